@@ -11,11 +11,28 @@ const API = axios.create({
 //  headers: { 'Content-Type': 'application/json' },
 //});
 
-/** Upload a Base64 image to the backend, which stores it on GCS. */
+async function sha256Hex(blob: Blob): Promise<string | null> {
+  if (!globalThis.crypto?.subtle) return null;
+  const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+}
+
+/**
+ * Upload an image (data URL) to the backend as raw bytes; the backend streams it to GCS.
+ * The content hash lets the backend write straight to the final object and reject a corrupted body.
+ */
 export async function uploadImage(base64Str: string, filename: string = 'selfie.jpg') {
-  const { data } = await API.post<{ gcs_uri: string; public_url: string }>(
-    '/api/v1/upload',
-    { image_base64: base64Str, filename },
+  const blob = await (await fetch(base64Str)).blob();
+  const digest = await sha256Hex(blob);
+  const { data } = await API.post<{ gcs_uri: string; public_url: string; deduplicated?: boolean }>(
+    `/api/v1/upload/stream?filename=${encodeURIComponent(filename)}`,
+    blob,
+    {
+      headers: {
+        'Content-Type': blob.type || 'application/octet-stream',
+        ...(digest ? { 'X-Content-SHA256': digest } : {}),
+      },
+    },
   );
   return data;
 }
@@ -0,0 +1,123 @@
+import asyncio
+import hmac
+import logging
+from typing import Literal
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
+from app.core.config import settings
+from app.utils import loop_monitor
+from app.utils.profiling import PROFILER, ProfilerBusyError, ProfileSession
+from app.utils.storage import StorageClient
+
+logger = logging.getLogger(__name__)
+
+def require_admin(authorization: str | None = Header(None)) -> None:
+    """
+    Bearer-token check against ADMIN_API_TOKEN. The admin API is hidden when no token is configured.
+    """
+    if not settings.ADMIN_API_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip(), settings.ADMIN_API_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid admin token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+def get_storage_client():
+    return StorageClient()
+
+class StartProfileRequest(BaseModel):
+    mode: Literal["sampling", "cprofile"] = "sampling"
+    scope: Literal["time", "requests", "jobs"] = "time"
+    duration_seconds: float = Field(30.0, gt=0)
+    count: int = Field(1, ge=1, description="Requests or jobs to profile (ignored for scope=time)")
+    interval_ms: float = Field(10.0, ge=1.0, le=1000.0, description="Sampling interval")
+    include_idle: bool = False
+
+def _get_session(profile_id: str) -> ProfileSession:
+    session = PROFILER.get(profile_id)
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found.")
+    return session
+
+def _finished_session(profile_id: str) -> ProfileSession:
+    session = _get_session(profile_id)
+    if session.status == "running":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Profile is still running.")
+    if not session.output:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile produced no output.")
+    return session
+
+@router.post("/profiles", status_code=status.HTTP_202_ACCEPTED)
+async def start_profile(request: StartProfileRequest):
+    """
+    Start a time-bounded sampling or cProfile session, optionally ending after the next N requests or jobs.
+    cProfile covers the event loop thread only; image processing runs in worker threads and shows up in sampling profiles.
+    """
+    duration = min(request.duration_seconds, settings.PROFILE_MAX_DURATION_SECONDS)
+    try:
+        session = PROFILER.start(
+            mode=request.mode,
+            scope=request.scope,
+            duration_seconds=duration,
+            target_count=request.count,
+            interval_ms=request.interval_ms,
+            include_idle=request.include_idle,
+        )
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return session.summary()
+
+@router.get("/profiles")
+async def list_profiles():
+    return {"profiles": [session.summary() for session in reversed(PROFILER.sessions.values())]}
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    return _get_session(profile_id).summary()
+
+@router.post("/profiles/{profile_id}/stop")
+async def stop_profile(profile_id: str):
+    session = _get_session(profile_id)
+    if PROFILER.active is session:
+        PROFILER.stop("stopped by admin")
+    return session.summary()
+
+@router.get("/profiles/{profile_id}/download")
+async def download_profile(profile_id: str):
+    """
+    Folded stacks for sampling profiles, a pstats file for cProfile profiles.
+    """
+    session = _finished_session(profile_id)
+    return Response(
+        content=session.output,
+        media_type=session.content_type,
+        headers={"Content-Disposition": f"attachment; filename={session.filename}"},
+    )
+
+@router.post("/profiles/{profile_id}/store")
+async def store_profile(profile_id: str, storage_client: StorageClient = Depends(get_storage_client)):
+    """
+    Copy a finished profile to GCS so it outlives the instance.
+    """
+    session = _finished_session(profile_id)
+    blob_name = f"admin/profiles/{session.filename}"
+    try:
+        await asyncio.to_thread(storage_client.upload_bytes, session.output, blob_name, session.content_type)
+        url = await asyncio.to_thread(storage_client.generate_signed_url, blob_name)
+    except Exception as e:
+        logger.error(f"Failed to store profile {profile_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to store profile")
+    return {"blob_name": blob_name, "url": url}
+
+@router.get("/loop-lag")
+async def get_loop_lag():
+    monitor = loop_monitor.get_monitor()
+    if monitor is None:
+        return {"enabled": False}
+    return {"enabled": True, **monitor.snapshot()}
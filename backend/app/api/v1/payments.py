@@ -1,7 +1,12 @@
+import asyncio
+import json
 import logging
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from app.core.config import settings
 from app.services.payment_service import PaymentService
+from app.services.payment_status import TERMINAL_PAYMENT_STATUSES, get_payment_status_hub
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -47,3 +52,64 @@ async def get_payment_status(
     except Exception as e:
         logger.error(f"Failed to get payment status: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to fetch payment status")
+
+
+def _sse_event(data: dict) -> str:
+    return f"event: status\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@router.get("/status/stream")
+async def stream_payment_status(
+    charge_id: str = Query(..., min_length=3),
+    payment_service: PaymentService = Depends(get_payment_service),
+) -> StreamingResponse:
+    """
+    Server-sent events for one payment: the current status straight away, then
+    every change until it reaches a final status (success, failed, expired).
+    Replaces polling GET /status while the QR code is shown.
+    """
+    hub = get_payment_status_hub()
+    # Subscribe before reading, so a change between the read and the first wait is not missed
+    changed = await hub.subscribe(charge_id)
+    try:
+        current = await payment_service.get_payment_status(charge_id)
+    except ValueError as ve:
+        hub.unsubscribe(charge_id, changed)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(ve))
+    except Exception as e:
+        hub.unsubscribe(charge_id, changed)
+        logger.error(f"Failed to get payment status: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to fetch payment status")
+
+    async def events():
+        nonlocal current
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.PAYMENT_STATUS_STREAM_SECONDS
+        try:
+            yield _sse_event(current)
+            while current["status"] not in TERMINAL_PAYMENT_STATUSES and loop.time() < deadline:
+                listening = hub.is_listening(charge_id)
+                timeout = settings.PAYMENT_STATUS_HEARTBEAT_SECONDS if listening else settings.PAYMENT_STATUS_POLL_SECONDS
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=min(timeout, max(0.0, deadline - loop.time())))
+                except asyncio.TimeoutError:
+                    if listening:
+                        yield ": keep-alive\n\n"
+                        continue
+                changed.clear()
+                try:
+                    latest = await payment_service.get_payment_status(charge_id)
+                except Exception as e:
+                    logger.warning(f"Failed to refresh payment status for {charge_id}: {e}")
+                    continue
+                if latest != current:
+                    current = latest
+                    yield _sse_event(current)
+        finally:
+            hub.unsubscribe(charge_id, changed)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,200 +1,87 @@
-import uuid
 import logging
-import asyncio
-import time
-from datetime import datetime, timezone
-from io import BytesIO
-import zipfile
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, RedirectResponse
 from pydantic import BaseModel
 from app.models.sticker import StickerGenerateRequest
 from app.services.user_service import UserService
-from app.services.ai_service import AIService
-from app.services.image_service import ImageProcessor
+from app.services.archive_service import ArchiveService
+from app.services.job_queue import JobQueue
+from app.services.generation_service import cancel_job, get_jobs_collection, submit_job
+from app.services.scheduling import tier_for_user
 from app.utils.storage import StorageClient
-from app.utils.firestore import get_db
-from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-GENERATION_SEMAPHORE = asyncio.Semaphore(max(1, settings.GENERATION_CONCURRENCY))
-USER_COOLDOWN: dict[str, float] = {}
-USER_COOLDOWN_LOCK = asyncio.Lock()
-
 def get_user_service():
     return UserService()
 
-def get_ai_service():
-    return AIService()
-
-def get_image_processor():
-    return ImageProcessor()
-
 def get_storage_client():
     return StorageClient()
 
-class ResetStickerSetRequest(BaseModel):
-    user_id: str
-
-def _sanitize_locked_indices(indices: list[int]) -> set[int]:
-    return {idx for idx in indices if isinstance(idx, int) and 0 <= idx < 16}
-
-def _utc_now():
-    return datetime.now(timezone.utc)
-
-def _get_jobs_collection():
-    return get_db().collection("jobs")
-
-async def _apply_user_cooldown(user_id: str) -> None:
-    cooldown = max(0, settings.GENERATION_COOLDOWN_SECONDS)
-    if cooldown == 0:
-        return
-    async with USER_COOLDOWN_LOCK:
-        now = time.monotonic()
-        next_allowed = USER_COOLDOWN.get(user_id, now)
-        wait_seconds = max(0, next_allowed - now)
-        USER_COOLDOWN[user_id] = max(next_allowed, now) + cooldown
-    if wait_seconds > 0:
-        await asyncio.sleep(wait_seconds)
-
-async def _update_job(job_id: str, data: dict) -> None:
-    job_ref = _get_jobs_collection().document(job_id)
-    data["updated_at"] = _utc_now()
-    await job_ref.update(data)
-
-async def _process_job(
-    job_id: str,
-    request: StickerGenerateRequest,
-    user_service: UserService,
-    ai_service: AIService,
-    image_processor: ImageProcessor,
-    storage_client: StorageClient,
-) -> None:
-    try:
-        await _update_job(job_id, {"status": "queued"})
-        await _apply_user_cooldown(request.user_id)
-
-        async with GENERATION_SEMAPHORE:
-            await _update_job(job_id, {"status": "processing"})
-
-            grid_bytes = await ai_service.generate_sticker_grid(
-                image_uri=request.image_uri,
-                style_id=request.style,
-                extra_prompt=request.prompt,
-            )
+def get_archive_service(storage_client: StorageClient = Depends(get_storage_client)):
+    return ArchiveService(storage_client)
 
-            # Store raw grid output for debugging / QA
-            grid_blob = f"users/{request.user_id}/jobs/{job_id}/grid.png"
-            storage_client.upload_file(
-                file_bytes=grid_bytes,
-                destination_blob_name=grid_blob,
-                content_type="image/png",
-            )
-            await _update_job(job_id, {"grid_blob": grid_blob})
+def get_job_queue():
+    return JobQueue()
 
-            sticker_images = image_processor.process_sticker_grid(grid_bytes)
-
-            output_urls: list[str] = []
-            output_blobs: list[str] = []
-
-            for i, sticker_bytes in enumerate(sticker_images):
-                blob_name = f"users/{request.user_id}/jobs/{job_id}/{i}.png"
-                url = storage_client.upload_file(
-                    file_bytes=sticker_bytes,
-                    destination_blob_name=blob_name,
-                    content_type="image/png"
-                )
-                output_urls.append(url)
-                output_blobs.append(blob_name)
-
-            locked_indices = _sanitize_locked_indices(request.locked_indices)
-            existing_slots, _ = await user_service.get_current_stickers(request.user_id)
-            existing_map: dict[int, dict] = {}
-            for slot in existing_slots:
-                if not isinstance(slot, dict):
-                    continue
-                idx = slot.get("index")
-                if isinstance(idx, int) and 0 <= idx < 16:
-                    existing_map[idx] = slot
-
-            result_slots = []
-            persisted_slots = []
-            for index in range(16):
-                use_existing = index in locked_indices and index in existing_map
-                if use_existing:
-                    existing_blob = existing_map[index].get("blob_name")
-                    if existing_blob:
-                        url = storage_client.generate_signed_url(existing_blob)
-                        blob_name = existing_blob
-                    else:
-                        url = output_urls[index]
-                        blob_name = output_blobs[index]
-                        use_existing = False
-                else:
-                    url = output_urls[index]
-                    blob_name = output_blobs[index]
-
-                locked = index in locked_indices if use_existing or locked_indices else False
-                result_slots.append({"index": index, "url": url, "locked": locked})
-                persisted_slots.append({"index": index, "blob_name": blob_name, "locked": locked})
+class ResetStickerSetRequest(BaseModel):
+    user_id: str
 
-            await user_service.set_current_stickers(request.user_id, persisted_slots, job_id)
-            await _update_job(job_id, {"status": "completed", "result_slots": persisted_slots})
+class CancelJobRequest(BaseModel):
+    user_id: str
 
-    except Exception as e:
-        logger.error(f"Sticker generation failed for {request.user_id}. Rolling back coin deduction. Error: {e}")
+def _slot_archive_entries(slots: list) -> list[tuple[str, str]]:
+    """
+    Map persisted sticker slots to (filename, blob_name) ZIP entries ordered by index.
+    """
+    def extract_index(slot: dict) -> int:
         try:
-            await user_service.refund_coin(request.user_id, amount=1)
-        except Exception as refund_error:
-            logger.error(f"CRITICAL: Failed to refund {request.user_id}: {refund_error}")
+            return int(slot.get("index", 9999))
+        except Exception:
+            return 9999
 
-        await _update_job(job_id, {"status": "failed", "error": str(e)})
+    slots_sorted = sorted([s for s in slots if isinstance(s, dict)], key=extract_index)
+    return [
+        (f"{extract_index(slot)}.png", slot["blob_name"])
+        for slot in slots_sorted
+        if slot.get("blob_name")
+    ]
 
 @router.post("/generate", status_code=status.HTTP_201_CREATED)
 async def generate_stickers(
     request: StickerGenerateRequest,
     user_service: UserService = Depends(get_user_service),
-    ai_service: AIService = Depends(get_ai_service),
-    image_processor: ImageProcessor = Depends(get_image_processor),
-    storage_client: StorageClient = Depends(get_storage_client)
+    job_queue: JobQueue = Depends(get_job_queue),
 ):
     """
     Main orchestration endpoint for generating Stickers.
+    Only charges the coin and enqueues the job; a generation worker does the work.
     """
     user_id = request.user_id
     
     # 1. Deduct 1 Coin from User atomically
     try:
-        await user_service.deduct_coin(user_id, amount=1)
+        charge = await user_service.deduct_coin_for_job(user_id, amount=1)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-        
-    job_id = str(uuid.uuid4())
-    job_ref = _get_jobs_collection().document(job_id)
-    await job_ref.set({
-        "job_id": job_id,
-        "user_id": user_id,
-        "status": "queued",
-        "created_at": _utc_now(),
-        "updated_at": _utc_now(),
-    })
 
-    asyncio.create_task(
-        _process_job(
-            job_id=job_id,
-            request=request,
-            user_service=user_service,
-            ai_service=ai_service,
-            image_processor=image_processor,
-            storage_client=storage_client,
-        )
-    )
+    # 2. Hand the job to the worker queue, prioritised by what the user has spent
+    tier = tier_for_user(charge["total_spent_thb"])
+    try:
+        job_id = await submit_job(request, job_queue, tier=tier)
+    except Exception as e:
+        logger.error(f"Failed to enqueue generation for {user_id}. Rolling back coin deduction. Error: {e}")
+        try:
+            await user_service.refund_coin(user_id, amount=1)
+        except Exception as refund_error:
+            logger.error(f"CRITICAL: Failed to refund {user_id}: {refund_error}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to queue sticker generation.")
 
     return {
         "job_id": job_id,
         "status": "queued",
+        "tier": tier,
     }
 
 @router.get("/current")
@@ -246,45 +133,36 @@ async def reset_current_stickers(
 async def download_current_sticker_zip(
     user_id: str = Query(..., min_length=3),
     user_service: UserService = Depends(get_user_service),
-    storage_client: StorageClient = Depends(get_storage_client),
+    archive_service: ArchiveService = Depends(get_archive_service),
 ):
     """
     Download the latest merged sticker set for a user as a ZIP file.
+    Redirects to the pre-built archive when one exists.
     """
-    slots, _ = await user_service.get_current_stickers(user_id)
+    sticker_set = await user_service.get_current_sticker_set(user_id)
+    slots = sticker_set["slots"]
     if not slots:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No stickers found for this user.")
 
-    def extract_index(slot: dict) -> int:
-        try:
-            return int(slot.get("index", 9999))
-        except Exception:
-            return 9999
-
-    slots_sorted = sorted([s for s in slots if isinstance(s, dict)], key=extract_index)
+    if sticker_set["archive_blob"]:
+        url = archive_service.signed_archive_url(sticker_set["archive_blob"], "stickers.zip")
+        return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
 
-    buffer = BytesIO()
-    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
-        for slot in slots_sorted:
-            blob_name = slot.get("blob_name")
-            if not blob_name:
-                continue
-            filename = f"{extract_index(slot)}.png"
-            blob = storage_client.bucket.blob(blob_name)
-            archive.writestr(filename, blob.download_as_bytes())
+    entries = _slot_archive_entries(slots)
 
-    buffer.seek(0)
     headers = {
         "Content-Disposition": "attachment; filename=stickers.zip"
     }
-    return StreamingResponse(buffer, media_type="application/zip", headers=headers)
+    return StreamingResponse(archive_service.stream_archive(entries), media_type="application/zip", headers=headers)
 
 @router.get("/{job_id}")
 async def get_job_status(
     job_id: str,
     storage_client: StorageClient = Depends(get_storage_client),
+    job_queue: JobQueue = Depends(get_job_queue),
+    user_service: UserService = Depends(get_user_service),
 ):
-    job_ref = _get_jobs_collection().document(job_id)
+    job_ref = get_jobs_collection().document(job_id)
     snapshot = await job_ref.get()
     if not snapshot.exists:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found.")
@@ -293,6 +171,9 @@ async def get_job_status(
     status_value = data.get("status")
 
     if status_value == "completed":
+        if data.get("user_id"):
+            # The worker that wrote the new set may be another process; don't let /current serve the old one
+            user_service.forget_current_sticker_set(data["user_id"])
         result_slots = []
         for slot in data.get("result_slots", []) or []:
             if not isinstance(slot, dict):
@@ -312,49 +193,69 @@ async def get_job_status(
             response["grid_url"] = storage_client.generate_signed_url(data["grid_blob"])
         return response
 
-    if status_value == "failed":
-        response = {"status": "failed", "job_id": job_id, "error": data.get("error", "Unknown error")}
+    if status_value in ("failed", "cancelled", "timed_out"):
+        response = {"status": status_value, "job_id": job_id, "error": data.get("error", "Unknown error")}
         if data.get("grid_blob"):
             response["grid_url"] = storage_client.generate_signed_url(data["grid_blob"])
         return response
 
     response = {"status": status_value or "queued", "job_id": job_id}
+    if data.get("cancel_requested"):
+        response["cancel_requested"] = True
+    if data.get("queue_reason"):
+        response["queue_reason"] = data["queue_reason"]
+        response["estimated_wait_seconds"] = data.get("estimated_wait_seconds")
+    elif (status_value or "queued") == "queued":
+        # Still waiting in the shared queue: report where the scheduler would start it
+        position = await job_queue.position(job_id)
+        if position is not None:
+            response.update(position)
     if data.get("grid_blob"):
         response["grid_url"] = storage_client.generate_signed_url(data["grid_blob"])
     return response
 
+@router.post("/{job_id}/cancel")
+async def cancel_generation_job(
+    job_id: str,
+    request: CancelJobRequest,
+    job_queue: JobQueue = Depends(get_job_queue),
+):
+    """
+    Cancel a queued or running job. The coin is refunded once the job has stopped:
+    immediately if it had not started yet, otherwise by the worker running it.
+    """
+    result = await cancel_job(job_id, request.user_id, job_queue)
+    if result is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Job not found or already finished.")
+    return {"job_id": job_id, "status": result}
+
 @router.get("/{job_id}/download")
 async def download_sticker_zip(
     job_id: str,
     user_id: str = Query(..., min_length=3),
-    storage_client: StorageClient = Depends(get_storage_client),
+    archive_service: ArchiveService = Depends(get_archive_service),
 ):
     """
     Download all 16 stickers for a job as a ZIP file.
+    Uses the blob names recorded on the job document instead of listing the bucket.
     """
-    prefix = f"users/{user_id}/jobs/{job_id}/"
-    blobs = storage_client.list_blobs(prefix=prefix)
-    if not blobs:
+    snapshot = await get_jobs_collection().document(job_id).get()
+    data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+    if data.get("user_id") != user_id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No stickers found for this job.")
+    # Superseded sets are removed by script/gc_artifacts.py; what is left would be an incomplete ZIP
+    if data.get("artifacts_deleted_at"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stickers for this job are no longer available.")
 
-    def extract_index(blob_name: str) -> int:
-        filename = blob_name.rsplit("/", 1)[-1]
-        stem = filename.split(".")[0]
-        try:
-            return int(stem)
-        except ValueError:
-            return 9999
-
-    blobs_sorted = sorted(blobs, key=lambda b: extract_index(b.name))
+    if data.get("archive_blob"):
+        url = archive_service.signed_archive_url(data["archive_blob"], f"stickers_{job_id}.zip")
+        return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
 
-    buffer = BytesIO()
-    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
-        for blob in blobs_sorted:
-            filename = blob.name.rsplit("/", 1)[-1]
-            archive.writestr(filename, blob.download_as_bytes())
+    entries = _slot_archive_entries(data.get("result_slots") or [])
+    if not entries:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No stickers found for this job.")
 
-    buffer.seek(0)
     headers = {
         "Content-Disposition": f"attachment; filename=stickers_{job_id}.zip"
     }
-    return StreamingResponse(buffer, media_type="application/zip", headers=headers)
+    return StreamingResponse(archive_service.stream_archive(entries), media_type="application/zip", headers=headers)
@@ -1,15 +1,22 @@
+import asyncio
 import base64
+import hashlib
 import uuid
 import logging
 import re
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Header, Query, Request
 from pydantic import BaseModel
+from app.services.image_service import ImageProcessor
 from app.utils.storage import StorageClient
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+GCS_UPLOAD_CHUNK_ALIGNMENT = 256 * 1024
+MAGIC_BYTES_LENGTH = 12
+SHA256_HEX_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
 
 class UploadRequest(BaseModel):
     image_base64: str
@@ -20,6 +27,10 @@ def get_storage_client():
     return StorageClient()
 
 
+def get_image_processor():
+    return ImageProcessor()
+
+
 def _decode_base64_image(data: str) -> bytes:
     """
     Decode a Base64 string, stripping the optional
@@ -39,53 +50,269 @@ def _decode_base64_image(data: str) -> bytes:
         )
 
 
+def _sniff_image_content_type(head: bytes) -> str | None:
+    """
+    Return the content type for JPEG/PNG/WEBP magic bytes, or None.
+    """
+    if head[:2] == b'\xff\xd8':
+        return "image/jpeg"
+    if head[:4] == b'\x89PNG':
+        return "image/png"
+    if head[:4] == b'RIFF':
+        return "image/webp"
+    return None
+
+
+def _invalid_image_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Uploaded data does not appear to be a valid image (JPEG/PNG/WEBP)"
+    )
+
+
+def _too_large_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Image exceeds the {settings.UPLOAD_MAX_BYTES} byte upload limit"
+    )
+
+
+def _upload_blob_name(digest: str) -> str:
+    """
+    Uploads are content-addressed: identical bytes always map to the same blob.
+    """
+    return f"temp/uploads/{digest}/original"
+
+
+def _normalized_blob_name(blob_name: str) -> str:
+    return f"{blob_name.rsplit('/', 1)[0]}/normalized.jpg"
+
+
+async def _store_normalized_rendition(
+    storage_client: StorageClient,
+    image_processor: ImageProcessor,
+    blob_name: str,
+    image_bytes: bytes | None = None,
+) -> str | None:
+    """
+    Store an oriented, downscaled JPEG next to the original upload and return its blob name.
+    Returns None when normalization is disabled or fails, so callers keep the original.
+    """
+    if not settings.SELFIE_NORMALIZE:
+        return None
+    normalized_blob = _normalized_blob_name(blob_name)
+    try:
+        if image_bytes is None:
+            image_bytes = await asyncio.to_thread(storage_client.download_bytes, blob_name)
+        normalized_bytes = await asyncio.to_thread(
+            image_processor.normalize_selfie,
+            image_bytes,
+            settings.SELFIE_MAX_DIMENSION,
+            settings.SELFIE_JPEG_QUALITY,
+        )
+        await asyncio.to_thread(storage_client.upload_bytes, normalized_bytes, normalized_blob, "image/jpeg")
+        logger.info(f"Normalized {blob_name}: {len(image_bytes)} -> {len(normalized_bytes)} bytes")
+        return normalized_blob
+    except Exception as e:
+        logger.warning(f"Selfie normalization failed for {blob_name}, using original: {e}")
+        return None
+
+
+def _upload_response(blob_name: str, normalized_blob: str | None, public_url: str, deduplicated: bool = False) -> dict:
+    """
+    gcs_uri points at the rendition generation should use; the original is kept alongside.
+    """
+    original_uri = f"gs://{settings.GCS_BUCKET_NAME}/{blob_name}"
+    gcs_uri = f"gs://{settings.GCS_BUCKET_NAME}/{normalized_blob}" if normalized_blob else original_uri
+    return {
+        "gcs_uri": gcs_uri,
+        "original_gcs_uri": original_uri,
+        "public_url": public_url,
+        "deduplicated": deduplicated
+    }
+
+
+async def _existing_upload_response(
+    storage_client: StorageClient,
+    image_processor: ImageProcessor,
+    digest: str,
+) -> dict | None:
+    """
+    Return the upload response for content that is already stored, or None.
+    The normalized rendition is written after the original, so when it exists
+    a single existence check covers both.
+    """
+    blob_name = _upload_blob_name(digest)
+    normalized_blob = _normalized_blob_name(blob_name) if settings.SELFIE_NORMALIZE else None
+
+    if not (normalized_blob and await asyncio.to_thread(storage_client.blob_exists, normalized_blob)):
+        if not await asyncio.to_thread(storage_client.blob_exists, blob_name):
+            return None
+        # Original stored but never normalized (disabled at the time, or it failed)
+        normalized_blob = await _store_normalized_rendition(storage_client, image_processor, blob_name)
+
+    # Reuse does not change the objects, so mark them used or the upload GC may delete them before generation
+    for reused_blob in filter(None, (blob_name, normalized_blob)):
+        try:
+            await asyncio.to_thread(storage_client.touch_blob, reused_blob)
+        except Exception as e:
+            logger.warning(f"Failed to refresh custom time of {reused_blob}: {e}")
+
+    public_url = await asyncio.to_thread(storage_client.generate_signed_url, blob_name)
+    logger.info(f"Reusing existing upload {blob_name}")
+    return _upload_response(blob_name, normalized_blob, public_url, deduplicated=True)
+
+
 @router.post("/upload")
 async def upload_image(
     request: UploadRequest,
-    storage_client: StorageClient = Depends(get_storage_client)
+    storage_client: StorageClient = Depends(get_storage_client),
+    image_processor: ImageProcessor = Depends(get_image_processor)
 ):
     """
     Accept a Base64-encoded image, upload it to GCS,
     and return the gs:// URI and a signed public URL.
+    Identical images resolve to the already stored object.
     """
     image_bytes = _decode_base64_image(request.image_base64)
+    if len(image_bytes) > settings.UPLOAD_MAX_BYTES:
+        raise _too_large_error()
 
     # Basic validation: check for common image magic bytes
-    if not (
-        image_bytes[:2] == b'\xff\xd8'       # JPEG
-        or image_bytes[:4] == b'\x89PNG'      # PNG
-        or image_bytes[:4] == b'RIFF'         # WEBP
-    ):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Uploaded data does not appear to be a valid image (JPEG/PNG/WEBP)"
-        )
-
-    # Build a unique GCS path
-    unique_id = str(uuid.uuid4())
-    blob_name = f"temp/uploads/{unique_id}/{request.filename}"
+    content_type = _sniff_image_content_type(image_bytes)
+    if content_type is None:
+        raise _invalid_image_error()
 
-    # Determine content type from filename extension
-    ext = request.filename.rsplit(".", 1)[-1].lower() if "." in request.filename else "jpeg"
-    content_type_map = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
-    content_type = content_type_map.get(ext, "image/jpeg")
+    digest = hashlib.sha256(image_bytes).hexdigest()
 
     try:
+        existing = await _existing_upload_response(storage_client, image_processor, digest)
+        if existing:
+            return existing
+
+        blob_name = _upload_blob_name(digest)
         public_url = storage_client.upload_file(
             file_bytes=image_bytes,
             destination_blob_name=blob_name,
             content_type=content_type
         )
 
-        gcs_uri = f"gs://{settings.GCS_BUCKET_NAME}/{blob_name}"
-
-        return {
-            "gcs_uri": gcs_uri,
-            "public_url": public_url
-        }
+        normalized_blob = await _store_normalized_rendition(
+            storage_client, image_processor, blob_name, image_bytes
+        )
+        return _upload_response(blob_name, normalized_blob, public_url)
     except Exception as e:
         logger.error(f"Failed to upload image: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to upload image to storage"
         )
+
+
+@router.post("/upload/stream")
+async def upload_image_stream(
+    request: Request,
+    filename: str = Query("selfie.jpg", min_length=1),
+    x_content_sha256: str | None = Header(None),
+    storage_client: StorageClient = Depends(get_storage_client),
+    image_processor: ImageProcessor = Depends(get_image_processor)
+):
+    """
+    Accept raw image bytes as the request body and stream them into a
+    GCS resumable upload. Memory use is bounded by the upload chunk size,
+    not by the image size.
+
+    The body is hashed while streaming and, for known content, the resumable
+    upload is cancelled before it is finalized. Stored content is only
+    returned for a body that was read and hashed here, never for a digest
+    the client merely claims. Clients may send the SHA-256 of the body in
+    X-Content-SHA256; the upload then goes straight to its final name and
+    is rejected if the body does not match.
+    """
+    claimed_digest = (x_content_sha256 or "").strip().lower() or None
+    if claimed_digest and not SHA256_HEX_PATTERN.match(claimed_digest):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid X-Content-SHA256 header")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.UPLOAD_MAX_BYTES:
+        raise _too_large_error()
+
+    chunk_size = max(1, -(-settings.UPLOAD_CHUNK_SIZE // GCS_UPLOAD_CHUNK_ALIGNMENT)) * GCS_UPLOAD_CHUNK_ALIGNMENT
+    # With a claimed digest we can write straight to the final name; otherwise stage first
+    blob_name = _upload_blob_name(claimed_digest) if claimed_digest else f"temp/uploads/staging/{uuid.uuid4()}"
+    hasher = hashlib.sha256()
+    writer = None
+    pending = bytearray()
+    total = 0
+
+    async def open_writer():
+        content_type = _sniff_image_content_type(bytes(pending[:MAGIC_BYTES_LENGTH]))
+        if content_type is None:
+            raise _invalid_image_error()
+        return await asyncio.to_thread(storage_client.open_upload_stream, blob_name, content_type, chunk_size)
+
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            total += len(chunk)
+            if total > settings.UPLOAD_MAX_BYTES:
+                raise _too_large_error()
+            hasher.update(chunk)
+            pending.extend(chunk)
+
+            if writer is None:
+                # Wait for enough bytes to validate the magic bytes before opening the upload
+                if len(pending) < MAGIC_BYTES_LENGTH:
+                    continue
+                writer = await open_writer()
+
+            if len(pending) >= chunk_size:
+                await asyncio.to_thread(writer.write, bytes(pending))
+                pending.clear()
+
+        if writer is None:
+            writer = await open_writer()
+
+        digest = hasher.hexdigest()
+        if claimed_digest and digest != claimed_digest:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="X-Content-SHA256 does not match body")
+
+        existing = await _existing_upload_response(storage_client, image_processor, digest)
+        if existing:
+            # The last chunk has not been sent, so no object is created or overwritten
+            await asyncio.to_thread(writer.terminate)
+            return existing
+
+        if pending:
+            await asyncio.to_thread(writer.write, bytes(pending))
+            pending.clear()
+        await asyncio.to_thread(writer.close)
+
+        if not claimed_digest:
+            staging_blob = blob_name
+            blob_name = _upload_blob_name(digest)
+            await asyncio.to_thread(storage_client.copy_blob, staging_blob, blob_name)
+            await asyncio.to_thread(storage_client.delete_blob, staging_blob)
+
+        public_url = await asyncio.to_thread(storage_client.generate_signed_url, blob_name)
+        logger.info(f"Streamed upload {filename} to {blob_name} ({total} bytes)")
+    except HTTPException:
+        if writer is not None and not writer.closed:
+            await asyncio.to_thread(writer.terminate)
+        raise
+    except Exception as e:
+        logger.error(f"Failed to stream image upload: {e}")
+        if writer is not None and not writer.closed:
+            try:
+                await asyncio.to_thread(writer.terminate)
+            except Exception:
+                pass
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to upload image to storage"
+        )
+
+    # The original was streamed without being held in memory, so normalization reads it back
+    normalized_blob = await _store_normalized_rendition(storage_client, image_processor, blob_name)
+    return _upload_response(blob_name, normalized_blob, public_url)
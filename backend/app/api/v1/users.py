@@ -18,16 +18,14 @@ async def get_user_permissions(
     Business Logic: total_spent_thb >= 30.
     """
     try:
-        user_ref = user_service.users_collection.document(user_id)
-        user_doc = await user_ref.get()
+        user_data = await user_service.get_user(user_id)
 
-        if not user_doc.exists:
+        if user_data is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"User {user_id} not found"
             )
 
-        user_data = user_doc.to_dict()
         current_spent = user_data.get("total_spent_thb", 0.0)
         
         required_spent = 30.0
@@ -1,5 +1,4 @@
 import logging
-import json
 from fastapi import APIRouter, Request, Header, HTTPException, status, Depends
 from app.services.payment_service import PaymentService
 
@@ -17,7 +16,8 @@ async def omise_webhook(
 ):
     """
     Omise Webhook Handler.
-    Listens for 'charge.complete' events.
+    Listens for 'charge.complete' events. The event is recorded and acknowledged;
+    PaymentEventWorker credits the coins in the background.
     """
     if not x_omise_signature:
         raise HTTPException(
@@ -28,16 +28,14 @@ async def omise_webhook(
     try:
         # We need the raw body bytes to verify the HMAC signature correctly
         raw_body = await request.body()
-        payload = await request.json()
         
-        await payment_service.process_webhook(
-            payload=payload, 
+        result = await payment_service.process_webhook(
             signature=x_omise_signature, 
             raw_payload=raw_body
         )
         
-        # Must return 200 OK fast so Omise doesn't retry
-        return {"status": "success"}
+        # Must return 200 OK fast so Omise doesn't retry; duplicates are acknowledged too
+        return {"status": "success", "event": result}
         
     except ValueError as ve:
         logger.warning(f"Webhook processing validation error: {ve}")
@@ -21,6 +21,68 @@ class Settings(BaseSettings):
     GENERATION_COOLDOWN_SECONDS: int = 30
     GENERATION_MAX_RETRIES: int = 8
     GENERATION_RETRY_BASE_DELAY: float = 5.0
+    ARCHIVE_PREFETCH_CONCURRENCY: int = 4
+    UPLOAD_MAX_BYTES: int = 10 * 1024 * 1024
+    UPLOAD_CHUNK_SIZE: int = 256 * 1024
+    SELFIE_NORMALIZE: bool = True
+    SELFIE_MAX_DIMENSION: int = 1536
+    SELFIE_JPEG_QUALITY: int = 90
+    ADMIN_API_TOKEN: str | None = None
+    PROFILE_MAX_DURATION_SECONDS: int = 300
+    LOOP_LAG_MONITOR_ENABLED: bool = True
+    LOOP_LAG_INTERVAL_SECONDS: float = 0.25
+    LOOP_LAG_THRESHOLD_SECONDS: float = 0.2
+    REMBG_MODEL: str = "u2net"
+    # Comma-separated subset of firestore,storage,ai,matting; empty disables warm-up
+    WARMUP_COMPONENTS: str = "firestore,storage,ai,matting"
+    # Finish warm-up before the instance reports ready instead of in the background
+    WARMUP_BLOCKING: bool = False
+    # "all" runs the generation worker inside the API process (development);
+    # "api" only enqueues jobs, "worker" is set for the app.worker service
+    PROCESS_ROLE: str = "all"
+    WORKER_POLL_INTERVAL_SECONDS: float = 2.0
+    WORKER_LEASE_SECONDS: int = 120
+    GENERATION_MAX_ATTEMPTS: int = 3
+    # A job not finished this long after submission is stopped and refunded
+    GENERATION_JOB_TIMEOUT_SECONDS: int = 900
+    # How often a worker checks whether a job it is running was cancelled from another process
+    JOB_CANCEL_POLL_SECONDS: float = 2.0
+    # Memory generation jobs may reserve in one process; 0 derives it from the container limit
+    GENERATION_MEMORY_BUDGET_MB: int = 0
+    # Per-job matting model activations and fixed buffers, on top of the per-pixel estimate
+    GENERATION_JOB_OVERHEAD_MB: int = 192
+    # Jobs whose estimated wait for memory is longer than this are failed and refunded
+    GENERATION_ADMISSION_MAX_WAIT_SECONDS: float = 600
+    # Weighted fair queuing between scheduling tiers (share of job starts while all tiers have work)
+    PRIORITY_TIER_WEIGHTS: str = "premium:6,paid:3,free:1"
+    PRIORITY_PREMIUM_MIN_SPENT_THB: float = 300.0
+    # Anti-starvation: a job queued this long starts next whatever its tier
+    PRIORITY_MAX_WAIT_SECONDS: float = 300
+    # Queue entries scanned per claim / queue-position lookup
+    GENERATION_QUEUE_SCAN_LIMIT: int = 200
+    QUEUE_STATUS_CACHE_SECONDS: float = 2.0
+    # Per-instance cache of user documents; 0 disables it
+    USER_CACHE_TTL_SECONDS: float = 15.0
+    USER_CACHE_MAX_ENTRIES: int = 10000
+    # Firestore listener that drops entries written by other instances before they expire
+    USER_CACHE_LISTENER_ENABLED: bool = False
+    # The listener's result set grows with every user written since it started; it restarts this often
+    USER_CACHE_LISTENER_RESTART_SECONDS: float = 600.0
+    # Login sync rewrites an unchanged profile only once its updated_at is this old
+    USER_SYNC_REFRESH_SECONDS: int = 86400
+    # Background application of recorded Omise webhooks (API processes)
+    PAYMENT_EVENT_POLL_SECONDS: float = 15.0
+    PAYMENT_EVENT_LEASE_SECONDS: int = 60
+    PAYMENT_EVENT_MAX_ATTEMPTS: int = 8
+    PAYMENT_EVENT_RETRY_BASE_SECONDS: float = 5.0
+    # Payment status: cache for final statuses, and the /payments/status/stream push channel
+    PAYMENT_STATUS_CACHE_SECONDS: float = 300.0
+    PAYMENT_STATUS_LISTENER_ENABLED: bool = True
+    # Streams poll Firestore at this interval only when the listener is unavailable
+    PAYMENT_STATUS_POLL_SECONDS: float = 5.0
+    PAYMENT_STATUS_HEARTBEAT_SECONDS: float = 15.0
+    # Matches the PromptPay QR lifetime; the page reconnects if it is still open
+    PAYMENT_STATUS_STREAM_SECONDS: float = 900.0
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+def _warm_firestore() -> None:
+    # Credential lookup blocks; the gRPC channel itself is only opened on the first call, on the event loop
+    from app.utils.firestore import get_db
+    get_db()
+
+def _warm_storage() -> None:
+    from app.utils.storage import StorageClient
+    StorageClient()
+
+def _warm_ai() -> None:
+    from app.services.ai_service import AIService
+    AIService()
+
+def _warm_matting() -> None:
+    from app.services.image_service import warm_up_matting
+    warm_up_matting()
+
+# Run in a worker thread: each step is blocking imports, credential lookup or model loading
+WARMUP_STEPS = {
+    "firestore": _warm_firestore,
+    "storage": _warm_storage,
+    "ai": _warm_ai,
+    "matting": _warm_matting,
+}
+
+# Only needed where generation runs; an API-only process skips them
+WORKER_COMPONENTS = {"ai", "matting"}
+
+def parse_components(value: str, role: str = "all") -> list[str]:
+    components = [component.strip().lower() for component in (value or "").split(",") if component.strip()]
+    unknown = [component for component in components if component not in WARMUP_STEPS]
+    if unknown:
+        logger.warning(f"Ignoring unknown warm-up components: {', '.join(unknown)}")
+    components = [component for component in components if component in WARMUP_STEPS]
+    if role == "api":
+        components = [component for component in components if component not in WORKER_COMPONENTS]
+    return components
+
+async def run_warmup(components: list[str]) -> dict[str, float]:
+    """
+    Load heavy dependencies in order, logging how long each took.
+    A failing step is logged and skipped; the dependency then loads on first use instead.
+    """
+    timings: dict[str, float] = {}
+    started = time.perf_counter()
+    for component in components:
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(WARMUP_STEPS[component])
+        except Exception as e:
+            logger.warning(f"Warm-up of {component} failed after {(time.perf_counter() - start) * 1000:.0f} ms: {e}")
+            continue
+        timings[component] = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f"Warm-up {component}: {timings[component]:.0f} ms")
+
+    logger.info(f"Warm-up finished in {(time.perf_counter() - started) * 1000:.0f} ms: {timings}")
+    return timings
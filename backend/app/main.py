@@ -1,10 +1,76 @@
-from fastapi import FastAPI
+import time
+_import_started = time.perf_counter()
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
+from app.api.v1.admin import require_admin
+from app.core import warmup
+from app.core.config import settings
+from app.services.generation_worker import GenerationWorker
+from app.services.payment_events import PaymentEventWorker
+from app.services.user_cache import UserCacheListener
+from app.utils import loop_monitor, metrics
+from app.utils.profiling import PROFILER
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup_started = time.perf_counter()
+    monitor = None
+    if settings.LOOP_LAG_MONITOR_ENABLED:
+        monitor = loop_monitor.start_monitor(
+            interval=settings.LOOP_LAG_INTERVAL_SECONDS,
+            threshold=settings.LOOP_LAG_THRESHOLD_SECONDS,
+        )
+
+    warmup_task = None
+    components = warmup.parse_components(settings.WARMUP_COMPONENTS, role=settings.PROCESS_ROLE)
+    if components:
+        if settings.WARMUP_BLOCKING:
+            await warmup.run_warmup(components)
+        else:
+            warmup_task = asyncio.create_task(warmup.run_warmup(components))
+    cache_listener = None
+    if settings.USER_CACHE_LISTENER_ENABLED:
+        # Other instances' writes to users then invalidate this instance's cache straight away
+        cache_listener = UserCacheListener()
+        await cache_listener.start()
+    worker = None
+    if settings.PROCESS_ROLE == "all":
+        # Single-process mode: run the generation worker alongside the API
+        worker = GenerationWorker()
+        worker.start()
+    # Credits coins for webhooks recorded by this or another API instance
+    payment_worker = PaymentEventWorker()
+    payment_worker.start()
+    logger.info(
+        f"Startup ({settings.PROCESS_ROLE} role): app import {IMPORT_SECONDS * 1000:.0f} ms, lifespan {(time.perf_counter() - startup_started) * 1000:.0f} ms, "
+        f"warm-up {'none' if not components else 'done' if settings.WARMUP_BLOCKING else 'running in background'}"
+    )
+
+    yield
+
+    if worker is not None:
+        await worker.stop()
+    await payment_worker.stop()
+    if cache_listener is not None:
+        cache_listener.stop()
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    PROFILER.stop("shutdown")
+    if monitor is not None:
+        await monitor.stop()
 
 app = FastAPI(
     title="StickerLine AI API",
     description="Backend API Gateway for StickerLine AI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Configure CORS (Should be restricted in production config to frontend domain)
@@ -20,12 +86,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _route_template(request: Request) -> str:
+    # Newer FastAPI releases keep included routes un-prefixed and record the full template separately
+    effective = (request.scope.get("fastapi") or {}).get("effective_route_context")
+    route = effective or request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Label by route template (e.g. /api/v1/jobs/{job_id}) to keep cardinality bounded
+        route_path = _route_template(request)
+        metrics.HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, request.method, route_path)
+        metrics.HTTP_REQUESTS_TOTAL.inc(request.method, route_path, str(status_code))
+        # Profiling the admin API or the scraper would only measure the profiler itself
+        if not route_path.startswith("/api/v1/admin") and route_path != "/metrics":
+            PROFILER.unit_finished("requests")
+
 @app.get("/")
 async def root():
     """Health check endpoint for Cloud Run."""
     return {"status": "ok", "service": "stickerline-api"}
 
-from app.api.v1 import auth, stickers, webhooks, users, upload, payments
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_admin)])
+async def prometheus_metrics():
+    """Prometheus scrape endpoint. Scrapers send the ADMIN_API_TOKEN bearer token."""
+    metrics.GENERATION_CONCURRENCY_LIMIT.set(max(1, settings.GENERATION_CONCURRENCY))
+    return Response(content=metrics.render_metrics(), media_type=metrics.CONTENT_TYPE)
+
+from app.api.v1 import auth, stickers, webhooks, users, upload, payments, admin
 
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["auth"])
 app.include_router(users.router, prefix="/api/v1/users", tags=["users"])
@@ -33,3 +128,6 @@ app.include_router(stickers.router, prefix="/api/v1/jobs", tags=["jobs"])
 app.include_router(upload.router, prefix="/api/v1", tags=["upload"])
 app.include_router(payments.router, prefix="/api/v1/payments", tags=["payments"])
 app.include_router(webhooks.router, prefix="/webhooks", tags=["payment"])
+app.include_router(admin.router, prefix="/api/v1/admin", tags=["admin"], include_in_schema=False)
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
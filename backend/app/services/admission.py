@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Awaitable, Callable, Optional
+from app.core.config import settings
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Bytes held per grid pixel while the whole grid is in memory: the decoded BGR
+# image, the b/g/r splits and green/content masks built by edge detection
+GRID_BYTES_PER_PIXEL = 12
+# Bytes held per cell pixel while one cell is processed: rembg's RGBA output,
+# spill/cleanup copies, connected-component labels (int32) and the padded stroke buffers
+CELL_BYTES_PER_PIXEL = 48
+
+# Base side length for GEMINI_IMAGE_SIZE values
+IMAGE_SIZE_PIXELS = {"1K": 1024, "2K": 2048, "4K": 4096}
+
+# Share of the container memory limit given to generation jobs; the rest covers
+# the interpreter, model weights and API requests
+CONTAINER_BUDGET_RATIO = 0.7
+DEFAULT_BUDGET_BYTES = 2048 * MB
+
+CGROUP_LIMIT_FILES = (
+    "/sys/fs/cgroup/memory.max",
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+)
+
+class AdmissionRejected(Exception):
+    pass
+
+def estimate_job_bytes(width: int, height: int) -> int:
+    """
+    Estimate the peak memory of one generation job for a grid of the given size.
+    Cells are processed one at a time, so only one cell's buffers count.
+    """
+    grid_pixels = max(0, width) * max(0, height)
+    cell_pixels = grid_pixels / 16
+    overhead = settings.GENERATION_JOB_OVERHEAD_MB * MB
+    return int(grid_pixels * GRID_BYTES_PER_PIXEL + cell_pixels * CELL_BYTES_PER_PIXEL + overhead)
+
+def expected_grid_dimensions() -> tuple[int, int]:
+    """
+    Grid size the AI provider is asked for (GEMINI_IMAGE_SIZE / GEMINI_IMAGE_ASPECT_RATIO).
+    """
+    long_side = IMAGE_SIZE_PIXELS.get(settings.GEMINI_IMAGE_SIZE.upper(), IMAGE_SIZE_PIXELS["2K"])
+    try:
+        ratio_w, ratio_h = (float(part) for part in settings.GEMINI_IMAGE_ASPECT_RATIO.split(":"))
+    except ValueError:
+        ratio_w, ratio_h = 1.0, 1.0
+    if ratio_w >= ratio_h:
+        return long_side, int(long_side * ratio_h / ratio_w)
+    return int(long_side * ratio_w / ratio_h), long_side
+
+def grid_dimensions(image_bytes: bytes) -> Optional[tuple[int, int]]:
+    """
+    Read width and height from the image header without decoding the pixels.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(BytesIO(image_bytes)) as img:
+            return img.size
+    except Exception:
+        return None
+
+def _container_memory_limit() -> Optional[int]:
+    for path in CGROUP_LIMIT_FILES:
+        try:
+            with open(path) as limit_file:
+                value = limit_file.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return None
+
+def default_budget_bytes() -> int:
+    if settings.GENERATION_MEMORY_BUDGET_MB > 0:
+        return settings.GENERATION_MEMORY_BUDGET_MB * MB
+    limit = _container_memory_limit()
+    if limit is None:
+        return DEFAULT_BUDGET_BYTES
+    return int(limit * CONTAINER_BUDGET_RATIO)
+
+@dataclass
+class _Reservation:
+    nbytes: int
+    started_at: float
+
+class MemoryAdmissionController:
+    """
+    Admit generation jobs against a memory budget instead of a blind job count.
+
+    Each job reserves its estimated peak memory before it starts and releases
+    it when it finishes. Jobs that do not fit wait in FIFO order; the expected
+    wait is derived from how long reservations are usually held.
+    """
+    def __init__(self, budget_bytes: int, default_hold_seconds: float = 60.0):
+        self.budget_bytes = max(1, budget_bytes)
+        self._reservations: dict[str, _Reservation] = {}
+        self._waiters: deque[tuple[str, int, asyncio.Future]] = deque()
+        self._avg_hold_seconds = default_hold_seconds
+        metrics.GENERATION_MEMORY_BUDGET.set(self.budget_bytes)
+
+    @property
+    def reserved_bytes(self) -> int:
+        return sum(reservation.nbytes for reservation in self._reservations.values())
+
+    @property
+    def free_bytes(self) -> int:
+        return max(0, self.budget_bytes - self.reserved_bytes)
+
+    def holds(self, job_id: str) -> bool:
+        return job_id in self._reservations
+
+    def admittable(self, nbytes: int) -> int:
+        """
+        How many more jobs of this size would be admitted right now.
+        A job larger than the whole budget counts as admittable when idle, so it reaches acquire() and is rejected there.
+        """
+        if self._waiters:
+            return 0
+        if nbytes > self.budget_bytes:
+            return 0 if self._reservations else 1
+        return self.free_bytes // max(1, nbytes)
+
+    def estimated_wait_seconds(self, nbytes: int) -> float:
+        """
+        Simulate releases in expected finish order until every waiter ahead and then this job fit.
+        """
+        now = time.monotonic()
+        releases = sorted(
+            (max(0.0, reservation.started_at + self._avg_hold_seconds - now), reservation.nbytes)
+            for reservation in self._reservations.values()
+        )
+        free = self.free_bytes
+        clock = 0.0
+        for needed in [waiter_bytes for _, waiter_bytes, _ in self._waiters] + [nbytes]:
+            while needed > free and releases:
+                clock, released = releases.pop(0)
+                free += released
+            free -= needed
+            releases.append((clock + self._avg_hold_seconds, needed))
+            releases.sort()
+        return clock
+
+    async def acquire(
+        self,
+        job_id: str,
+        nbytes: int,
+        max_wait: Optional[float] = None,
+        on_wait: Optional[Callable[[float], Awaitable[None]]] = None,
+    ) -> None:
+        if nbytes > self.budget_bytes:
+            metrics.GENERATION_ADMISSION_REJECTED_TOTAL.inc("too_large")
+            raise AdmissionRejected(
+                f"This job needs about {nbytes // MB} MB, more than the {self.budget_bytes // MB} MB "
+                "available for generation on this server."
+            )
+        if not self._waiters and nbytes <= self.free_bytes:
+            self._grant(job_id, nbytes)
+            return
+
+        wait_seconds = self.estimated_wait_seconds(nbytes)
+        if max_wait is not None and wait_seconds > max_wait:
+            metrics.GENERATION_ADMISSION_REJECTED_TOTAL.inc("wait_too_long")
+            raise AdmissionRejected(
+                f"Sticker generation is busy right now (estimated wait about {max(1, round(wait_seconds / 60))} min). "
+                "Please try again later."
+            )
+        logger.info(f"Job {job_id} waiting for {nbytes // MB} MB of generation memory (estimated {wait_seconds:.0f}s)")
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((job_id, nbytes, future))
+        try:
+            if on_wait is not None:
+                await on_wait(wait_seconds)
+            await future
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Already granted, e.g. while on_wait was still writing the job document
+                self.release(job_id)
+            else:
+                future.cancel()
+                self._waiters = deque(waiter for waiter in self._waiters if waiter[2] is not future)
+                self._wake()
+            raise
+
+    def adjust(self, job_id: str, nbytes: int) -> None:
+        """
+        Replace an admitted job's estimate once its real grid size is known.
+        A larger estimate is accepted even if it over-commits the budget; later admissions absorb it.
+        """
+        reservation = self._reservations.get(job_id)
+        if reservation is None or reservation.nbytes == nbytes:
+            return
+        if nbytes > reservation.nbytes and self.reserved_bytes - reservation.nbytes + nbytes > self.budget_bytes:
+            logger.warning(f"Job {job_id} needs {nbytes // MB} MB, over-committing the generation memory budget")
+        reservation.nbytes = nbytes
+        metrics.GENERATION_MEMORY_RESERVED.set(self.reserved_bytes)
+        self._wake()
+
+    def release(self, job_id: str) -> None:
+        reservation = self._reservations.pop(job_id, None)
+        if reservation is None:
+            return
+        held = time.monotonic() - reservation.started_at
+        self._avg_hold_seconds = 0.8 * self._avg_hold_seconds + 0.2 * held
+        metrics.GENERATION_MEMORY_RESERVED.set(self.reserved_bytes)
+        self._wake()
+
+    @asynccontextmanager
+    async def reserve(self, job_id: str, nbytes: int, **kwargs):
+        await self.acquire(job_id, nbytes, **kwargs)
+        try:
+            yield
+        finally:
+            self.release(job_id)
+
+    def _grant(self, job_id: str, nbytes: int) -> None:
+        self._reservations[job_id] = _Reservation(nbytes=nbytes, started_at=time.monotonic())
+        metrics.GENERATION_MEMORY_RESERVED.set(self.reserved_bytes)
+
+    def _wake(self) -> None:
+        while self._waiters and self._waiters[0][1] <= self.free_bytes:
+            job_id, nbytes, future = self._waiters.popleft()
+            if future.done():
+                continue
+            self._grant(job_id, nbytes)
+            future.set_result(None)
+
+    def snapshot(self) -> dict:
+        return {
+            "budget_mb": round(self.budget_bytes / MB),
+            "reserved_mb": round(self.reserved_bytes / MB),
+            "admitted_jobs": len(self._reservations),
+            "waiting_jobs": len(self._waiters),
+            "avg_hold_seconds": round(self._avg_hold_seconds, 1),
+        }
+
+_controller: Optional[MemoryAdmissionController] = None
+
+def get_admission_controller() -> MemoryAdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = MemoryAdmissionController(default_budget_bytes())
+        logger.info(f"Generation memory budget: {_controller.budget_bytes // MB} MB")
+    return _controller
@@ -3,15 +3,20 @@ import base64
 import logging
 import random
 import re
+import time
 from typing import Optional, Callable, Awaitable, Any
 
 import httpx
-import vertexai
-from google.api_core import exceptions as gax_exceptions
-from vertexai.generative_models import GenerativeModel, Part, GenerationConfig
 
 from app.core.config import settings
 from app.utils.storage import StorageClient
+from app.utils import timing, metrics, cancellation
+from app.utils.cancellation import JobCancelled
+from app.utils.lazy import lazy_import
+
+# The Vertex AI SDK is imported on first use (AIService construction or warm-up)
+vertexai = lazy_import("vertexai")
+gax_exceptions = lazy_import("google.api_core.exceptions")
 
 logger = logging.getLogger(__name__)
 
@@ -80,6 +85,8 @@ class AIService:
                 self.generation_config = None
                 logger.info("Gemini API (AI Studio) client initialized.")
             elif self.provider == "vertex":
+                from vertexai.generative_models import GenerativeModel, GenerationConfig
+
                 vertexai.init(project=settings.PROJECT_ID, location=settings.VERTEX_LOCATION)
                 self.model = GenerativeModel(self.model_id)
                 self.generation_config = GenerationConfig(
@@ -167,6 +174,7 @@ class AIService:
 
                 if self.fallback_provider in self.GEMINI_PROVIDER_ALIASES and self.gemini_api_key:
                     logger.warning("Vertex AI exhausted. Falling back to Gemini API.")
+                    metrics.AI_FALLBACKS_TOTAL.inc("vertex", "gemini_api")
                     try:
                         return await self._generate_with_gemini_api(
                             image_uri=image_uri,
@@ -191,6 +199,8 @@ class AIService:
         max_retries: Optional[int] = None,
         provider_label: str = "Vertex AI",
     ) -> bytes:
+        from vertexai.generative_models import Part
+
         image_part = Part.from_uri(image_uri, mime_type="image/jpeg")
 
         async def _call():
@@ -203,6 +213,7 @@ class AIService:
             _call,
             max_retries=max_retries,
             provider_label=provider_label,
+            provider="vertex",
         )
 
         candidates = response.candidates or []
@@ -250,7 +261,8 @@ class AIService:
         max_retries: Optional[int] = None,
         provider_label: str = "Gemini API",
     ) -> bytes:
-        image_bytes = await self._load_image_bytes(image_uri)
+        with timing.span("ai.load_image"):
+            image_bytes = await self._load_image_bytes(image_uri)
         mime_type = self._guess_mime_type(image_bytes)
         image_b64 = base64.b64encode(image_bytes).decode("ascii")
 
@@ -279,6 +291,7 @@ class AIService:
             _call,
             max_retries=max_retries,
             provider_label=provider_label,
+            provider="gemini_api",
         )
 
         candidates = data.get("candidates") or []
@@ -323,14 +336,28 @@ class AIService:
         call: Callable[[], Awaitable[Any]],
         max_retries: Optional[int] = None,
         provider_label: str = "AI",
+        provider: str = "unknown",
     ) -> Any:
         retries = self.max_retries if max_retries is None else max(0, max_retries)
         for attempt in range(retries + 1):
+            # Stop spending quota on a job that was cancelled or is past its deadline
+            cancellation.check()
+            start = time.perf_counter()
             try:
-                return await call()
+                with timing.span("ai.attempt"):
+                    result = await cancellation.run(call())
+                metrics.AI_CALL_DURATION.observe(time.perf_counter() - start, provider)
+                metrics.AI_CALLS_TOTAL.inc(provider, "success")
+                return result
+            except JobCancelled:
+                raise
             except Exception as e:
-                if not self._is_retryable_error(e) or attempt >= retries:
+                retryable = self._is_retryable_error(e)
+                metrics.AI_CALL_DURATION.observe(time.perf_counter() - start, provider)
+                metrics.AI_CALLS_TOTAL.inc(provider, "retryable_error" if retryable else "error")
+                if not retryable or attempt >= retries:
                     raise
+                metrics.AI_RETRIES_TOTAL.inc(provider)
                 delay = self.retry_base_delay * (2 ** attempt)
                 delay += random.uniform(0, delay * 0.25)
                 logger.warning(
@@ -340,7 +367,8 @@ class AIService:
                     attempt + 1,
                     retries,
                 )
-                await asyncio.sleep(delay)
+                with timing.span("ai.retry_backoff"):
+                    await cancellation.sleep(delay)
 
     async def _load_image_bytes(self, image_uri: str) -> bytes:
         if image_uri.startswith("gs://"):
@@ -0,0 +1,148 @@
+import asyncio
+import io
+import logging
+import zipfile
+from io import BytesIO
+from typing import AsyncIterator, Optional
+
+from app.core.config import settings
+from app.utils.storage import StorageClient
+
+logger = logging.getLogger(__name__)
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Unseekable write target for zipfile. Bytes are collected until drained,
+    which lets the archive be emitted entry by entry.
+    """
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+class ArchiveService:
+    """
+    Builds the downloadable sticker ZIP once, when a sticker set is produced,
+    so download endpoints only have to hand out a signed URL.
+    """
+    ARCHIVE_FILENAME = "stickers.zip"
+
+    def __init__(self, storage_client: Optional[StorageClient] = None) -> None:
+        self.storage_client = storage_client or StorageClient()
+        self.prefetch = max(1, settings.ARCHIVE_PREFETCH_CONCURRENCY)
+
+    @staticmethod
+    def archive_blob_for_job(user_id: str, job_id: str) -> str:
+        return f"users/{user_id}/jobs/{job_id}/{ArchiveService.ARCHIVE_FILENAME}"
+
+    @staticmethod
+    def build_archive(entries: list[tuple[str, bytes]]) -> bytes:
+        """
+        Pack (filename, data) pairs into a ZIP.
+        PNGs are already compressed, so entries are stored as-is.
+        """
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+            for filename, data in entries:
+                archive.writestr(filename, data)
+        return buffer.getvalue()
+
+    async def iter_blob_bytes(self, blob_names: list[str]) -> AsyncIterator[tuple[str, bytes]]:
+        """
+        Yield (blob_name, bytes) in input order while keeping up to
+        `prefetch` downloads running ahead of the consumer.
+        """
+        pending: list[tuple[str, asyncio.Task]] = []
+        names = iter(blob_names)
+
+        def schedule_next() -> None:
+            name = next(names, None)
+            if name is not None:
+                task = asyncio.create_task(asyncio.to_thread(self.storage_client.download_bytes, name))
+                pending.append((name, task))
+
+        try:
+            for _ in range(self.prefetch):
+                schedule_next()
+            while pending:
+                name, task = pending.pop(0)
+                data = await task
+                schedule_next()
+                yield name, data
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def stream_archive(self, entries: list[tuple[str, str]]) -> AsyncIterator[bytes]:
+        """
+        Stream a ZIP of (filename, blob_name) entries.
+        Each local header and its data are emitted as soon as the blob arrives;
+        the central directory follows the last entry.
+        """
+        sink = _ChunkSink()
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+            position = 0
+            async for _, data in self.iter_blob_bytes([blob_name for _, blob_name in entries]):
+                archive.writestr(entries[position][0], data)
+                position += 1
+                yield sink.drain()
+        tail = sink.drain()
+        if tail:
+            yield tail
+
+    async def publish_sticker_archive(
+        self,
+        archive_blob: str,
+        slots: list[dict],
+        known_bytes: Optional[dict[str, bytes]] = None,
+    ) -> Optional[str]:
+        """
+        Build the ZIP for a sticker set and store it at archive_blob.
+        known_bytes maps blob names to sticker bytes already in memory;
+        anything else (e.g. locked slots from an earlier job) is downloaded.
+        Returns the archive blob name, or None if the archive could not be built.
+        """
+        known_bytes = dict(known_bytes or {})
+        try:
+            ordered = [
+                slot for slot in sorted(slots, key=lambda s: s.get("index", 9999))
+                if slot.get("blob_name")
+            ]
+            if not ordered:
+                return None
+
+            missing = [slot["blob_name"] for slot in ordered if slot["blob_name"] not in known_bytes]
+            async for blob_name, data in self.iter_blob_bytes(missing):
+                known_bytes[blob_name] = data
+
+            entries = [(f"{slot.get('index')}.png", known_bytes[slot["blob_name"]]) for slot in ordered]
+            archive_bytes = self.build_archive(entries)
+            await asyncio.to_thread(
+                self.storage_client.upload_bytes,
+                archive_bytes,
+                archive_blob,
+                "application/zip",
+            )
+            logger.info(f"Sticker archive stored at {archive_blob} ({len(archive_bytes)} bytes)")
+            return archive_blob
+        except Exception as e:
+            # Downloads fall back to building the archive on demand
+            logger.warning(f"Failed to build sticker archive {archive_blob}: {e}")
+            return None
+
+    def signed_archive_url(self, archive_blob: str, download_name: str) -> str:
+        return self.storage_client.generate_signed_url(
+            archive_blob,
+            response_disposition=f"attachment; filename={download_name}",
+        )
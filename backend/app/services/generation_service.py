@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from app.models.sticker import StickerGenerateRequest
+from app.services.user_service import UserService
+from app.services.ai_service import AIService
+from app.services.image_service import ImageProcessor
+from app.services.archive_service import ArchiveService
+from app.services.job_queue import JobQueue
+from app.services.scheduling import DEFAULT_TIER
+from app.services.admission import estimate_job_bytes, expected_grid_dimensions, get_admission_controller, grid_dimensions
+from app.utils.storage import StorageClient
+from app.utils.firestore import firestore, get_db
+from app.utils import timing, metrics, cancellation
+from app.utils.cancellation import CancellationToken, JobCancelled
+from app.utils.profiling import PROFILER
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+GENERATION_SEMAPHORE = asyncio.Semaphore(max(1, settings.GENERATION_CONCURRENCY))
+# Per-user start reservations, shared by every worker instance
+COOLDOWN_COLLECTION = "generation_cooldowns"
+# Tokens of jobs running in this process, so a cancel request handled here takes effect immediately
+RUNNING_TOKENS: dict[str, CancellationToken] = {}
+TERMINAL_STATUSES = ("completed", "failed", "cancelled", "timed_out")
+
+def _sanitize_locked_indices(indices: list[int]) -> set[int]:
+    return {idx for idx in indices if isinstance(idx, int) and 0 <= idx < 16}
+
+def _utc_now():
+    return datetime.now(timezone.utc)
+
+def get_jobs_collection():
+    return get_db().collection("jobs")
+
+async def _apply_user_cooldown(user_id: str) -> None:
+    """
+    Space one user's job starts GENERATION_COOLDOWN_SECONDS apart across all workers.
+    The next free start time is reserved in Firestore, then this job sleeps until it.
+    """
+    cooldown = max(0, settings.GENERATION_COOLDOWN_SECONDS)
+    if cooldown == 0:
+        return
+    cooldown_ref = get_db().collection(COOLDOWN_COLLECTION).document(user_id)
+    transaction = get_db().transaction()
+
+    @firestore.async_transactional
+    async def reserve_start(transaction, cooldown_ref):
+        snapshot = await cooldown_ref.get(transaction=transaction)
+        now = _utc_now()
+        next_allowed = (snapshot.to_dict() or {}).get("next_allowed_at") if snapshot.exists else None
+        start_at = max(next_allowed, now) if next_allowed is not None else now
+        transaction.set(cooldown_ref, {"next_allowed_at": start_at + timedelta(seconds=cooldown)})
+        return (start_at - now).total_seconds()
+
+    try:
+        wait_seconds = await reserve_start(transaction, cooldown_ref)
+    except Exception as e:
+        logger.warning(f"Failed to reserve a start for {user_id}, skipping the cooldown: {e}")
+        return
+    if wait_seconds > 0:
+        await cancellation.sleep(wait_seconds)
+
+@asynccontextmanager
+async def _generation_slot():
+    """
+    Hold one GENERATION_SEMAPHORE slot, tracking queue depth and slot usage for /metrics.
+    """
+    wait_start = time.perf_counter()
+    metrics.GENERATION_QUEUE_DEPTH.inc()
+    try:
+        await cancellation.run(GENERATION_SEMAPHORE.acquire())
+    finally:
+        metrics.GENERATION_QUEUE_DEPTH.dec()
+    timing.record("job.semaphore_wait", time.perf_counter() - wait_start)
+
+    metrics.GENERATION_IN_PROGRESS.inc()
+    try:
+        yield
+    finally:
+        GENERATION_SEMAPHORE.release()
+        metrics.GENERATION_IN_PROGRESS.dec()
+
+async def _update_job(job_id: str, data: dict) -> None:
+    job_ref = get_jobs_collection().document(job_id)
+    data["updated_at"] = _utc_now()
+    with timing.span("job.firestore_write"):
+        await job_ref.update(data)
+
+async def process_job(
+    job_id: str,
+    request: StickerGenerateRequest,
+    user_service: UserService,
+    ai_service: AIService,
+    image_processor: ImageProcessor,
+    storage_client: StorageClient,
+    archive_service: ArchiveService,
+    enqueued_at: datetime | None = None,
+    deadline: datetime | None = None,
+) -> None:
+    timer = timing.start_job_timer()
+    token = cancellation.start_job_token(deadline)
+    RUNNING_TOKENS[job_id] = token
+    started_at = time.perf_counter()
+    if enqueued_at is not None:
+        # Wall clock: the job may have been enqueued by another process
+        timing.record("job.queue_wait", max(0.0, (_utc_now() - enqueued_at).total_seconds()))
+
+    try:
+        token.check()
+        await _update_job(job_id, {"status": "queued"})
+        with timing.span("job.cooldown_wait"):
+            await _apply_user_cooldown(request.user_id)
+
+        admission = get_admission_controller()
+
+        async def report_memory_wait(wait_seconds: float) -> None:
+            await _update_job(job_id, {"queue_reason": "memory", "estimated_wait_seconds": round(wait_seconds)})
+
+        # Admit against the memory budget before taking a slot; the estimate is corrected once the grid's real size is known
+        with timing.span("job.admission_wait"):
+            await token.run(admission.acquire(
+                job_id,
+                estimate_job_bytes(*expected_grid_dimensions()),
+                max_wait=settings.GENERATION_ADMISSION_MAX_WAIT_SECONDS,
+                on_wait=report_memory_wait,
+            ))
+        async with _generation_slot():
+            await _update_job(job_id, {"status": "processing", "queue_reason": None, "estimated_wait_seconds": None})
+
+            with timing.span("job.ai_generate"):
+                grid_bytes = await ai_service.generate_sticker_grid(
+                    image_uri=request.image_uri,
+                    style_id=request.style,
+                    extra_prompt=request.prompt,
+                )
+
+            # Store raw grid output for debugging / QA
+            grid_blob = f"users/{request.user_id}/jobs/{job_id}/grid.png"
+            with timing.span("job.grid_upload"):
+                storage_client.upload_file(
+                    file_bytes=grid_bytes,
+                    destination_blob_name=grid_blob,
+                    content_type="image/png",
+                )
+            await _update_job(job_id, {"grid_blob": grid_blob})
+
+            dimensions = grid_dimensions(grid_bytes)
+            if dimensions is not None:
+                admission.adjust(job_id, estimate_job_bytes(*dimensions))
+
+            # Off the event loop, so admitted jobs really process in parallel and the API stays responsive.
+            # On cancellation the slot and memory stay held until the thread stops at its next cell check.
+            token.check()
+            with timing.span("job.image_processing"):
+                sticker_images = await token.run_in_thread(image_processor.process_sticker_grid, grid_bytes)
+            token.check()
+
+            output_urls: list[str] = []
+            output_blobs: list[str] = []
+
+            with timing.span("job.sticker_upload"):
+                for i, sticker_bytes in enumerate(sticker_images):
+                    blob_name = f"users/{request.user_id}/jobs/{job_id}/{i}.png"
+                    url = storage_client.upload_file(
+                        file_bytes=sticker_bytes,
+                        destination_blob_name=blob_name,
+                        content_type="image/png"
+                    )
+                    output_urls.append(url)
+                    output_blobs.append(blob_name)
+
+            locked_indices = _sanitize_locked_indices(request.locked_indices)
+            with timing.span("job.firestore_read"):
+                # Locked slots are merged into the stored set, so read it fresh rather than from the cache
+                existing_slots, _ = await user_service.get_current_stickers(request.user_id, use_cache=False)
+            existing_map: dict[int, dict] = {}
+            for slot in existing_slots:
+                if not isinstance(slot, dict):
+                    continue
+                idx = slot.get("index")
+                if isinstance(idx, int) and 0 <= idx < 16:
+                    existing_map[idx] = slot
+
+            result_slots = []
+            persisted_slots = []
+            for index in range(16):
+                use_existing = index in locked_indices and index in existing_map
+                if use_existing:
+                    existing_blob = existing_map[index].get("blob_name")
+                    if existing_blob:
+                        url = storage_client.generate_signed_url(existing_blob)
+                        blob_name = existing_blob
+                    else:
+                        url = output_urls[index]
+                        blob_name = output_blobs[index]
+                        use_existing = False
+                else:
+                    url = output_urls[index]
+                    blob_name = output_blobs[index]
+
+                locked = index in locked_indices if use_existing or locked_indices else False
+                result_slots.append({"index": index, "url": url, "locked": locked})
+                persisted_slots.append({"index": index, "blob_name": blob_name, "locked": locked})
+
+            # Build the downloadable ZIP once, while the new stickers are still in memory
+            with timing.span("job.archive_build"):
+                archive_blob = await archive_service.publish_sticker_archive(
+                    archive_blob=ArchiveService.archive_blob_for_job(request.user_id, job_id),
+                    slots=persisted_slots,
+                    known_bytes=dict(zip(output_blobs, sticker_images)),
+                )
+
+            with timing.span("job.firestore_write"):
+                await user_service.set_current_stickers(request.user_id, persisted_slots, job_id, archive_blob=archive_blob)
+            timing.record("job.total", time.perf_counter() - started_at)
+            await _update_job(job_id, {
+                "status": "completed",
+                "result_slots": persisted_slots,
+                "archive_blob": archive_blob,
+                "stage_timings_ms": timer.as_millis(),
+            })
+
+    except JobCancelled as e:
+        logger.info(f"Job {job_id} for {request.user_id} stopped ({e.reason}). Refunding coin.")
+        try:
+            await user_service.refund_coin(request.user_id, amount=1)
+        except Exception as refund_error:
+            logger.error(f"CRITICAL: Failed to refund {request.user_id}: {refund_error}")
+
+        timing.record("job.total", time.perf_counter() - started_at)
+        await _update_job(job_id, {"status": e.reason, "error": str(e), "stage_timings_ms": timer.as_millis()})
+    except Exception as e:
+        logger.error(f"Sticker generation failed for {request.user_id}. Rolling back coin deduction. Error: {e}")
+        try:
+            await user_service.refund_coin(request.user_id, amount=1)
+        except Exception as refund_error:
+            logger.error(f"CRITICAL: Failed to refund {request.user_id}: {refund_error}")
+
+        timing.record("job.total", time.perf_counter() - started_at)
+        await _update_job(job_id, {"status": "failed", "error": str(e), "stage_timings_ms": timer.as_millis()})
+    finally:
+        RUNNING_TOKENS.pop(job_id, None)
+        get_admission_controller().release(job_id)
+        PROFILER.unit_finished("jobs")
+
+async def submit_job(request: StickerGenerateRequest, job_queue: JobQueue, tier: str = DEFAULT_TIER) -> str:
+    """
+    Create the job document and put the job on the shared generation queue.
+    Whichever worker claims it runs process_job; `tier` sets its scheduling priority.
+    """
+    job_id = str(uuid.uuid4())
+    now = _utc_now()
+    deadline = now + timedelta(seconds=settings.GENERATION_JOB_TIMEOUT_SECONDS)
+    await get_jobs_collection().document(job_id).set({
+        "job_id": job_id,
+        "user_id": request.user_id,
+        "status": "queued",
+        "tier": tier,
+        "deadline": deadline,
+        "created_at": now,
+        "updated_at": now,
+    })
+    await job_queue.enqueue(job_id, request.model_dump(), enqueued_at=now, tier=tier, deadline=deadline)
+    return job_id
+
+async def fail_job(job_id: str, user_id: str, error: str) -> None:
+    """
+    Mark a job failed without running it and give the coin back.
+    """
+    try:
+        await UserService().refund_coin(user_id, amount=1)
+    except Exception as refund_error:
+        logger.error(f"CRITICAL: Failed to refund {user_id}: {refund_error}")
+    await _update_job(job_id, {"status": "failed", "error": error})
+
+def cancel_local(job_id: str) -> bool:
+    """
+    Cancel a job running in this process. Returns False if it is not running here.
+    """
+    token = RUNNING_TOKENS.get(job_id)
+    if token is None:
+        return False
+    token.cancel()
+    return True
+
+async def cancel_job(job_id: str, user_id: str, job_queue: JobQueue) -> str | None:
+    """
+    Cancel a job on behalf of its owner.
+    Returns "cancelled" when the job had not started (the coin is refunded here),
+    "cancelling" when a worker is running it (the worker refunds once it stops),
+    or None if the job does not exist, belongs to someone else or has already finished.
+    """
+    job_ref = get_jobs_collection().document(job_id)
+    transaction = get_db().transaction()
+
+    @firestore.async_transactional
+    async def request_cancel(transaction, job_ref):
+        snapshot = await job_ref.get(transaction=transaction)
+        data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+        if data.get("user_id") != user_id or data.get("status") in TERMINAL_STATUSES:
+            return False
+        transaction.update(job_ref, {"cancel_requested": True, "updated_at": _utc_now()})
+        return True
+
+    if not await request_cancel(transaction, job_ref):
+        return None
+
+    # Still waiting in the queue: take it out before any worker claims it
+    if await job_queue.remove_waiting(job_id):
+        try:
+            await UserService().refund_coin(user_id, amount=1)
+        except Exception as refund_error:
+            logger.error(f"CRITICAL: Failed to refund {user_id}: {refund_error}")
+        await _update_job(job_id, {"status": "cancelled", "error": JobCancelled.MESSAGES[cancellation.CANCELLED]})
+        return "cancelled"
+
+    cancel_local(job_id)
+    return "cancelling"
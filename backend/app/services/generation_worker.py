@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from app.models.sticker import StickerGenerateRequest
+from app.services.user_service import UserService
+from app.services.ai_service import AIService
+from app.services.image_service import ImageProcessor
+from app.services.archive_service import ArchiveService
+from app.services.admission import estimate_job_bytes, expected_grid_dimensions, get_admission_controller
+from app.services.scheduling import get_scheduler
+from app.services.job_queue import JobQueue, subscribe_local, unsubscribe_local
+from app.services.generation_service import TERMINAL_STATUSES, cancel_local, fail_job, get_jobs_collection, process_job
+from app.utils.storage import StorageClient
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class GenerationWorker:
+    """
+    Consume the generation queue and run the AI + image pipeline.
+
+    Runs as its own service (app.worker) or embedded in the API process when
+    PROCESS_ROLE is "all". Each claimed entry holds a lease that is renewed
+    while the job runs, so a crashed worker's jobs are picked up again.
+    """
+    def __init__(
+        self,
+        queue: JobQueue | None = None,
+        user_service: UserService | None = None,
+        ai_service: AIService | None = None,
+        image_processor: ImageProcessor | None = None,
+        storage_client: StorageClient | None = None,
+        concurrency: int | None = None,
+        poll_interval: float | None = None,
+        lease_seconds: float | None = None,
+    ):
+        self.queue = queue
+        self.user_service = user_service
+        self.ai_service = ai_service
+        self.image_processor = image_processor
+        self.storage_client = storage_client
+        self.concurrency = max(1, concurrency or settings.GENERATION_CONCURRENCY)
+        self.poll_interval = poll_interval or settings.WORKER_POLL_INTERVAL_SECONDS
+        self.lease_seconds = lease_seconds or settings.WORKER_LEASE_SECONDS
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._active: dict[str, asyncio.Task] = {}
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        self._avg_job_seconds: float | None = None
+
+    async def _init_services(self) -> None:
+        # Client construction does blocking credential lookups; keep it off the event loop
+        if self.queue is None:
+            self.queue = await asyncio.to_thread(JobQueue)
+        if self.user_service is None:
+            self.user_service = await asyncio.to_thread(UserService)
+        if self.storage_client is None:
+            self.storage_client = await asyncio.to_thread(StorageClient)
+        if self.ai_service is None:
+            self.ai_service = await asyncio.to_thread(AIService)
+        if self.image_processor is None:
+            self.image_processor = ImageProcessor()
+        self.archive_service = ArchiveService(self.storage_client)
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def run(self) -> None:
+        await self._init_services()
+        self._wakeup = subscribe_local()
+        logger.info(f"Generation worker {self.worker_id} started (concurrency {self.concurrency})")
+        try:
+            while not self._stopping:
+                self._wakeup.clear()
+                # Leave work in the shared queue, where other instances can take it, rather than admit past the memory budget
+                admission = get_admission_controller()
+                # Claimed jobs still in cooldown have not reserved their memory yet
+                pending = sum(1 for job_id in self._active if not admission.holds(job_id))
+                free = min(
+                    self.concurrency - len(self._active),
+                    admission.admittable(estimate_job_bytes(*expected_grid_dimensions())) - pending,
+                )
+                if free > 0:
+                    try:
+                        entries = await self.queue.claim(self.worker_id, self.lease_seconds, limit=free, scheduler=get_scheduler())
+                    except Exception as e:
+                        logger.error(f"Failed to poll generation queue: {e}")
+                        entries = []
+                    for entry in entries:
+                        self._spawn(entry)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            unsubscribe_local(self._wakeup)
+
+    def _spawn(self, entry: dict) -> None:
+        job_id = entry["job_id"]
+        task = asyncio.create_task(self._run_entry(entry))
+        self._active[job_id] = task
+
+        def _done(_task: asyncio.Task) -> None:
+            self._active.pop(job_id, None)
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+        task.add_done_callback(_done)
+
+    async def _keep_lease(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self.queue.renew(job_id, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.warning(f"Failed to renew lease on job {job_id}: {e}")
+
+    async def _watch_cancel_requests(self, job_id: str) -> None:
+        # The cancel endpoint may run in an API process; it flags the job document
+        job_ref = get_jobs_collection().document(job_id)
+        while True:
+            try:
+                snapshot = await job_ref.get(field_paths=["cancel_requested"])
+                if snapshot.exists and (snapshot.to_dict() or {}).get("cancel_requested"):
+                    cancel_local(job_id)
+                    return
+            except Exception as e:
+                logger.warning(f"Failed to check cancellation of job {job_id}: {e}")
+            await asyncio.sleep(settings.JOB_CANCEL_POLL_SECONDS)
+
+    async def _run_entry(self, entry: dict) -> None:
+        job_id = entry["job_id"]
+        request = StickerGenerateRequest.model_validate(entry.get("payload") or {})
+        lease_task = asyncio.create_task(self._keep_lease(job_id))
+        cancel_watch_task = None
+        try:
+            # A reclaimed entry may belong to a job that finished before its worker could complete the entry
+            snapshot = await get_jobs_collection().document(job_id).get(field_paths=["status"])
+            status = (snapshot.to_dict() or {}).get("status") if snapshot.exists else None
+            attempts = int(entry.get("attempts") or 0)
+            if status in TERMINAL_STATUSES:
+                logger.info(f"Job {job_id} already {status}; dropping its queue entry")
+            elif attempts > settings.GENERATION_MAX_ATTEMPTS:
+                logger.error(f"Job {job_id} abandoned after {attempts - 1} interrupted attempts")
+                await fail_job(job_id, request.user_id, "Generation was interrupted too many times.")
+            else:
+                started = time.monotonic()
+                cancel_watch_task = asyncio.create_task(self._watch_cancel_requests(job_id))
+                await process_job(
+                    job_id=job_id,
+                    request=request,
+                    user_service=self.user_service,
+                    ai_service=self.ai_service,
+                    image_processor=self.image_processor,
+                    storage_client=self.storage_client,
+                    archive_service=self.archive_service,
+                    enqueued_at=entry.get("enqueued_at"),
+                    deadline=entry.get("deadline"),
+                )
+                await self._record_duration(time.monotonic() - started)
+            # Not reached on cancellation: the entry stays leased and is retried once the lease expires
+            await self.queue.complete(job_id)
+        except Exception as e:
+            logger.error(f"Generation worker failed on job {job_id}: {e}")
+        finally:
+            lease_task.cancel()
+            if cancel_watch_task is not None:
+                cancel_watch_task.cancel()
+
+    async def _record_duration(self, seconds: float) -> None:
+        # Feeds the queue ETA shown by the job status endpoint
+        previous = self._avg_job_seconds
+        self._avg_job_seconds = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+        try:
+            await self.queue.record_job_seconds(round(self._avg_job_seconds, 1))
+        except Exception as e:
+            logger.warning(f"Failed to record job duration: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "concurrency": self.concurrency,
+            "active_jobs": sorted(self._active),
+            "memory": get_admission_controller().snapshot(),
+        }
+
+    async def stop(self) -> None:
+        """
+        Stop claiming new work and cancel jobs still running.
+        Their queue entries are left leased, so another worker retries them after the lease expires.
+        """
+        self._stopping = True
+        tasks = list(self._active.values())
+        if self._task is not None:
+            tasks.append(self._task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info(f"Generation worker {self.worker_id} stopped")
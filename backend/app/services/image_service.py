@@ -1,43 +1,99 @@
-import cv2
-import numpy as np
-import rembg
+from __future__ import annotations
+
 import logging
+import threading
+from io import BytesIO
 from typing import List
+from app.core.config import settings
+from app.utils import timing, cancellation
+from app.utils.lazy import lazy_import
+
+# Imported on first use: instances serving only users/payments never load OpenCV or the matting model
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+rembg = lazy_import("rembg")
+Image = lazy_import("PIL.Image")
+ImageOps = lazy_import("PIL.ImageOps")
 
 logger = logging.getLogger(__name__)
 
+_matting_session = None
+_matting_session_lock = threading.Lock()
+
+def get_matting_session():
+    """
+    Process-wide rembg session. rembg.remove builds a new ONNX session on
+    every call when none is passed, so it is created once and reused.
+    """
+    global _matting_session
+    if _matting_session is None:
+        with _matting_session_lock:
+            if _matting_session is None:
+                with timing.span("image.model_load"):
+                    _matting_session = rembg.new_session(settings.REMBG_MODEL)
+                logger.info(f"Loaded rembg model {settings.REMBG_MODEL}.")
+    return _matting_session
+
+def warm_up_matting() -> None:
+    """
+    Load the matting model and run one tiny inference so the first real sticker does not pay for it.
+    """
+    session = get_matting_session()
+    rembg.remove(np.zeros((64, 64, 3), dtype=np.uint8), session=session)
+
 class ImageProcessor:
+    def normalize_selfie(self, image_bytes: bytes, max_dimension: int = 1536, quality: int = 90) -> bytes:
+        """
+        Prepare an uploaded selfie for the AI model: apply EXIF orientation,
+        downscale so the longest side is at most max_dimension, and re-encode as JPEG.
+        """
+        with Image.open(BytesIO(image_bytes)) as img:
+            # Let the JPEG decoder scale down while decoding (cheaper than a full decode)
+            img.draft("RGB", (max_dimension, max_dimension))
+            normalized = ImageOps.exif_transpose(img)
+            if normalized.mode != "RGB":
+                normalized = normalized.convert("RGB")
+            normalized.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+            output = BytesIO()
+            normalized.save(output, format="JPEG", quality=quality, optimize=True)
+            return output.getvalue()
+
     def process_sticker_grid(self, image_bytes: bytes) -> List[bytes]:
         """
         Process the 4x4 grid image into 16 individual stickers.
         """
         try:
             # Step A: Load image from bytes to OpenCV format
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            grid_img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            with timing.span("image.decode"):
+                nparr = np.frombuffer(image_bytes, np.uint8)
+                grid_img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
             
             if grid_img is None:
                 raise ValueError("Could not decode image bytes into OpenCV format.")
 
-            # Step A.1: Trim solid green margins (if any) to stabilize grid slicing
-            grid_img = self._trim_green_margin(grid_img)
+            with timing.span("image.grid_layout"):
+                # Step A.1: Trim solid green margins (if any) to stabilize grid slicing
+                grid_img = self._trim_green_margin(grid_img)
+
+                # Step A.2: Normalize to sizes divisible by 4 to avoid drift
+                grid_img = self._normalize_grid_size(grid_img)
 
-            # Step A.2: Normalize to sizes divisible by 4 to avoid drift
-            grid_img = self._normalize_grid_size(grid_img)
+                # Step B: Detect grid boundaries using green gutters (fallback to equal split)
+                height, width = grid_img.shape[:2]
+                y_edges = self._detect_grid_edges(grid_img, axis="y")
+                if y_edges is None:
+                    y_edges = self._equal_edges(height)
+                x_edges = self._detect_grid_edges(grid_img, axis="x")
+                if x_edges is None:
+                    x_edges = self._equal_edges(width)
 
             processed_stickers = []
-            
-            # Step B: Detect grid boundaries using green gutters (fallback to equal split)
-            height, width = grid_img.shape[:2]
-            y_edges = self._detect_grid_edges(grid_img, axis="y")
-            if y_edges is None:
-                y_edges = self._equal_edges(height)
-            x_edges = self._detect_grid_edges(grid_img, axis="x")
-            if x_edges is None:
-                x_edges = self._equal_edges(width)
 
             for row in range(4):
                 for col in range(4):
+                    # Stop between cells once the job is cancelled or past its deadline
+                    cancellation.check()
                     # Slice the grid using fractional edges to reduce drift
                     y_start = y_edges[row]
                     y_end = y_edges[row + 1]
@@ -52,6 +108,8 @@ class ImageProcessor:
                     processed_stickers.append(output_bytes)
 
             return processed_stickers
+        except cancellation.JobCancelled:
+            raise
         except Exception as e:
             logger.error(f"Error processing sticker grid: {e}")
             raise e
@@ -194,62 +252,68 @@ class ImageProcessor:
     def _process_single_sticker(self, cv_img: np.ndarray) -> bytes:
         # 1. Remove background using rembg
         # Note: rembg removes the green/solid background and returns RGBA
-        img_with_alpha = rembg.remove(cv_img)
+        session = get_matting_session()
+        with timing.span("image.rembg"):
+            img_with_alpha = rembg.remove(cv_img, session=session)
 
-        # 1.1 Clean residual green spill before cropping
-        img_with_alpha = self._remove_green_spill(img_with_alpha)
-        
-        # 2. Remove tiny fragments then trim transparent whitespace
-        b, g, r, a = cv2.split(img_with_alpha)
-        a = self._remove_small_alpha_blobs(a)
-        y_indices, x_indices = np.where(a > 0)
-
-        if len(x_indices) > 0 and len(y_indices) > 0:
-            x_min, x_max = np.min(x_indices), np.max(x_indices)
-            y_min, y_max = np.min(y_indices), np.max(y_indices)
-            cropped_img = img_with_alpha[y_min:y_max+1, x_min:x_max+1]
-        else:
-            cropped_img = img_with_alpha  # fallback if totally transparent
+        with timing.span("image.cleanup"):
+            # 1.1 Clean residual green spill before cropping
+            img_with_alpha = self._remove_green_spill(img_with_alpha)
             
-        # 3. Add White Stroke
-        # Add padding first so the stroke doesn't get cut off at the edges
-        pad = 12
-        padded_img = cv2.copyMakeBorder(cropped_img, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=[0, 0, 0, 0])
-        b_p, g_p, r_p, a_p = cv2.split(padded_img)
-        
-        # Create a circular kernel for the stroke and use cv2.dilate on the alpha channel to create a mask
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-        dilated_alpha = cv2.dilate(a_p, kernel, iterations=2)
-        
-        # Overlay the original image on a white background using the dilated alpha mask
-        final_img = np.zeros_like(padded_img)
-        
-        # Set pixels where dilated alpha is > 0 to white with full opacity
-        stroke_mask = dilated_alpha > 0
-        final_img[stroke_mask] = [255, 255, 255, 255]
-        
-        # Overwrite the white background with the original actual object pixels
-        object_mask = a_p > 0
-        final_img[object_mask] = padded_img[object_mask]
-        
-        # 4. Resize to 370x320 px maintaining aspect ratio
-        target_w, target_h = 370, 320
-        h, w = final_img.shape[:2]
-        
-        scale = min(target_w / w, target_h / h)
-        new_w, new_h = int(w * scale), int(h * scale)
-        
-        resized_img = cv2.resize(final_img, (new_w, new_h), interpolation=cv2.INTER_AREA)
-        
-        # Create a blank 370x320 transparent canvas and paste the resized image in the center
-        canvas = np.zeros((target_h, target_w, 4), dtype=np.uint8)
-        x_offset = (target_w - new_w) // 2
-        y_offset = (target_h - new_h) // 2
+            # 2. Remove tiny fragments then trim transparent whitespace
+            b, g, r, a = cv2.split(img_with_alpha)
+            a = self._remove_small_alpha_blobs(a)
+            y_indices, x_indices = np.where(a > 0)
+
+            if len(x_indices) > 0 and len(y_indices) > 0:
+                x_min, x_max = np.min(x_indices), np.max(x_indices)
+                y_min, y_max = np.min(y_indices), np.max(y_indices)
+                cropped_img = img_with_alpha[y_min:y_max+1, x_min:x_max+1]
+            else:
+                cropped_img = img_with_alpha  # fallback if totally transparent
+            
+        with timing.span("image.stroke"):
+            # 3. Add White Stroke
+            # Add padding first so the stroke doesn't get cut off at the edges
+            pad = 12
+            padded_img = cv2.copyMakeBorder(cropped_img, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=[0, 0, 0, 0])
+            b_p, g_p, r_p, a_p = cv2.split(padded_img)
+            
+            # Create a circular kernel for the stroke and use cv2.dilate on the alpha channel to create a mask
+            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+            dilated_alpha = cv2.dilate(a_p, kernel, iterations=2)
+            
+            # Overlay the original image on a white background using the dilated alpha mask
+            final_img = np.zeros_like(padded_img)
+            
+            # Set pixels where dilated alpha is > 0 to white with full opacity
+            stroke_mask = dilated_alpha > 0
+            final_img[stroke_mask] = [255, 255, 255, 255]
+            
+            # Overwrite the white background with the original actual object pixels
+            object_mask = a_p > 0
+            final_img[object_mask] = padded_img[object_mask]
         
-        canvas[y_offset:y_offset+new_h, x_offset:x_offset+new_w] = resized_img
+        with timing.span("image.resize"):
+            # 4. Resize to 370x320 px maintaining aspect ratio
+            target_w, target_h = 370, 320
+            h, w = final_img.shape[:2]
+            
+            scale = min(target_w / w, target_h / h)
+            new_w, new_h = int(w * scale), int(h * scale)
+            
+            resized_img = cv2.resize(final_img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+            
+            # Create a blank 370x320 transparent canvas and paste the resized image in the center
+            canvas = np.zeros((target_h, target_w, 4), dtype=np.uint8)
+            x_offset = (target_w - new_w) // 2
+            y_offset = (target_h - new_h) // 2
+            
+            canvas[y_offset:y_offset+new_h, x_offset:x_offset+new_w] = resized_img
         
         # Encode back to PNG bytes
-        is_success, buffer = cv2.imencode(".png", canvas)
+        with timing.span("image.encode"):
+            is_success, buffer = cv2.imencode(".png", canvas)
         if not is_success:
             raise ValueError("Failed to encode image to PNG.")
             
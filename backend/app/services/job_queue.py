@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from app.core.config import settings
+from app.services.scheduling import DEFAULT_TIER, WeightedFairScheduler, get_scheduler
+from app.utils.firestore import firestore, get_db
+
+logger = logging.getLogger(__name__)
+
+# Workers in this process waiting for new entries; lets an in-process enqueue skip the poll delay
+_local_listeners: set[asyncio.Event] = set()
+
+def subscribe_local() -> asyncio.Event:
+    event = asyncio.Event()
+    _local_listeners.add(event)
+    return event
+
+def unsubscribe_local(event: asyncio.Event) -> None:
+    _local_listeners.discard(event)
+
+# Fields needed to schedule; the payload is only read when an entry is claimed
+SCAN_FIELDS = ["job_id", "tier", "enqueued_at", "lease_owner", "lease_expires_at"]
+# Until a worker has reported a duration
+DEFAULT_JOB_SECONDS = 60.0
+
+_snapshot_cache: dict = {"expires": 0.0, "value": None}
+
+class JobQueue:
+    """
+    Generation work queue shared by API and worker processes, stored in Firestore.
+
+    The API enqueues one entry per job; workers claim entries with a lease and
+    renew it while working. If a worker dies the lease runs out and another
+    worker claims the entry again. Entries are deleted once the job reaches a
+    terminal status.
+    """
+    COLLECTION = "generation_queue"
+    STATS_COLLECTION = "generation_stats"
+
+    def __init__(self):
+        self.db = get_db()
+        self.collection = self.db.collection(self.COLLECTION)
+        self.stats_ref = self.db.collection(self.STATS_COLLECTION).document("queue")
+        # Fair-queuing state shared by all workers; see WeightedFairScheduler
+        self.scheduler_ref = self.db.collection(self.STATS_COLLECTION).document("scheduler")
+
+    async def enqueue(
+        self,
+        job_id: str,
+        payload: dict,
+        enqueued_at: datetime,
+        tier: str = DEFAULT_TIER,
+        deadline: Optional[datetime] = None,
+    ) -> None:
+        await self.collection.document(job_id).set({
+            "job_id": job_id,
+            "payload": payload,
+            "tier": tier,
+            "enqueued_at": enqueued_at,
+            "deadline": deadline,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "attempts": 0,
+        })
+        for event in list(_local_listeners):
+            event.set()
+
+    async def scan(self) -> tuple[list[dict], int]:
+        """
+        Return (waiting entries, number of entries currently leased), oldest first.
+        """
+        query = (
+            self.collection.select(SCAN_FIELDS)
+            .order_by("enqueued_at")
+            .limit(max(1, settings.GENERATION_QUEUE_SCAN_LIMIT))
+        )
+        now = datetime.now(timezone.utc)
+        waiting: list[dict] = []
+        leased = 0
+        async for snapshot in query.stream():
+            entry = snapshot.to_dict() or {}
+            if not entry.get("enqueued_at"):
+                continue
+            entry["job_id"] = snapshot.id
+            if self._is_claimable(entry, now):
+                waiting.append(entry)
+            else:
+                leased += 1
+        return waiting, leased
+
+    async def claim(
+        self,
+        worker_id: str,
+        lease_seconds: float,
+        limit: int,
+        scheduler: Optional[WeightedFairScheduler] = None,
+    ) -> list[dict]:
+        """
+        Claim up to `limit` waiting (or lease-expired) entries in scheduler order.
+        """
+        if limit <= 0:
+            return []
+        scheduler = scheduler or get_scheduler()
+        waiting, _ = await self.scan()
+        if not waiting:
+            return []
+        scheduler.load(await self._scheduler_state())
+        claimed: list[dict] = []
+        for candidate in scheduler.order(waiting, datetime.now(timezone.utc)):
+            if len(claimed) >= limit:
+                break
+            entry = await self._try_claim(self.collection.document(candidate["job_id"]), worker_id, lease_seconds, scheduler)
+            if entry is not None:
+                claimed.append(entry)
+        return claimed
+
+    async def _scheduler_state(self) -> Optional[dict]:
+        snapshot = await self.scheduler_ref.get()
+        return (snapshot.to_dict() or {}) if snapshot.exists else None
+
+    @staticmethod
+    def _is_claimable(entry: dict, now: datetime) -> bool:
+        expires_at = entry.get("lease_expires_at")
+        return not entry.get("lease_owner") or expires_at is None or expires_at <= now
+
+    async def _try_claim(
+        self,
+        entry_ref,
+        worker_id: str,
+        lease_seconds: float,
+        scheduler: WeightedFairScheduler,
+    ) -> Optional[dict]:
+        transaction = self.db.transaction()
+
+        @firestore.async_transactional
+        async def atomic_claim(transaction, entry_ref):
+            snapshot = await entry_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            entry = snapshot.to_dict() or {}
+            now = datetime.now(timezone.utc)
+            # Another worker may have claimed it between the query and this transaction
+            if not self._is_claimable(entry, now):
+                return None
+            # Charged in the same transaction, so concurrent claims by other workers are all counted
+            state = await self.scheduler_ref.get(transaction=transaction)
+            scheduler.load((state.to_dict() or {}) if state.exists else None)
+            scheduler.charge(entry.get("tier") or DEFAULT_TIER)
+            transaction.set(self.scheduler_ref, scheduler.state())
+            entry["lease_owner"] = worker_id
+            entry["lease_expires_at"] = now + timedelta(seconds=lease_seconds)
+            entry["attempts"] = int(entry.get("attempts") or 0) + 1
+            transaction.update(entry_ref, {
+                "lease_owner": entry["lease_owner"],
+                "lease_expires_at": entry["lease_expires_at"],
+                "attempts": entry["attempts"],
+            })
+            return entry
+
+        try:
+            return await atomic_claim(transaction, entry_ref)
+        except Exception as e:
+            logger.warning(f"Failed to claim queue entry {entry_ref.id}: {e}")
+            return None
+
+    async def renew(self, job_id: str, worker_id: str, lease_seconds: float) -> None:
+        await self.collection.document(job_id).update({
+            "lease_owner": worker_id,
+            "lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=lease_seconds),
+        })
+
+    async def complete(self, job_id: str) -> None:
+        await self.collection.document(job_id).delete()
+
+    async def remove_waiting(self, job_id: str) -> bool:
+        """
+        Delete an entry only if no worker holds a live lease on it.
+        Returns True if this call removed it, i.e. the job will never run.
+        """
+        entry_ref = self.collection.document(job_id)
+        transaction = self.db.transaction()
+
+        @firestore.async_transactional
+        async def atomic_remove(transaction, entry_ref):
+            snapshot = await entry_ref.get(transaction=transaction)
+            if not snapshot.exists or not self._is_claimable(snapshot.to_dict() or {}, datetime.now(timezone.utc)):
+                return False
+            transaction.delete(entry_ref)
+            return True
+
+        return await atomic_remove(transaction, entry_ref)
+
+    async def record_job_seconds(self, avg_job_seconds: float) -> None:
+        """
+        Publish a worker's average job duration for queue ETAs; the last writer wins.
+        """
+        await self.stats_ref.set({
+            "avg_job_seconds": avg_job_seconds,
+            "updated_at": datetime.now(timezone.utc),
+        }, merge=True)
+
+    async def _cached_snapshot(self) -> dict:
+        # Status polls from many clients share one scan per QUEUE_STATUS_CACHE_SECONDS
+        if _snapshot_cache["value"] is not None and time.monotonic() < _snapshot_cache["expires"]:
+            return _snapshot_cache["value"]
+        waiting, leased = await self.scan()
+        stats = await self.stats_ref.get()
+        avg_job_seconds = ((stats.to_dict() or {}).get("avg_job_seconds") if stats.exists else None) or DEFAULT_JOB_SECONDS
+        # Ordered with the workers' shared state rather than this process's own
+        scheduler = get_scheduler()
+        scheduler.load(await self._scheduler_state())
+        order = scheduler.order(waiting, datetime.now(timezone.utc))
+        value = {
+            "positions": {entry["job_id"]: index for index, entry in enumerate(order)},
+            "tiers": {entry["job_id"]: entry.get("tier") or DEFAULT_TIER for entry in order},
+            "leased": leased,
+            "avg_job_seconds": float(avg_job_seconds),
+        }
+        _snapshot_cache.update(value=value, expires=time.monotonic() + settings.QUEUE_STATUS_CACHE_SECONDS)
+        return value
+
+    async def position(self, job_id: str) -> Optional[dict]:
+        """
+        Queue position (1-based, in scheduler order) and estimated start of a waiting job.
+        None if the job is not waiting in the scanned part of the queue.
+        """
+        snapshot = await self._cached_snapshot()
+        index = snapshot["positions"].get(job_id)
+        if index is None:
+            return None
+        slots = max(1, settings.GENERATION_CONCURRENCY, snapshot["leased"])
+        # Jobs ahead of this one, including those running, drain through `slots` parallel slots
+        jobs_ahead = index + snapshot["leased"]
+        wait_seconds = max(0, jobs_ahead + 1 - slots) * snapshot["avg_job_seconds"] / slots
+        return {
+            "tier": snapshot["tiers"][job_id],
+            "queue_position": index + 1,
+            "estimated_wait_seconds": round(wait_seconds),
+            "estimated_start_at": (datetime.now(timezone.utc) + timedelta(seconds=wait_seconds)).isoformat(),
+        }
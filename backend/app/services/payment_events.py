@@ -0,0 +1,201 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from app.core.config import settings
+from app.utils.firestore import firestore, get_db
+
+logger = logging.getLogger(__name__)
+
+# Workers in this process; lets the webhook hand an event over without waiting for the next poll
+_local_listeners: set[asyncio.Event] = set()
+
+def subscribe_local() -> asyncio.Event:
+    event = asyncio.Event()
+    _local_listeners.add(event)
+    return event
+
+def unsubscribe_local(event: asyncio.Event) -> None:
+    _local_listeners.discard(event)
+
+# Backoff between attempts is capped here
+MAX_RETRY_DELAY_SECONDS = 600
+
+class PaymentEventQueue:
+    """
+    Omise charge events waiting to be applied, stored in Firestore.
+
+    One document per charge ID, so a redelivered webhook finds the existing
+    document and is dropped. next_attempt_at drives everything: it is set
+    when the event is due, pushed forward by a lease while a worker applies
+    it, and removed once the event is processed or has failed for good.
+    """
+    COLLECTION = "payment_events"
+
+    def __init__(self):
+        self.db = get_db()
+        self.collection = self.db.collection(self.COLLECTION)
+
+    async def record(self, event: dict) -> bool:
+        """
+        Store a verified charge event. Returns False if this charge was already recorded.
+        """
+        event_ref = self.collection.document(event["charge_id"])
+        transaction = self.db.transaction()
+
+        @firestore.async_transactional
+        async def atomic_record(transaction, event_ref):
+            snapshot = await event_ref.get(field_paths=["status"], transaction=transaction)
+            if snapshot.exists:
+                return False
+            now = datetime.now(timezone.utc)
+            transaction.set(event_ref, {
+                **event,
+                "status": "pending",
+                "attempts": 0,
+                "next_attempt_at": now,
+                "received_at": now,
+            })
+            return True
+
+        created = await atomic_record(transaction, event_ref)
+        if created:
+            for listener in list(_local_listeners):
+                listener.set()
+        return created
+
+    async def due(self, limit: int = 50) -> list[str]:
+        """
+        Charge IDs of events that are waiting, waiting to be retried, or whose worker's lease ran out.
+        """
+        query = (
+            self.collection.where(filter=firestore.FieldFilter("next_attempt_at", "<=", datetime.now(timezone.utc)))
+            .order_by("next_attempt_at")
+            .limit(limit)
+        )
+        return [snapshot.id async for snapshot in query.select(["next_attempt_at"]).stream()]
+
+    async def claim(self, charge_id: str, lease_seconds: float) -> Optional[dict]:
+        event_ref = self.collection.document(charge_id)
+        transaction = self.db.transaction()
+
+        @firestore.async_transactional
+        async def atomic_claim(transaction, event_ref):
+            snapshot = await event_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            event = snapshot.to_dict() or {}
+            now = datetime.now(timezone.utc)
+            next_attempt_at = event.get("next_attempt_at")
+            # Processed, failed, or leased by another worker since due() ran
+            if next_attempt_at is None or next_attempt_at > now:
+                return None
+            event["attempts"] = int(event.get("attempts") or 0) + 1
+            transaction.update(event_ref, {
+                "status": "processing",
+                "attempts": event["attempts"],
+                "next_attempt_at": now + timedelta(seconds=lease_seconds),
+            })
+            return event
+
+        try:
+            return await atomic_claim(transaction, event_ref)
+        except Exception as e:
+            logger.warning(f"Failed to claim payment event {charge_id}: {e}")
+            return None
+
+    async def complete(self, charge_id: str) -> None:
+        await self.collection.document(charge_id).update({
+            "status": "processed",
+            "processed_at": datetime.now(timezone.utc),
+            "next_attempt_at": firestore.DELETE_FIELD,
+        })
+
+    async def retry_later(self, charge_id: str, attempts: int, error: str) -> bool:
+        """
+        Schedule another attempt with exponential backoff. Returns False once attempts are used up.
+        """
+        if attempts >= settings.PAYMENT_EVENT_MAX_ATTEMPTS:
+            await self.collection.document(charge_id).update({
+                "status": "failed",
+                "error": error,
+                "next_attempt_at": firestore.DELETE_FIELD,
+            })
+            return False
+        delay = min(MAX_RETRY_DELAY_SECONDS, settings.PAYMENT_EVENT_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+        await self.collection.document(charge_id).update({
+            "status": "pending",
+            "error": error,
+            "next_attempt_at": datetime.now(timezone.utc) + timedelta(seconds=delay),
+        })
+        return True
+
+class PaymentEventWorker:
+    """
+    Apply recorded charge events (credit coins, mark the payment successful) off the webhook path.
+
+    Runs in every API process. Events recorded by this process are picked up
+    immediately; the poll covers retries and events whose worker died.
+    """
+    def __init__(self, queue: PaymentEventQueue | None = None, payment_service=None, poll_interval: float | None = None):
+        self.queue = queue
+        self.payment_service = payment_service
+        self.poll_interval = poll_interval or settings.PAYMENT_EVENT_POLL_SECONDS
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def run(self) -> None:
+        if self.queue is None:
+            self.queue = await asyncio.to_thread(PaymentEventQueue)
+        if self.payment_service is None:
+            # Imported here: payment_service imports this module for the webhook
+            from app.services.payment_service import PaymentService
+            self.payment_service = await asyncio.to_thread(PaymentService)
+        self._wakeup = subscribe_local()
+        try:
+            while True:
+                self._wakeup.clear()
+                try:
+                    charge_ids = await self.queue.due()
+                except Exception as e:
+                    logger.error(f"Failed to poll payment events: {e}")
+                    charge_ids = []
+                for charge_id in charge_ids:
+                    await self._process(charge_id)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            unsubscribe_local(self._wakeup)
+
+    async def _process(self, charge_id: str) -> None:
+        event = await self.queue.claim(charge_id, settings.PAYMENT_EVENT_LEASE_SECONDS)
+        if event is None:
+            return
+        try:
+            await self.payment_service.apply_charge_event(event)
+        except Exception as e:
+            attempts = int(event.get("attempts") or 1)
+            logger.error(f"Failed to apply payment event {charge_id} (attempt {attempts}): {e}")
+            try:
+                if not await self.queue.retry_later(charge_id, attempts, str(e)):
+                    logger.error(f"Giving up on payment event {charge_id}; the charge needs manual review")
+            except Exception as update_error:
+                # The lease runs out and the event is retried anyway
+                logger.error(f"Failed to reschedule payment event {charge_id}: {update_error}")
+            return
+        try:
+            await self.queue.complete(charge_id)
+        except Exception as e:
+            # Crediting is idempotent, so a retry after the lease runs out is harmless
+            logger.warning(f"Failed to mark payment event {charge_id} processed: {e}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from typing import Optional
+from app.core.config import settings
+from app.utils.firestore import firestore
+from app.utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# A payment in one of these states never changes again
+TERMINAL_PAYMENT_STATUSES = ("success", "successful", "failed", "expired", "reversed")
+
+_terminal_cache: Optional[TTLCache] = None
+
+def get_terminal_status_cache() -> TTLCache:
+    """
+    Per-instance cache of payment statuses that can no longer change, keyed by charge ID.
+    """
+    global _terminal_cache
+    if _terminal_cache is None:
+        _terminal_cache = TTLCache(settings.PAYMENT_STATUS_CACHE_SECONDS)
+    return _terminal_cache
+
+class _PendingWatch:
+    """
+    Placeholder in PaymentStatusHub._watches while a Firestore listener starts.
+    """
+
+class PaymentStatusHub:
+    """
+    In-process pub/sub of payment status changes, keyed by charge ID.
+
+    The payment event worker publishes here after marking a payment, which
+    reaches status streams on the same instance directly. For webhooks
+    applied by another instance, the first subscriber to a charge starts a
+    Firestore listener on payments/{charge_id} that publishes on change; if
+    the listener cannot be started, streams fall back to polling.
+    """
+    def __init__(self):
+        self._subscribers: dict[str, set[asyncio.Event]] = {}
+        self._watches: dict[str, object] = {}
+        self._client = None
+        # Set when the listener client cannot be created; streams then poll for the rest of the process
+        self._listener_unavailable = False
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def publish(self, charge_id: str) -> None:
+        for event in list(self._subscribers.get(charge_id, ())):
+            event.set()
+
+    def is_listening(self, charge_id: str) -> bool:
+        watch = self._watches.get(charge_id)
+        return watch is not None and not isinstance(watch, _PendingWatch)
+
+    async def subscribe(self, charge_id: str) -> asyncio.Event:
+        self._loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        self._subscribers.setdefault(charge_id, set()).add(event)
+        if charge_id not in self._watches and settings.PAYMENT_STATUS_LISTENER_ENABLED and not self._listener_unavailable:
+            # Reserved before the await, so later subscribers do not start a second watch
+            pending = _PendingWatch()
+            self._watches[charge_id] = pending
+            start = asyncio.ensure_future(asyncio.to_thread(self._start_watch, charge_id))
+            # Runs even if this subscriber is cancelled while the watch starts
+            start.add_done_callback(lambda task: self._watch_started(charge_id, pending, task))
+            await asyncio.wait({start})
+        return event
+
+    def _watch_started(self, charge_id: str, pending: "_PendingWatch", task: asyncio.Future) -> None:
+        # Whoever unsubscribed last while the watch was starting found nothing to close
+        reserved = self._watches.get(charge_id) is pending
+        if task.cancelled() or task.exception() is not None:
+            if reserved:
+                del self._watches[charge_id]
+            if not task.cancelled():
+                logger.warning(f"Failed to listen to payment {charge_id}, falling back to polling: {task.exception()}")
+            return
+        watch = task.result()
+        if reserved and charge_id in self._subscribers:
+            self._watches[charge_id] = watch
+            return
+        if reserved:
+            del self._watches[charge_id]
+        watch.unsubscribe()
+
+    def unsubscribe(self, charge_id: str, event: asyncio.Event) -> None:
+        subscribers = self._subscribers.get(charge_id)
+        if subscribers is None:
+            return
+        subscribers.discard(event)
+        if not subscribers:
+            del self._subscribers[charge_id]
+            watch = self._watches.pop(charge_id, None)
+            # A watch still starting is closed by _watch_started once it is up
+            if watch is not None and not isinstance(watch, _PendingWatch):
+                watch.unsubscribe()
+
+    def _start_watch(self, charge_id: str):
+        if self._client is None:
+            # The async client has no listeners
+            try:
+                self._client = firestore.Client(project=settings.PROJECT_ID)
+            except Exception:
+                self._listener_unavailable = True
+                raise
+        initial = True
+
+        def on_snapshot(_docs, _changes, _read_time) -> None:
+            nonlocal initial
+            # The first callback is the document as it was when the listener started
+            if initial:
+                initial = False
+                return
+            self._loop.call_soon_threadsafe(self.publish, charge_id)
+
+        return self._client.collection("payments").document(charge_id).on_snapshot(on_snapshot)
+
+_hub: Optional[PaymentStatusHub] = None
+
+def get_payment_status_hub() -> PaymentStatusHub:
+    global _hub
+    if _hub is None:
+        _hub = PaymentStatusHub()
+    return _hub
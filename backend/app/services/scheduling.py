@@ -0,0 +1,117 @@
+import logging
+from datetime import datetime
+from typing import Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Highest priority first
+TIERS = ("premium", "paid", "free")
+DEFAULT_TIER = "free"
+
+def tier_for_user(total_spent_thb: float) -> str:
+    """
+    Scheduling tier from lifetime spend: anyone who has paid outranks free-trial users.
+    """
+    spent = float(total_spent_thb or 0)
+    if spent >= settings.PRIORITY_PREMIUM_MIN_SPENT_THB:
+        return "premium"
+    if spent > 0:
+        return "paid"
+    return "free"
+
+def parse_tier_weights(value: str) -> dict[str, float]:
+    weights = {tier: 1.0 for tier in TIERS}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        tier, _, weight = item.partition(":")
+        tier = tier.strip().lower()
+        try:
+            weight_value = float(weight)
+        except ValueError:
+            weight_value = 0.0
+        if tier not in weights or weight_value <= 0:
+            logger.warning(f"Ignoring invalid priority weight {item.strip()!r}")
+            continue
+        weights[tier] = weight_value
+    return weights
+
+class WeightedFairScheduler:
+    """
+    Weighted fair queuing across scheduling tiers.
+
+    Every job costs one unit of service, so each tier gets a share of starts
+    proportional to its weight while it has work queued: with premium:6,
+    paid:3, free:1 a busy free tier still gets one start in ten. An entry
+    that has waited longer than max_wait_seconds is started next regardless
+    of tier, oldest first.
+
+    The virtual time and finish tags are shared by every process: JobQueue
+    keeps them in Firestore, charges them in the claim transaction and
+    loads them before ordering, so workers and queue positions agree.
+    """
+    def __init__(self, weights: dict[str, float], max_wait_seconds: float):
+        self.weights = weights
+        self.max_wait_seconds = max_wait_seconds
+        self.virtual_time = 0.0
+        self.finish_tags: dict[str, float] = {}
+
+    def _weight(self, tier: str) -> float:
+        return self.weights.get(tier) or self.weights.get(DEFAULT_TIER, 1.0)
+
+    def order(self, entries: list[dict], now: datetime) -> list[dict]:
+        """
+        Return entries in the order they would be started, without changing the scheduler's state.
+        Call charge() for each entry that is actually started.
+        """
+        oldest_first = sorted(entries, key=lambda entry: entry["enqueued_at"])
+        starving = [
+            entry for entry in oldest_first
+            if (now - entry["enqueued_at"]).total_seconds() >= self.max_wait_seconds
+        ]
+        starving_ids = {entry["job_id"] for entry in starving}
+
+        # Start-time fair queuing: a tier's entries are tagged 1/weight apart, starting where
+        # the tier left off (or at the current virtual time, if it was idle); lowest tag starts first
+        tagged = []
+        next_start: dict[str, float] = {}
+        # Starving entries go first but still use up their tier's share
+        for entry in starving + [entry for entry in oldest_first if entry["job_id"] not in starving_ids]:
+            tier = entry.get("tier") or DEFAULT_TIER
+            start = next_start.get(tier, max(self.virtual_time, self.finish_tags.get(tier, 0.0)))
+            next_start[tier] = start + 1 / self._weight(tier)
+            if entry["job_id"] not in starving_ids:
+                tagged.append((start, -self._weight(tier), entry["enqueued_at"], entry))
+        tagged.sort(key=lambda item: item[:3])
+        return starving + [item[3] for item in tagged]
+
+    def load(self, state: Optional[dict]) -> None:
+        """
+        Replace the virtual time and finish tags with the shared state.
+        """
+        state = state or {}
+        self.virtual_time = float(state.get("virtual_time") or 0.0)
+        self.finish_tags = {tier: float(tag) for tier, tag in (state.get("finish_tags") or {}).items()}
+
+    def state(self) -> dict:
+        return {"virtual_time": self.virtual_time, "finish_tags": dict(self.finish_tags)}
+
+    def charge(self, tier: str) -> None:
+        """
+        Account one started job to its tier.
+        """
+        start = max(self.virtual_time, self.finish_tags.get(tier, 0.0))
+        self.finish_tags[tier] = start + 1 / self._weight(tier)
+        self.virtual_time = start
+
+_scheduler: Optional[WeightedFairScheduler] = None
+
+def get_scheduler() -> WeightedFairScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = WeightedFairScheduler(
+            parse_tier_weights(settings.PRIORITY_TIER_WEIGHTS),
+            settings.PRIORITY_MAX_WAIT_SECONDS,
+        )
+    return _scheduler
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+from app.core.config import settings
+from app.utils.firestore import firestore
+from app.utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_cache: Optional[TTLCache] = None
+
+def sticker_set_key(user_id: str) -> tuple[str, str]:
+    return ("sticker_set", user_id)
+
+def get_user_cache() -> TTLCache:
+    """
+    Per-instance cache of user documents (keyed by LINE user ID) and current
+    sticker sets (keyed by sticker_set_key). Filled by UserService reads and
+    invalidated by its writes.
+    """
+    global _cache
+    if _cache is None:
+        _cache = TTLCache(settings.USER_CACHE_TTL_SECONDS, settings.USER_CACHE_MAX_ENTRIES)
+    return _cache
+
+class UserCacheListener:
+    """
+    Invalidate cached user documents and sticker sets written by other instances.
+
+    Listens to documents whose updated_at is later than the listener's start,
+    so the initial snapshot is empty and only later writes are delivered
+    (every UserService write sets updated_at). That result set keeps every
+    document written since, so the watches are replaced with fresh ones every
+    USER_CACHE_LISTENER_RESTART_SECONDS and the whole cache is invalidated, which
+    covers writes the old watches had not delivered yet. The async client has no
+    listeners, so this uses the sync client; callbacks arrive on its own thread.
+    """
+    def __init__(self, cache: TTLCache | None = None):
+        self.cache = cache or get_user_cache()
+        self._client = None
+        self._watches = []
+        self._restart_task: asyncio.Task | None = None
+
+    def _on_user_snapshot(self, _docs, changes, _read_time) -> None:
+        for change in changes:
+            self.cache.invalidate(change.document.id)
+
+    def _on_sticker_set_snapshot(self, _docs, changes, _read_time) -> None:
+        for change in changes:
+            self.cache.invalidate(sticker_set_key(change.document.id))
+
+    def _open_watches(self) -> list:
+        if self._client is None:
+            self._client = firestore.Client(project=settings.PROJECT_ID)
+        started_at = datetime.now(timezone.utc)
+        watches = []
+        try:
+            for collection, callback in (
+                ("users", self._on_user_snapshot),
+                ("sticker_sets", self._on_sticker_set_snapshot),
+            ):
+                query = self._client.collection(collection).where(
+                    filter=firestore.FieldFilter("updated_at", ">", started_at)
+                )
+                watches.append(query.on_snapshot(callback))
+        except Exception:
+            for watch in watches:
+                watch.unsubscribe()
+            raise
+        return watches
+
+    def _restart(self) -> None:
+        # The new watches open before the old ones close, so no write falls between them
+        watches = self._open_watches()
+        old, self._watches = self._watches, watches
+        for watch in old:
+            watch.unsubscribe()
+        self.cache.invalidate_all()
+
+    async def _restart_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(settings.USER_CACHE_LISTENER_RESTART_SECONDS)
+            try:
+                await asyncio.to_thread(self._restart)
+            except Exception as e:
+                # The old watches stay open; try again next time
+                logger.error(f"Failed to restart user cache listener: {e}")
+
+    async def start(self) -> None:
+        try:
+            self._watches = await asyncio.to_thread(self._open_watches)
+            logger.info("User cache invalidation listener started")
+        except Exception as e:
+            # Without it, other instances' writes are only picked up when entries expire
+            logger.error(f"Failed to start user cache listener: {e}")
+            return
+        if settings.USER_CACHE_LISTENER_RESTART_SECONDS > 0:
+            self._restart_task = asyncio.create_task(self._restart_periodically())
+
+    def stop(self) -> None:
+        if self._restart_task is not None:
+            self._restart_task.cancel()
+            self._restart_task = None
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches = []
@@ -1,11 +1,28 @@
 import logging
 from datetime import datetime, timezone
-from google.cloud import firestore
-from app.utils.firestore import get_db
+from app.utils.firestore import firestore, get_db
 from app.models.user import UserCreate, UserInDB
+from app.services.user_cache import get_user_cache, sticker_set_key
+from app.utils import metrics
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Field masks: user documents created before sticker sets moved to their own
+# collection still carry the slot array, which profile and coin reads skip
+USER_FIELDS = [
+    "line_id",
+    "display_name",
+    "picture_url",
+    "coin_balance",
+    "total_spent_thb",
+    "is_free_trial_used",
+    "created_at",
+    "updated_at",
+]
+STICKER_SET_FIELDS = ["slots", "job_id", "archive_blob"]
+LEGACY_STICKER_SET_FIELDS = ["current_stickers", "current_stickers_job_id", "current_stickers_archive_blob"]
+
 class InsufficientCoinsError(Exception):
     pass
 
@@ -13,16 +30,46 @@ class UserService:
     def __init__(self):
         self.db = get_db()
         self.users_collection = self.db.collection('users')
+        # One compact document per user, so slot writes don't contend with coin transactions
+        self.sticker_sets_collection = self.db.collection('sticker_sets')
+        self.cache = get_user_cache()
+
+    async def get_user(self, user_id: str) -> dict | None:
+        """
+        Read-through fetch of the user document; None if the user does not exist.
+        May be up to USER_CACHE_TTL_SECONDS stale for writes made by other instances.
+        Coin balances are always re-read inside the deduct/refund/top-up transactions.
+        """
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            metrics.USER_CACHE_REQUESTS_TOTAL.inc("hit")
+            return cached
+        metrics.USER_CACHE_REQUESTS_TOTAL.inc("miss")
+        generation = self.cache.generation(user_id)
+        snapshot = await self.users_collection.document(user_id).get(field_paths=USER_FIELDS)
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict() or {}
+        self.cache.set(user_id, data, generation=generation)
+        return data
+
+    def _remember(self, key, data: dict | None = None) -> None:
+        """
+        Drop the cached document after a write, or replace it when the write's result is known exactly.
+        """
+        self.cache.invalidate(key)
+        if data is not None:
+            self.cache.set(key, data)
 
     async def sync_user(self, line_profile: UserCreate) -> dict:
         """
         Check if user exists. If not, create new user with 2 free coins.
-        If exists, update info and return.
+        If exists, update info when the LINE profile changed (or USER_SYNC_REFRESH_SECONDS passed) and return.
         """
         user_ref = self.users_collection.document(line_profile.line_id)
-        user_doc = await user_ref.get()
+        existing = await self.get_user(line_profile.line_id)
 
-        if not user_doc.exists:
+        if existing is None:
             # Create new user based on Business Rules (Grant 2 Free Coins)
             new_user = UserInDB(
                 line_id=line_profile.line_id,
@@ -31,17 +78,29 @@ class UserService:
                 coin_balance=2,
                 total_spent_thb=0.0,
                 is_free_trial_used=True,
-                current_stickers=[],
-                current_stickers_job_id=None,
-                current_stickers_updated_at=None,
                 created_at=datetime.now(timezone.utc),
                 updated_at=datetime.now(timezone.utc)
             )
             user_data = new_user.model_dump()
-            await user_ref.set(user_data)
+            sticker_set = {"slots": [], "job_id": None, "archive_blob": None}
+            batch = self.db.batch()
+            batch.set(user_ref, user_data)
+            # Created up front, so a missing sticker set always means a legacy user
+            batch.set(self.sticker_sets_collection.document(line_profile.line_id), {
+                "user_id": line_profile.line_id,
+                **sticker_set,
+                "updated_at": user_data["updated_at"],
+            })
+            await batch.commit()
+            self._remember(line_profile.line_id, user_data)
+            self._remember(sticker_set_key(line_profile.line_id), sticker_set)
             logger.info(f"Created new user: {line_profile.line_id}")
             return user_data
         else:
+            if not self._profile_needs_write(existing, line_profile):
+                # Common case on every LIFF open: nothing changed, so no write
+                return existing
+
             # Update existing user info asynchronously
             update_data = {
                 "display_name": line_profile.display_name,
@@ -49,39 +108,100 @@ class UserService:
                 "updated_at": datetime.now(timezone.utc)
             }
             await user_ref.update(update_data)
+            self._remember(line_profile.line_id)
             
-            user_data = user_doc.to_dict()
+            user_data = existing
             # Merge updated fields for immediate response reflection
             user_data.update(update_data)
             logger.info(f"Updated existing user: {line_profile.line_id}")
             return user_data
 
-    async def get_current_stickers(self, user_id: str) -> tuple[list[dict], str | None]:
+    def _profile_needs_write(self, existing: dict, line_profile: UserCreate) -> bool:
+        if existing.get("display_name") != line_profile.display_name:
+            return True
+        if existing.get("picture_url") != line_profile.picture_url:
+            return True
+        updated_at = existing.get("updated_at")
+        if not isinstance(updated_at, datetime):
+            return True
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        return (datetime.now(timezone.utc) - updated_at).total_seconds() >= settings.USER_SYNC_REFRESH_SECONDS
+
+    async def get_current_sticker_set(self, user_id: str, use_cache: bool = True) -> dict:
         """
-        Fetch the user's current sticker set and associated job ID.
-        Returns (slots, job_id). Slots may be empty if none exist.
+        Fetch the user's current sticker set.
+        Returns a dict with "slots", "job_id" and "archive_blob" (pre-built ZIP, may be None).
         """
-        user_ref = self.users_collection.document(user_id)
-        snapshot = await user_ref.get()
+        key = sticker_set_key(user_id)
+        if use_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.USER_CACHE_REQUESTS_TOTAL.inc("hit")
+                return cached
+            metrics.USER_CACHE_REQUESTS_TOTAL.inc("miss")
+        generation = self.cache.generation(key)
+
+        snapshot = await self.sticker_sets_collection.document(user_id).get(field_paths=STICKER_SET_FIELDS)
+        if snapshot.exists:
+            data = snapshot.to_dict() or {}
+            sticker_set = {
+                "slots": data.get("slots") or [],
+                "job_id": data.get("job_id"),
+                "archive_blob": data.get("archive_blob"),
+            }
+        else:
+            sticker_set = await self._get_legacy_sticker_set(user_id)
+        self.cache.set(key, sticker_set, generation=generation)
+        return sticker_set
+
+    async def _get_legacy_sticker_set(self, user_id: str) -> dict:
+        """
+        Sticker set still stored on the user document (users not yet migrated by script/migrate_sticker_sets.py).
+        """
+        snapshot = await self.users_collection.document(user_id).get(field_paths=LEGACY_STICKER_SET_FIELDS)
         if not snapshot.exists:
             raise ValueError(f"User {user_id} not found")
 
         data = snapshot.to_dict() or {}
-        slots = data.get("current_stickers") or []
-        job_id = data.get("current_stickers_job_id")
-        return slots, job_id
+        return {
+            "slots": data.get("current_stickers") or [],
+            "job_id": data.get("current_stickers_job_id"),
+            "archive_blob": data.get("current_stickers_archive_blob"),
+        }
+
+    async def get_current_stickers(self, user_id: str, use_cache: bool = True) -> tuple[list[dict], str | None]:
+        """
+        Fetch the user's current sticker set and associated job ID.
+        Returns (slots, job_id). Slots may be empty if none exist.
+        """
+        sticker_set = await self.get_current_sticker_set(user_id, use_cache=use_cache)
+        return sticker_set["slots"], sticker_set["job_id"]
 
-    async def set_current_stickers(self, user_id: str, slots: list[dict], job_id: str | None) -> None:
+    def forget_current_sticker_set(self, user_id: str) -> None:
+        """
+        Drop this instance's cached sticker set, e.g. once a job finished by another process is reported.
+        """
+        self.cache.invalidate(sticker_set_key(user_id))
+
+    async def set_current_stickers(
+        self,
+        user_id: str,
+        slots: list[dict],
+        job_id: str | None,
+        archive_blob: str | None = None,
+    ) -> None:
         """
         Persist the user's current sticker set in Firestore.
+        Replaces the whole sticker set document; the user document is not touched.
         """
-        user_ref = self.users_collection.document(user_id)
-        await user_ref.update({
-            "current_stickers": slots,
-            "current_stickers_job_id": job_id,
-            "current_stickers_updated_at": datetime.now(timezone.utc),
+        sticker_set = {"slots": slots, "job_id": job_id, "archive_blob": archive_blob}
+        await self.sticker_sets_collection.document(user_id).set({
+            "user_id": user_id,
+            **sticker_set,
             "updated_at": datetime.now(timezone.utc),
         })
+        self._remember(sticker_set_key(user_id), sticker_set)
 
     async def reset_current_stickers(self, user_id: str) -> None:
         """
@@ -93,12 +213,20 @@ class UserService:
         """
         Deduct coin from user using atomic transaction to prevent race conditions.
         """
+        charge = await self.deduct_coin_for_job(user_id, amount)
+        return charge["coin_balance"]
+
+    async def deduct_coin_for_job(self, user_id: str, amount: int = 1) -> dict:
+        """
+        Deduct coin like deduct_coin and also return the user's total_spent_thb,
+        read in the same transaction, so the job can be prioritised without another read.
+        """
         transaction = self.db.transaction()
         user_ref = self.users_collection.document(user_id)
 
         @firestore.async_transactional
         async def atomic_deduct(transaction, user_ref, amount):
-            snapshot = await user_ref.get(transaction=transaction)
+            snapshot = await user_ref.get(field_paths=USER_FIELDS, transaction=transaction)
             if not snapshot.exists:
                 raise ValueError(f"User {user_id} not found")
             
@@ -107,16 +235,23 @@ class UserService:
                 raise InsufficientCoinsError(f"Not enough coins. Balance: {balance}, Required: {amount}")
             
             new_balance = balance - amount
-            transaction.update(user_ref, {
+            update_data = {
                 "coin_balance": new_balance,
                 "updated_at": datetime.now(timezone.utc)
-            })
-            return new_balance
+            }
+            transaction.update(user_ref, update_data)
+            data = snapshot.to_dict() or {}
+            charge = {
+                "coin_balance": new_balance,
+                "total_spent_thb": float(data.get("total_spent_thb") or 0.0),
+            }
+            return charge, {**data, **update_data}
 
         try:
-            new_balance = await atomic_deduct(transaction, user_ref, amount)
-            logger.info(f"Deducted {amount} coins from {user_id}. New balance: {new_balance}")
-            return new_balance
+            charge, user_data = await atomic_deduct(transaction, user_ref, amount)
+            self._remember(user_id, user_data)
+            logger.info(f"Deducted {amount} coins from {user_id}. New balance: {charge['coin_balance']}")
+            return charge
         except Exception as e:
             logger.error(f"Failed to deduct coin for {user_id}: {e}")
             raise
@@ -131,20 +266,22 @@ class UserService:
 
         @firestore.async_transactional
         async def atomic_refund(transaction, user_ref, amount):
-            snapshot = await user_ref.get(transaction=transaction)
+            snapshot = await user_ref.get(field_paths=USER_FIELDS, transaction=transaction)
             if not snapshot.exists:
                 raise ValueError(f"User {user_id} not found")
             
             balance = snapshot.get("coin_balance")
             new_balance = balance + amount
-            transaction.update(user_ref, {
+            update_data = {
                 "coin_balance": new_balance,
                 "updated_at": datetime.now(timezone.utc)
-            })
-            return new_balance
+            }
+            transaction.update(user_ref, update_data)
+            return new_balance, {**(snapshot.to_dict() or {}), **update_data}
 
         try:
-            new_balance = await atomic_refund(transaction, user_ref, amount)
+            new_balance, user_data = await atomic_refund(transaction, user_ref, amount)
+            self._remember(user_id, user_data)
             logger.info(f"Refunded {amount} coins to {user_id}. New balance: {new_balance}")
             return new_balance
         except Exception as e:
@@ -155,21 +292,35 @@ class UserService:
         """
         Top up coins and total spent THB using an atomic transaction.
         Also logs the transaction in the 'transactions' collection.
+        Idempotent per reference_id: the log entry is keyed by it, so a repeated
+        top-up for the same charge changes nothing and returns "duplicate": True.
         """
         transaction = self.db.transaction()
         user_ref = self.users_collection.document(user_id)
         
-        # Auto-generate a transaction ID
-        txn_ref = self.db.collection('transactions').document()
+        if reference_id:
+            txn_ref = self.db.collection('transactions').document(f"topup_{reference_id}")
+        else:
+            # Auto-generate a transaction ID
+            txn_ref = self.db.collection('transactions').document()
 
         @firestore.async_transactional
         async def atomic_top_up(transaction, user_ref, txn_ref, coins, thb_amount, reference_id):
-            snapshot = await user_ref.get(transaction=transaction)
+            snapshot = await user_ref.get(field_paths=USER_FIELDS, transaction=transaction)
             if not snapshot.exists:
                 raise ValueError(f"User {user_id} not found")
             
-            # Update user balances
             data = snapshot.to_dict() or {}
+            if reference_id:
+                existing_txn = await txn_ref.get(field_paths=["txn_id"], transaction=transaction)
+                if existing_txn.exists:
+                    return {
+                        "coin_balance": data.get("coin_balance", 0),
+                        "total_spent_thb": data.get("total_spent_thb", 0.0),
+                        "duplicate": True,
+                    }, data
+
+            # Update user balances
             current_coins = data.get("coin_balance", 0)
             current_spent = data.get("total_spent_thb", 0.0)
             
@@ -178,11 +329,12 @@ class UserService:
             
             now_utc = datetime.now(timezone.utc)
             
-            transaction.update(user_ref, {
+            update_data = {
                 "coin_balance": new_coins,
                 "total_spent_thb": new_spent,
                 "updated_at": now_utc
-            })
+            }
+            transaction.update(user_ref, update_data)
             
             # Log the transaction
             transaction.set(txn_ref, {
@@ -197,10 +349,14 @@ class UserService:
             return {
                 "coin_balance": new_coins,
                 "total_spent_thb": new_spent
-            }
+            }, {**data, **update_data}
 
         try:
-            result = await atomic_top_up(transaction, user_ref, txn_ref, coins, thb_amount, reference_id)
+            result, user_data = await atomic_top_up(transaction, user_ref, txn_ref, coins, thb_amount, reference_id)
+            self._remember(user_id, user_data)
+            if result.get("duplicate"):
+                logger.info(f"Top-up for {user_id} with reference {reference_id} was already applied.")
+                return result
             logger.info(f"Top-up successful for {user_id}. Added {coins} coins for {thb_amount} THB.")
             return result
         except Exception as e:
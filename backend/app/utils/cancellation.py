@@ -0,0 +1,152 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+CANCELLED = "cancelled"
+TIMED_OUT = "timed_out"
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job once it has been cancelled or has run past its deadline.
+    """
+    MESSAGES = {
+        CANCELLED: "Job was cancelled.",
+        TIMED_OUT: "Job did not finish before its deadline.",
+    }
+
+    def __init__(self, reason: str):
+        super().__init__(self.MESSAGES.get(reason, reason))
+        self.reason = reason
+
+class CancellationToken:
+    """
+    Cancellation flag and deadline for one generation job.
+
+    Checked between AI retries, before image processing and between grid
+    cells. check() only reads plain attributes, so it is safe from the
+    worker thread that processes the grid; cancel() must be called on the
+    event loop.
+    """
+    def __init__(self, deadline: Optional[datetime] = None) -> None:
+        self._deadline_monotonic: Optional[float] = None
+        if deadline is not None:
+            remaining = (deadline - datetime.now(timezone.utc)).total_seconds()
+            self._deadline_monotonic = time.monotonic() + remaining
+        self._reason: Optional[str] = None
+        self._event = asyncio.Event()
+
+    @property
+    def reason(self) -> Optional[str]:
+        if self._reason is not None:
+            return self._reason
+        if self._deadline_monotonic is not None and time.monotonic() >= self._deadline_monotonic:
+            return TIMED_OUT
+        return None
+
+    def remaining(self) -> Optional[float]:
+        if self._deadline_monotonic is None:
+            return None
+        return max(0.0, self._deadline_monotonic - time.monotonic())
+
+    def cancel(self, reason: str = CANCELLED) -> None:
+        if self._reason is None:
+            self._reason = reason
+        self._event.set()
+
+    def check(self) -> None:
+        reason = self.reason
+        if reason is not None:
+            raise JobCancelled(reason)
+
+    async def sleep(self, seconds: float) -> None:
+        """
+        Sleep unless cancelled first. A sleep that would outlast the deadline fails straight away.
+        """
+        self.check()
+        remaining = self.remaining()
+        if remaining is not None and seconds >= remaining:
+            raise JobCancelled(TIMED_OUT)
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            return
+        self.check()
+
+    async def run(self, awaitable: Awaitable[T]) -> T:
+        """
+        Await `awaitable`, abandoning it as soon as the job is cancelled or its deadline passes.
+        """
+        self.check()
+        task = asyncio.ensure_future(awaitable)
+        waiter = asyncio.ensure_future(self._event.wait())
+        try:
+            done, _ = await asyncio.wait({task, waiter}, timeout=self.remaining(), return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            task.cancel()
+            raise
+        finally:
+            waiter.cancel()
+        if task in done:
+            return task.result()
+        task.cancel()
+        raise JobCancelled(self.reason or TIMED_OUT)
+
+    async def run_in_thread(self, func: Callable[..., T], *args) -> T:
+        """
+        Like run(asyncio.to_thread(func, *args)), but a cancelled thread is waited for
+        rather than abandoned: it keeps running until func's next check(), and whatever
+        the caller holds (generation slot, memory reservation) must stay held until then.
+        """
+        self.check()
+        task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        waiter = asyncio.ensure_future(self._event.wait())
+        try:
+            done, _ = await asyncio.wait({task, waiter}, timeout=self.remaining(), return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            task.cancel()
+            raise
+        finally:
+            waiter.cancel()
+        if task in done:
+            return task.result()
+        # The thread sees the reason at its next check() and raises JobCancelled there
+        await asyncio.wait({task})
+        if not task.cancelled():
+            task.exception()
+        raise JobCancelled(self.reason or TIMED_OUT)
+
+_current_token: ContextVar[Optional[CancellationToken]] = ContextVar("cancellation_token", default=None)
+
+def start_job_token(deadline: Optional[datetime] = None) -> CancellationToken:
+    """
+    Bind a fresh CancellationToken to the current context, like timing.start_job_timer.
+    Code below (AIService retries, ImageProcessor in its worker thread) reaches it through check()/sleep().
+    """
+    token = CancellationToken(deadline)
+    _current_token.set(token)
+    return token
+
+def current() -> Optional[CancellationToken]:
+    return _current_token.get()
+
+def check() -> None:
+    token = _current_token.get()
+    if token is not None:
+        token.check()
+
+async def sleep(seconds: float) -> None:
+    token = _current_token.get()
+    if token is None:
+        await asyncio.sleep(seconds)
+    else:
+        await token.sleep(seconds)
+
+async def run(awaitable: Awaitable[T]) -> T:
+    token = _current_token.get()
+    if token is None:
+        return await awaitable
+    return await token.run(awaitable)
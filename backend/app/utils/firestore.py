@@ -1,6 +1,11 @@
+from __future__ import annotations
+
 import logging
-from google.cloud import firestore
+import threading
 from app.core.config import settings
+from app.utils.lazy import lazy_import
+
+firestore = lazy_import("google.cloud.firestore")
 
 logger = logging.getLogger(__name__)
 
@@ -10,17 +15,22 @@ class AsyncFirestoreClientWrapper:
     """
     _instance = None
     _client = None
+    # Startup warm-up may create the client from a worker thread while a request does the same
+    _lock = threading.Lock()
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(AsyncFirestoreClientWrapper, cls).__new__(cls)
-            try:
-                # Initialize Async Firestore Client using the project ID from settings
-                cls._instance._client = firestore.AsyncClient(project=settings.PROJECT_ID)
-                logger.info("Async Firestore Client initialized successfully.")
-            except Exception as e:
-                logger.error(f"Failed to initialize Async Firestore Client: {e}")
-                raise e
+            with cls._lock:
+                if cls._instance is None:
+                    try:
+                        # Initialize Async Firestore Client using the project ID from settings
+                        instance = super(AsyncFirestoreClientWrapper, cls).__new__(cls)
+                        instance._client = firestore.AsyncClient(project=settings.PROJECT_ID)
+                        cls._instance = instance
+                        logger.info("Async Firestore Client initialized successfully.")
+                    except Exception as e:
+                        logger.error(f"Failed to initialize Async Firestore Client: {e}")
+                        raise e
         return cls._instance
     
     @property
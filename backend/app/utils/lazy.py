@@ -0,0 +1,38 @@
+import importlib
+import logging
+import threading
+import time
+from types import ModuleType
+
+logger = logging.getLogger(__name__)
+
+class LazyModule(ModuleType):
+    """
+    Stand-in for a module that is imported on first attribute access.
+    Once loaded, the real module's attributes are copied onto the stand-in,
+    so later lookups are ordinary attribute reads.
+    """
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self.__dict__["_lazy_lock"] = threading.Lock()
+        self.__dict__["_lazy_loaded"] = False
+
+    def _load(self) -> ModuleType:
+        with self._lazy_lock:
+            start = time.perf_counter()
+            module = importlib.import_module(self.__name__)
+            if not self._lazy_loaded:
+                self.__dict__.update(module.__dict__)
+                self.__dict__["_lazy_loaded"] = True
+                logger.info(f"Imported {self.__name__} on first use in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Defer importing a heavy dependency until it is actually used.
+    Use for module aliases only (`cv2 = lazy_import("cv2")`); `from x import y` still imports eagerly.
+    """
+    return LazyModule(name)
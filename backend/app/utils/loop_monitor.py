@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Innermost frames logged for a stall; the outer ones are always the server and middleware stack
+STACK_LIMIT = 12
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up from a short sleep.
+
+    A watchdog thread notices a stall while it is still happening and logs the
+    loop thread's current stack once per stall, which names the blocking call.
+    """
+    def __init__(self, interval: float = 0.25, threshold: float = 0.2) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._last_beat = time.perf_counter()
+        self._stall_reported = False
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._stop_event.clear()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Event loop lag monitor started (threshold {self.threshold * 1000:.0f} ms)")
+
+    async def stop(self) -> None:
+        self._stop_event.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - start - self.interval)
+            self._last_beat = now
+            self._stall_reported = False
+
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            metrics.EVENT_LOOP_LAG.observe(lag)
+            if lag > self.threshold:
+                self.stalls += 1
+                metrics.EVENT_LOOP_STALLS_TOTAL.inc()
+                logger.warning(f"Event loop lag {lag * 1000:.0f} ms (threshold {self.threshold * 1000:.0f} ms)")
+
+    def _watch(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            stalled = time.perf_counter() - self._last_beat - self.interval
+            if stalled <= self.threshold or self._stall_reported:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self._stall_reported = True
+            stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT))
+            logger.warning(f"Event loop blocked for {stalled * 1000:.0f} ms so far; loop thread is at:\n{stack}")
+
+    def snapshot(self) -> dict:
+        return {
+            "interval_ms": round(self.interval * 1000, 1),
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "last_lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalls": self.stalls,
+        }
+
+_monitor: Optional[LoopLagMonitor] = None
+
+def start_monitor(interval: float, threshold: float) -> LoopLagMonitor:
+    """
+    Start the process-wide monitor on the running loop.
+    """
+    global _monitor
+    _monitor = LoopLagMonitor(interval=interval, threshold=threshold)
+    _monitor.start()
+    return _monitor
+
+def get_monitor() -> Optional[LoopLagMonitor]:
+    return _monitor
@@ -0,0 +1,254 @@
+import os
+import resource
+import threading
+from typing import Callable, Optional
+
+from app.utils.timing import DEFAULT_BUCKETS, STAGE_HISTOGRAMS, HistogramFamily
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """
+    Monotonic counter with optional labels.
+    """
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.labels:
+            items = [((), 0.0)]
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_number(value)}")
+        return lines
+
+class Gauge:
+    """
+    Point-in-time value. Either updated with inc/dec/set or read from a callback at scrape time.
+    """
+    def __init__(self, name: str, documentation: str, callback: Optional[Callable[[], float]] = None) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    def value(self) -> float:
+        if self.callback is not None:
+            return float(self.callback())
+        with self._lock:
+            return self._value
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {_format_number(self.value())}",
+        ]
+
+class Histogram:
+    """
+    Labelled duration histogram backed by a timing.HistogramFamily.
+    """
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        family: Optional[HistogramFamily] = None,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.family = family or HistogramFamily(DEFAULT_BUCKETS)
+
+    def observe(self, seconds: float, *label_values: str) -> None:
+        self.family.observe(label_values, seconds)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, histogram in sorted(self.family.snapshot().items(), key=lambda item: str(item[0])):
+            label_values = key if isinstance(key, tuple) else (key,)
+            for bound, count in histogram.cumulative():
+                labels = _format_labels(self.labels, label_values, f'le="{_format_number(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labels, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {histogram.count}")
+            plain = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{plain} {_format_number(histogram.total)}")
+            lines.append(f"{self.name}_count{plain} {histogram.count}")
+        return lines
+
+def _resident_memory_bytes() -> float:
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+        return float(resident_pages * os.sysconf("SC_PAGE_SIZE"))
+    except (OSError, ValueError, IndexError):
+        # Peak RSS (KiB on Linux) when /proc is unavailable
+        return float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "stickerline_http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    labels=("method", "route"),
+)
+HTTP_REQUESTS_TOTAL = Counter(
+    "stickerline_http_requests_total",
+    "HTTP requests by route template and status code.",
+    labels=("method", "route", "status"),
+)
+GENERATION_QUEUE_DEPTH = Gauge(
+    "stickerline_generation_queue_depth",
+    "Generation jobs waiting for a generation slot.",
+)
+GENERATION_IN_PROGRESS = Gauge(
+    "stickerline_generation_in_progress",
+    "Generation jobs currently holding a generation slot.",
+)
+GENERATION_CONCURRENCY_LIMIT = Gauge(
+    "stickerline_generation_concurrency_limit",
+    "Configured GENERATION_CONCURRENCY.",
+)
+GENERATION_MEMORY_BUDGET = Gauge(
+    "stickerline_generation_memory_budget_bytes",
+    "Memory budget generation jobs are admitted against.",
+)
+GENERATION_MEMORY_RESERVED = Gauge(
+    "stickerline_generation_memory_reserved_bytes",
+    "Estimated peak memory of the generation jobs currently admitted.",
+)
+GENERATION_ADMISSION_REJECTED_TOTAL = Counter(
+    "stickerline_generation_admission_rejected_total",
+    "Generation jobs rejected by memory admission control.",
+    labels=("reason",),
+)
+AI_CALL_DURATION = Histogram(
+    "stickerline_ai_call_duration_seconds",
+    "Latency of individual AI provider calls (one per attempt).",
+    labels=("provider",),
+)
+AI_CALLS_TOTAL = Counter(
+    "stickerline_ai_calls_total",
+    "AI provider calls by outcome (success, retryable_error, error).",
+    labels=("provider", "outcome"),
+)
+AI_RETRIES_TOTAL = Counter(
+    "stickerline_ai_retries_total",
+    "Retries scheduled after a retryable AI provider error.",
+    labels=("provider",),
+)
+AI_FALLBACKS_TOTAL = Counter(
+    "stickerline_ai_fallbacks_total",
+    "Fallback provider activations.",
+    labels=("from_provider", "to_provider"),
+)
+SIGNED_URLS_TOTAL = Counter(
+    "stickerline_signed_urls_total",
+    "Signed URLs generated. Each one is computed fresh; there is no signed-URL cache.",
+)
+USER_CACHE_REQUESTS_TOTAL = Counter(
+    "stickerline_user_cache_requests_total",
+    "User document reads served from the per-instance cache (hit) or Firestore (miss).",
+    labels=("result",),
+)
+STAGE_DURATION = Histogram(
+    "stickerline_stage_duration_seconds",
+    "Duration of generation pipeline stages (job.*, ai.*, image.*).",
+    labels=("stage",),
+    family=STAGE_HISTOGRAMS,
+)
+EVENT_LOOP_LAG = Histogram(
+    "stickerline_event_loop_lag_seconds",
+    "How late the event loop woke up from the lag monitor's sleep.",
+)
+EVENT_LOOP_STALLS_TOTAL = Counter(
+    "stickerline_event_loop_stalls_total",
+    "Lag monitor wake-ups later than LOOP_LAG_THRESHOLD_SECONDS.",
+)
+# Callbacks are installed by app.utils.storage, which imports this module
+GCS_HTTP_POOL_MAX_CONNECTIONS = Gauge(
+    "stickerline_gcs_http_pool_max_connections",
+    "Kept-alive connection slots in the HTTP pools of GCS clients created so far.",
+)
+GCS_HTTP_POOL_IN_USE = Gauge(
+    "stickerline_gcs_http_pool_in_use_connections",
+    "GCS HTTP connections currently checked out of their pool.",
+)
+GCS_HTTP_POOL_IDLE = Gauge(
+    "stickerline_gcs_http_pool_idle_connections",
+    "Open GCS HTTP connections waiting in their pool for reuse.",
+)
+PROCESS_RESIDENT_MEMORY = Gauge(
+    "process_resident_memory_bytes",
+    "Resident set size of this process.",
+    callback=_resident_memory_bytes,
+)
+
+METRICS = [
+    HTTP_REQUEST_DURATION,
+    HTTP_REQUESTS_TOTAL,
+    GENERATION_QUEUE_DEPTH,
+    GENERATION_IN_PROGRESS,
+    GENERATION_CONCURRENCY_LIMIT,
+    GENERATION_MEMORY_BUDGET,
+    GENERATION_MEMORY_RESERVED,
+    GENERATION_ADMISSION_REJECTED_TOTAL,
+    AI_CALL_DURATION,
+    AI_CALLS_TOTAL,
+    AI_RETRIES_TOTAL,
+    AI_FALLBACKS_TOTAL,
+    SIGNED_URLS_TOTAL,
+    USER_CACHE_REQUESTS_TOTAL,
+    STAGE_DURATION,
+    EVENT_LOOP_LAG,
+    EVENT_LOOP_STALLS_TOTAL,
+    GCS_HTTP_POOL_MAX_CONNECTIONS,
+    GCS_HTTP_POOL_IN_USE,
+    GCS_HTTP_POOL_IDLE,
+    PROCESS_RESIDENT_MEMORY,
+]
+
+def render_metrics() -> str:
+    """
+    Render every registered metric in the Prometheus text exposition format.
+    """
+    lines: list[str] = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
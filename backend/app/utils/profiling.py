@@ -0,0 +1,245 @@
+import asyncio
+import cProfile
+import logging
+import marshal
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+MODES = ("sampling", "cprofile")
+SCOPES = ("time", "requests", "jobs")
+
+# (file basename, function) leaf frames of threads that are parked, not working
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+
+class ProfilerBusyError(Exception):
+    pass
+
+_LIBRARY_PREFIX = re.compile(r"^.*/(?:site-packages|dist-packages|lib/python\d+\.\d+)/")
+_APP_PREFIX = re.compile(r"^.*/(?=app/)")
+
+def format_frame(frame) -> str:
+    """
+    'function (path:line)' with the interpreter, site-packages and repo prefixes trimmed from the path.
+    """
+    code = frame.f_code
+    filename, count = _LIBRARY_PREFIX.subn("", code.co_filename)
+    if not count:
+        filename = _APP_PREFIX.sub("", filename)
+    # ';' separates frames in the folded format
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+class _StackSampler(threading.Thread):
+    """
+    Samples the stacks of every thread at a fixed interval and counts them as folded stacks.
+    Covers the event loop thread and the asyncio.to_thread workers alike.
+    """
+    def __init__(self, interval: float, include_idle: bool) -> None:
+        super().__init__(name="stack-sampler", daemon=True)
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        own_ident = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                leaf = (frame.f_code.co_filename.rsplit("/", 1)[-1], frame.f_code.co_name)
+                if not self.include_idle and leaf in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(format_frame(frame))
+                    frame = frame.f_back
+                stack.append(thread_names.get(ident, f"thread-{ident}"))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join(timeout=5)
+
+    def folded(self) -> bytes:
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+@dataclass
+class ProfileSession:
+    profile_id: str
+    mode: str
+    scope: str
+    target_count: int
+    duration_seconds: float
+    interval_ms: float
+    include_idle: bool
+    started_at: datetime
+    status: str = "running"
+    completed_units: int = 0
+    stop_reason: Optional[str] = None
+    finished_at: Optional[datetime] = None
+    samples: int = 0
+    output: Optional[bytes] = field(default=None, repr=False)
+
+    @property
+    def filename(self) -> str:
+        extension = "folded.txt" if self.mode == "sampling" else "prof"
+        return f"profile-{self.profile_id}.{extension}"
+
+    @property
+    def content_type(self) -> str:
+        return "text/plain; charset=utf-8" if self.mode == "sampling" else "application/octet-stream"
+
+    def summary(self) -> dict:
+        return {
+            "profile_id": self.profile_id,
+            "mode": self.mode,
+            "scope": self.scope,
+            "target_count": self.target_count,
+            "duration_seconds": self.duration_seconds,
+            "status": self.status,
+            "completed_units": self.completed_units,
+            "stop_reason": self.stop_reason,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "samples": self.samples,
+            "output_bytes": len(self.output) if self.output else 0,
+            "filename": self.filename,
+        }
+
+class Profiler:
+    """
+    Runs at most one profiling session per process and keeps the last few results in memory.
+
+    A session stops when its duration elapses or, for the "requests"/"jobs" scopes,
+    after target_count units have finished, whichever comes first.
+    Sampling output is folded stacks (speedscope, flamegraph.pl, inferno).
+    cProfile output is a marshalled pstats file (snakeviz, flameprof, pstats).
+
+    start/stop/unit_finished must be called on the event loop thread: cProfile only
+    profiles the thread that enabled it. Image processing (process_sticker_grid) and
+    other asyncio.to_thread work run on worker threads, so cProfile sees only their
+    await; use sampling mode to profile them.
+    """
+    def __init__(self, keep: int = 5) -> None:
+        self.keep = keep
+        self.sessions: "OrderedDict[str, ProfileSession]" = OrderedDict()
+        self._active: Optional[ProfileSession] = None
+        self._sampler: Optional[_StackSampler] = None
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._deadline: Optional[asyncio.TimerHandle] = None
+        self._started_monotonic = 0.0
+
+    @property
+    def active(self) -> Optional[ProfileSession]:
+        return self._active
+
+    def start(
+        self,
+        mode: str,
+        scope: str,
+        duration_seconds: float,
+        target_count: int = 0,
+        interval_ms: float = 10.0,
+        include_idle: bool = False,
+    ) -> ProfileSession:
+        if self._active is not None:
+            raise ProfilerBusyError(f"Profile {self._active.profile_id} is still running.")
+        if mode not in MODES:
+            raise ValueError(f"Unsupported profiling mode: {mode}")
+        if scope not in SCOPES:
+            raise ValueError(f"Unsupported profiling scope: {scope}")
+
+        session = ProfileSession(
+            profile_id=uuid.uuid4().hex[:12],
+            mode=mode,
+            scope=scope,
+            target_count=target_count if scope != "time" else 0,
+            duration_seconds=duration_seconds,
+            interval_ms=interval_ms,
+            include_idle=include_idle,
+            started_at=datetime.now(timezone.utc),
+        )
+        if mode == "sampling":
+            self._sampler = _StackSampler(interval_ms / 1000, include_idle)
+            self._sampler.start()
+        else:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+        self._active = session
+        self._started_monotonic = time.monotonic()
+        self._deadline = asyncio.get_running_loop().call_later(duration_seconds, self.stop, "duration")
+        self.sessions[session.profile_id] = session
+        while len(self.sessions) > self.keep:
+            self.sessions.popitem(last=False)
+        logger.info(f"Started {mode} profile {session.profile_id} (scope={scope}, duration={duration_seconds}s)")
+        return session
+
+    def unit_finished(self, scope: str) -> None:
+        """
+        Called when a request or job finishes; stops the session once enough have been seen.
+        """
+        session = self._active
+        if session is None or session.scope != scope:
+            return
+        session.completed_units += 1
+        if session.completed_units >= session.target_count:
+            self.stop(f"{session.completed_units} {scope}")
+
+    def stop(self, reason: str = "stopped") -> Optional[ProfileSession]:
+        session = self._active
+        if session is None:
+            return None
+        self._active = None
+        if self._deadline is not None:
+            self._deadline.cancel()
+            self._deadline = None
+
+        try:
+            if self._sampler is not None:
+                self._sampler.stop()
+                session.samples = self._sampler.samples
+                session.output = self._sampler.folded()
+            elif self._cprofile is not None:
+                self._cprofile.disable()
+                self._cprofile.create_stats()
+                # Same bytes pstats.Stats.dump_stats would write
+                session.output = marshal.dumps(self._cprofile.stats)
+            session.status = "completed"
+        except Exception as e:
+            logger.error(f"Failed to collect profile {session.profile_id}: {e}")
+            session.status = "failed"
+        finally:
+            self._sampler = None
+            self._cprofile = None
+
+        session.stop_reason = reason
+        session.finished_at = datetime.now(timezone.utc)
+        logger.info(
+            f"Profile {session.profile_id} finished after {time.monotonic() - self._started_monotonic:.1f}s "
+            f"({reason}, {len(session.output or b'')} bytes)"
+        )
+        return session
+
+    def get(self, profile_id: str) -> Optional[ProfileSession]:
+        return self.sessions.get(profile_id)
+
+PROFILER = Profiler()
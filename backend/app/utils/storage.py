@@ -1,10 +1,50 @@
+from __future__ import annotations
+
 import logging
 import datetime
-from google.cloud import storage
+import weakref
 from app.core.config import settings
+from app.utils.lazy import lazy_import
+from app.utils.metrics import GCS_HTTP_POOL_IDLE, GCS_HTTP_POOL_IN_USE, GCS_HTTP_POOL_MAX_CONNECTIONS, SIGNED_URLS_TOTAL
+
+storage = lazy_import("google.cloud.storage")
 
 logger = logging.getLogger(__name__)
 
+# Live clients, read by the HTTP pool gauges at scrape time
+_clients: weakref.WeakSet = weakref.WeakSet()
+
+def http_pool_stats() -> dict[str, int]:
+    """
+    Connection counts summed over the urllib3 pools behind every live StorageClient.
+
+    A pool's queue holds one entry per kept-alive slot: an idle connection, or
+    None for a slot never filled. Slots missing from the queue are checked out.
+    """
+    stats = {"max": 0, "in_use": 0, "idle": 0}
+    for client in list(_clients):
+        # Read without the _http property, which would open a session just to report it
+        session = getattr(client.client, "_http_internal", None)
+        if session is None:
+            continue
+        for adapter in list(session.adapters.values()):
+            pools = getattr(getattr(adapter, "poolmanager", None), "pools", None)
+            if pools is None:
+                continue
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None or pool.pool is None:
+                    continue
+                slots = list(pool.pool.queue)
+                stats["max"] += pool.pool.maxsize
+                stats["in_use"] += max(pool.pool.maxsize - len(slots), 0)
+                stats["idle"] += sum(1 for conn in slots if conn is not None)
+    return stats
+
+GCS_HTTP_POOL_MAX_CONNECTIONS.callback = lambda: http_pool_stats()["max"]
+GCS_HTTP_POOL_IN_USE.callback = lambda: http_pool_stats()["in_use"]
+GCS_HTTP_POOL_IDLE.callback = lambda: http_pool_stats()["idle"]
+
 class StorageClient:
     def __init__(self):
         try:
@@ -12,6 +52,7 @@ class StorageClient:
             self.client = storage.Client(project=settings.PROJECT_ID)
             self.bucket_name = settings.GCS_BUCKET_NAME
             self.bucket = self.client.bucket(self.bucket_name)
+            _clients.add(self)
             logger.info("Storage Client initialized successfully.")
         except Exception as e:
             logger.error(f"Failed to initialize Storage Client: {e}")
@@ -23,10 +64,10 @@ class StorageClient:
         Returns the signed URL valid for 1 hour.
         """
         try:
-            blob = self.bucket.blob(destination_blob_name)
-            blob.upload_from_string(file_bytes, content_type=content_type)
-            
+            blob = self.upload_bytes(file_bytes, destination_blob_name, content_type=content_type)
+
             # Generate a signed URL valid for 1 hour for secure frontend access
+            SIGNED_URLS_TOTAL.inc()
             url = blob.generate_signed_url(
                 version="v4",
                 expiration=datetime.timedelta(hours=1),
@@ -39,21 +80,82 @@ class StorageClient:
             logger.error(f"Failed to upload file to GCS: {e}")
             raise e
 
+    def upload_bytes(self, file_bytes: bytes, destination_blob_name: str, content_type: str = "image/png") -> storage.Blob:
+        """
+        Upload data to GCS without signing a URL for it.
+        """
+        blob = self.bucket.blob(destination_blob_name)
+        blob.upload_from_string(file_bytes, content_type=content_type)
+        return blob
+
+    def open_upload_stream(
+        self,
+        destination_blob_name: str,
+        content_type: str,
+        chunk_size: int = 256 * 1024,
+    ):
+        """
+        Open a GCS resumable upload for incremental writes.
+        At most chunk_size bytes are buffered before being sent.
+        chunk_size must be a multiple of 256 KiB.
+        """
+        blob = self.bucket.blob(destination_blob_name)
+        return blob.open("wb", content_type=content_type, chunk_size=chunk_size, ignore_flush=True)
+
+    def download_bytes(self, blob_name: str) -> bytes:
+        """
+        Download a blob from the configured bucket and return bytes.
+        """
+        return self.bucket.blob(blob_name).download_as_bytes()
+
+    def blob_exists(self, blob_name: str) -> bool:
+        """
+        Check whether a blob exists in the configured bucket.
+        """
+        return self.bucket.blob(blob_name).exists()
+
+    def touch_blob(self, blob_name: str) -> None:
+        """
+        Set the blob's custom time to now, marking it as recently used without rewriting it.
+        """
+        blob = self.bucket.blob(blob_name)
+        blob.custom_time = datetime.datetime.now(datetime.timezone.utc)
+        blob.patch()
+
+    def copy_blob(self, source_blob_name: str, destination_blob_name: str) -> None:
+        """
+        Server-side copy within the configured bucket.
+        """
+        self.bucket.copy_blob(self.bucket.blob(source_blob_name), self.bucket, destination_blob_name)
+
+    def delete_blob(self, blob_name: str) -> None:
+        """
+        Delete a blob from the configured bucket.
+        """
+        self.bucket.blob(blob_name).delete()
+
     def list_blobs(self, prefix: str) -> list[storage.Blob]:
         """
         List blobs in the bucket by prefix.
         """
         return list(self.bucket.list_blobs(prefix=prefix))
 
-    def generate_signed_url(self, blob_name: str, expires_hours: int = 1) -> str:
+    def generate_signed_url(
+        self,
+        blob_name: str,
+        expires_hours: int = 1,
+        response_disposition: str | None = None,
+    ) -> str:
         """
         Generate a signed URL for an existing blob.
         """
         blob = self.bucket.blob(blob_name)
+        SIGNED_URLS_TOTAL.inc()
         return blob.generate_signed_url(
             version="v4",
             expiration=datetime.timedelta(hours=expires_hours),
-            method="GET"
+            method="GET",
+            response_disposition=response_disposition,
         )
 
     def download_gcs_uri(self, gcs_uri: str) -> bytes:
@@ -0,0 +1,114 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional, Union
+
+# Histogram keys: a stage name, or a tuple of label values for multi-label families
+HistogramKey = Union[str, tuple[str, ...]]
+
+# Upper bounds in seconds; covers per-cell image work (ms) up to AI calls with backoff (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+class Histogram:
+    """
+    Fixed-bucket histogram (cumulative on export, Prometheus style).
+    """
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        running = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+    def copy(self) -> "Histogram":
+        clone = Histogram(self.buckets)
+        clone.counts = list(self.counts)
+        clone.count = self.count
+        clone.total = self.total
+        return clone
+
+class HistogramFamily:
+    """
+    Process-wide histograms keyed by a label (stage name, route, ...).
+    Safe to use from worker threads (image processing runs off the event loop).
+    """
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms: dict[HistogramKey, Histogram] = {}
+
+    def observe(self, key: HistogramKey, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def snapshot(self) -> dict[HistogramKey, Histogram]:
+        with self._lock:
+            return {key: histogram.copy() for key, histogram in self._histograms.items()}
+
+STAGE_HISTOGRAMS = HistogramFamily()
+
+class StageTimer:
+    """
+    Accumulates stage durations for one unit of work (a generation job).
+    Repeated stages (per-cell work, retries, Firestore writes) are summed.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.durations: dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    def as_millis(self) -> dict[str, float]:
+        with self._lock:
+            return {stage: round(seconds * 1000, 1) for stage, seconds in self.durations.items()}
+
+_current_timer: ContextVar[Optional[StageTimer]] = ContextVar("stage_timer", default=None)
+
+def start_job_timer() -> StageTimer:
+    """
+    Bind a fresh StageTimer to the current context so spans opened anywhere
+    below (AIService, ImageProcessor, threads started via asyncio.to_thread)
+    are attributed to it. Each job runs in its own task, so the binding
+    ends with the task.
+    """
+    timer = StageTimer()
+    _current_timer.set(timer)
+    return timer
+
+def record(stage: str, seconds: float) -> None:
+    STAGE_HISTOGRAMS.observe(stage, seconds)
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.add(stage, seconds)
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Time a block. Works around awaits as well as synchronous code.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
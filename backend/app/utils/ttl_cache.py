@@ -0,0 +1,81 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+class TTLCache:
+    """
+    Small in-process cache with per-entry expiry and LRU eviction.
+
+    Values are deep-copied in and out, so callers can mutate what they get
+    back. Thread-safe: invalidations may come from a Firestore listener thread.
+    """
+    def __init__(self, ttl_seconds: float, max_entries: int = 10000) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        # Bumped on invalidation, so a read that started before a write cannot re-cache stale data
+        self._generations: dict[Hashable, int] = {}
+        # Bumped by invalidate_all(); part of every key's generation
+        self._epoch = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if self.ttl_seconds <= 0:
+            return None
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return copy.deepcopy(value)
+
+    def generation(self, key: Hashable) -> int:
+        with self._lock:
+            return self._epoch + self._generations.get(key, 0)
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        """
+        Store a value. With `generation` (from generation() before the read), the value
+        is dropped if the key was invalidated while it was being read.
+        """
+        if self.ttl_seconds <= 0:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            if generation is not None and self._epoch + self._generations.get(key, 0) != generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+            if len(self._generations) > self.max_entries * 2:
+                # Only in-flight reads compare generations; old counters can go
+                self._generations.clear()
+
+    def invalidate_all(self) -> None:
+        """
+        Drop every entry, and like invalidate() keep reads already in flight from re-caching.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,75 @@
+"""
+Generation worker service.
+
+Run with `uvicorn app.worker:app`. Consumes the generation queue filled by the
+API service (PROCESS_ROLE=api) and runs AIService + ImageProcessor. The HTTP
+server only exists for health checks, /metrics and the admin API, which is
+where profiles with scope=jobs and loop-lag readings come from once the roles
+are split.
+"""
+import logging
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI
+from fastapi.responses import Response
+from app.api.v1 import admin
+from app.api.v1.admin import require_admin
+from app.core import warmup
+from app.core.config import settings
+from app.services.generation_worker import GenerationWorker
+from app.services.user_cache import UserCacheListener
+from app.utils import loop_monitor, metrics
+from app.utils.profiling import PROFILER
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    monitor = None
+    if settings.LOOP_LAG_MONITOR_ENABLED:
+        monitor = loop_monitor.start_monitor(
+            interval=settings.LOOP_LAG_INTERVAL_SECONDS,
+            threshold=settings.LOOP_LAG_THRESHOLD_SECONDS,
+        )
+
+    # Load the model before claiming jobs so the first job doesn't pay for it
+    components = warmup.parse_components(settings.WARMUP_COMPONENTS, role="worker")
+    if components:
+        await warmup.run_warmup(components)
+
+    cache_listener = None
+    if settings.USER_CACHE_LISTENER_ENABLED:
+        # Sticker resets and top-ups made through the API service then reach this cache at once
+        cache_listener = UserCacheListener()
+        await cache_listener.start()
+    worker = GenerationWorker()
+    app.state.worker = worker
+    worker.start()
+
+    yield
+
+    await worker.stop()
+    if cache_listener is not None:
+        cache_listener.stop()
+    PROFILER.stop("shutdown")
+    if monitor is not None:
+        await monitor.stop()
+
+app = FastAPI(
+    title="StickerLine AI Worker",
+    description="Sticker generation worker for StickerLine AI",
+    version="1.0.0",
+    lifespan=lifespan,
+)
+
+@app.get("/")
+async def root():
+    """Health check endpoint for Cloud Run."""
+    return {"status": "ok", "service": "stickerline-worker", **app.state.worker.stats()}
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_admin)])
+async def prometheus_metrics():
+    """Prometheus scrape endpoint. Scrapers send the ADMIN_API_TOKEN bearer token."""
+    metrics.GENERATION_CONCURRENCY_LIMIT.set(max(1, settings.GENERATION_CONCURRENCY))
+    return Response(content=metrics.render_metrics(), media_type=metrics.CONTENT_TYPE)
+
+app.include_router(admin.router, prefix="/api/v1/admin", tags=["admin"], include_in_schema=False)
@@ -0,0 +1,594 @@
+"""
+In-memory stand-ins for GCS, Firestore and the AI provider, for exercising the API offline.
+
+Only the surface the app uses is implemented. Storage and Firestore calls can be
+given an artificial latency so contention looks closer to production; storage
+latency is a blocking sleep because the real client blocks too.
+"""
+import asyncio
+import copy
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Optional
+
+from google.api_core import exceptions as gax_exceptions
+from google.cloud import firestore
+from google.cloud.firestore_v1 import transforms
+
+from app.services.ai_service import AIService
+from app.utils import timing
+from app.utils.metrics import SIGNED_URLS_TOTAL
+
+FAKE_SIGNED_URL_BASE = "https://storage.fake.local"
+
+# ---------------------------------------------------------------------------
+# Storage
+# ---------------------------------------------------------------------------
+
+@dataclass
+class FakeBlob:
+    name: str
+    size: int
+    content_type: str
+
+class FakeUploadStream:
+    """
+    Mimics the BlobWriter returned by StorageClient.open_upload_stream:
+    nothing is visible until close(), terminate() discards the upload.
+    """
+    def __init__(self, storage: "FakeStorageClient", blob_name: str, content_type: str) -> None:
+        self._storage = storage
+        self._blob_name = blob_name
+        self._content_type = content_type
+        self._buffer = bytearray()
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed upload stream.")
+        self._storage._delay("stream_write")
+        self._buffer.extend(data)
+        return len(data)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self._storage.upload_bytes(bytes(self._buffer), self._blob_name, content_type=self._content_type)
+
+    def terminate(self) -> None:
+        self.closed = True
+        self._buffer.clear()
+
+class FakeStorageClient:
+    """
+    Drop-in for app.utils.storage.StorageClient backed by a dict.
+    """
+    def __init__(self, bucket_name: str = "fake-bucket", latency: float = 0.0) -> None:
+        self.bucket_name = bucket_name
+        self.latency = max(0.0, latency)
+        self.operations: Counter = Counter()
+        self._lock = threading.Lock()
+        self._objects: dict[str, tuple[bytes, str]] = {}
+
+    def _delay(self, operation: str) -> None:
+        with self._lock:
+            self.operations[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _read(self, blob_name: str) -> bytes:
+        with self._lock:
+            stored = self._objects.get(blob_name)
+        if stored is None:
+            raise gax_exceptions.NotFound(f"No such object: {self.bucket_name}/{blob_name}")
+        return stored[0]
+
+    def upload_file(self, file_bytes: bytes, destination_blob_name: str, content_type: str = "image/png") -> str:
+        self.upload_bytes(file_bytes, destination_blob_name, content_type=content_type)
+        return self.generate_signed_url(destination_blob_name)
+
+    def upload_bytes(self, file_bytes: bytes, destination_blob_name: str, content_type: str = "image/png") -> FakeBlob:
+        self._delay("upload")
+        with self._lock:
+            self._objects[destination_blob_name] = (bytes(file_bytes), content_type)
+        return FakeBlob(destination_blob_name, len(file_bytes), content_type)
+
+    def open_upload_stream(self, destination_blob_name: str, content_type: str, chunk_size: int = 256 * 1024) -> FakeUploadStream:
+        self._delay("open_upload_stream")
+        return FakeUploadStream(self, destination_blob_name, content_type)
+
+    def download_bytes(self, blob_name: str) -> bytes:
+        self._delay("download")
+        return self._read(blob_name)
+
+    def blob_exists(self, blob_name: str) -> bool:
+        self._delay("exists")
+        with self._lock:
+            return blob_name in self._objects
+
+    def touch_blob(self, blob_name: str) -> None:
+        self._delay("touch")
+        with self._lock:
+            if blob_name not in self._objects:
+                raise FileNotFoundError(blob_name)
+
+    def copy_blob(self, source_blob_name: str, destination_blob_name: str) -> None:
+        self._delay("copy")
+        data = self._read(source_blob_name)
+        with self._lock:
+            self._objects[destination_blob_name] = (data, self._objects[source_blob_name][1])
+
+    def delete_blob(self, blob_name: str) -> None:
+        self._delay("delete")
+        with self._lock:
+            if self._objects.pop(blob_name, None) is None:
+                raise gax_exceptions.NotFound(f"No such object: {self.bucket_name}/{blob_name}")
+
+    def list_blobs(self, prefix: str) -> list[FakeBlob]:
+        self._delay("list")
+        with self._lock:
+            return [
+                FakeBlob(name, len(data), content_type)
+                for name, (data, content_type) in sorted(self._objects.items())
+                if name.startswith(prefix)
+            ]
+
+    def generate_signed_url(self, blob_name: str, expires_hours: int = 1, response_disposition: str | None = None) -> str:
+        # Signing is local CPU work in the real client, so no artificial latency
+        SIGNED_URLS_TOTAL.inc()
+        with self._lock:
+            self.operations["sign"] += 1
+        return f"{FAKE_SIGNED_URL_BASE}/{self.bucket_name}/{blob_name}?expires={expires_hours}h"
+
+    def download_gcs_uri(self, gcs_uri: str) -> bytes:
+        if not gcs_uri.startswith("gs://"):
+            raise ValueError(f"Invalid GCS URI: {gcs_uri}")
+        path = gcs_uri[len("gs://"):]
+        if "/" not in path:
+            raise ValueError(f"Invalid GCS URI: {gcs_uri}")
+        _, blob_name = path.split("/", 1)
+        return self.download_bytes(blob_name)
+
+    def object_count(self) -> int:
+        with self._lock:
+            return len(self._objects)
+
+    def stored_bytes(self) -> int:
+        with self._lock:
+            return sum(len(data) for data, _ in self._objects.values())
+
+# ---------------------------------------------------------------------------
+# Firestore
+# ---------------------------------------------------------------------------
+
+def _get_path(data: dict, field_path: str) -> Any:
+    value: Any = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            raise KeyError(field_path)
+        value = value[part]
+    return value
+
+def _apply_field(data: dict, field_path: str, value: Any) -> None:
+    parts = field_path.split(".")
+    target = data
+    for part in parts[:-1]:
+        target = target.setdefault(part, {})
+    key = parts[-1]
+    if value is transforms.DELETE_FIELD:
+        target.pop(key, None)
+    elif value is transforms.SERVER_TIMESTAMP:
+        target[key] = datetime.now(timezone.utc)
+    elif isinstance(value, transforms.Increment):
+        target[key] = target.get(key, 0) + value.value
+    else:
+        target[key] = copy.deepcopy(value)
+
+def _project(data: dict, field_paths: Optional[list[str]]) -> dict:
+    if not field_paths:
+        return data
+    projected: dict = {}
+    for field_path in field_paths:
+        try:
+            _apply_field(projected, field_path, _get_path(data, field_path))
+        except KeyError:
+            continue
+    return projected
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference: "FakeDocumentReference", data: Optional[dict]) -> None:
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[dict]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str) -> Any:
+        if self._data is None:
+            raise KeyError(field_path)
+        return copy.deepcopy(_get_path(self._data, field_path))
+
+class FakeDocumentReference:
+    def __init__(self, client: "FakeFirestore", path: str) -> None:
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, collection_id: str) -> "FakeCollectionReference":
+        return FakeCollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    async def get(self, field_paths: Optional[list[str]] = None, transaction=None, **kwargs) -> FakeDocumentSnapshot:
+        await self._client._delay("read")
+        data = self._client._read(self.path)
+        return FakeDocumentSnapshot(self, _project(data, field_paths) if data is not None else None)
+
+    async def set(self, document_data: dict, merge: bool = False) -> None:
+        await self._client._delay("write")
+        self._client._set(self.path, document_data, merge)
+
+    async def update(self, field_updates: dict) -> None:
+        await self._client._delay("write")
+        self._client._update(self.path, field_updates)
+
+    async def delete(self) -> None:
+        await self._client._delay("write")
+        self._client._delete(self.path)
+
+class FakeQuery:
+    _OPERATORS = {
+        "==": lambda a, b: a == b,
+        "!=": lambda a, b: a != b,
+        "<": lambda a, b: a < b,
+        "<=": lambda a, b: a <= b,
+        ">": lambda a, b: a > b,
+        ">=": lambda a, b: a >= b,
+        "in": lambda a, b: a in b,
+        "not-in": lambda a, b: a not in b,
+        "array_contains": lambda a, b: isinstance(a, list) and b in a,
+    }
+
+    def __init__(self, client: "FakeFirestore", collection_path: str) -> None:
+        self._client = client
+        self._collection_path = collection_path
+        self._filters: list[tuple[str, str, Any]] = []
+        self._orders: list[tuple[str, str]] = []
+        self._limit: Optional[int] = None
+        self._start_after: Optional[dict] = None
+        self._field_paths: Optional[list[str]] = None
+
+    def _copy(self) -> "FakeQuery":
+        clone = FakeQuery(self._client, self._collection_path)
+        clone._filters = list(self._filters)
+        clone._orders = list(self._orders)
+        clone._limit = self._limit
+        clone._start_after = self._start_after
+        clone._field_paths = self._field_paths
+        return clone
+
+    def where(self, field_path: Optional[str] = None, op_string: Optional[str] = None, value: Any = None, *, filter=None) -> "FakeQuery":
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string not in self._OPERATORS:
+            raise ValueError(f"Unsupported operator in fake Firestore: {op_string}")
+        clone = self._copy()
+        clone._filters.append((field_path, op_string, value))
+        return clone
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING") -> "FakeQuery":
+        clone = self._copy()
+        clone._orders.append((field_path, direction))
+        return clone
+
+    def limit(self, count: int) -> "FakeQuery":
+        clone = self._copy()
+        clone._limit = count
+        return clone
+
+    def start_after(self, document_fields_or_snapshot) -> "FakeQuery":
+        clone = self._copy()
+        if isinstance(document_fields_or_snapshot, FakeDocumentSnapshot):
+            clone._start_after = document_fields_or_snapshot._data or {}
+        else:
+            clone._start_after = dict(document_fields_or_snapshot)
+        return clone
+
+    def select(self, field_paths: list[str]) -> "FakeQuery":
+        clone = self._copy()
+        clone._field_paths = list(field_paths)
+        return clone
+
+    def _matches(self, data: dict) -> bool:
+        for field_path, op_string, value in self._filters:
+            try:
+                actual = _get_path(data, field_path)
+            except KeyError:
+                return False
+            try:
+                if not self._OPERATORS[op_string](actual, value):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    def _run(self) -> list[tuple[str, dict]]:
+        rows = [(path, data) for path, data in self._client._children(self._collection_path) if self._matches(data)]
+        # Apply orderings last-to-first so the first order_by is the primary key (stable sort)
+        rows.sort(key=lambda item: item[0])
+        for field_path, direction in reversed(self._orders):
+            rows.sort(
+                key=lambda item, f=field_path: (_safe_get(item[1], f) is None, _safe_get(item[1], f)),
+                reverse=direction == firestore.Query.DESCENDING,
+            )
+        if self._start_after is not None and self._orders:
+            cursor = tuple(_safe_get(self._start_after, field_path) for field_path, _ in self._orders)
+            for position, (_, data) in enumerate(rows):
+                if tuple(_safe_get(data, field_path) for field_path, _ in self._orders) == cursor:
+                    rows = rows[position + 1:]
+                    break
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return rows
+
+    async def stream(self, transaction=None):
+        await self._client._delay("query")
+        for path, data in self._run():
+            yield FakeDocumentSnapshot(FakeDocumentReference(self._client, path), _project(data, self._field_paths))
+
+    async def get(self, transaction=None) -> list[FakeDocumentSnapshot]:
+        return [snapshot async for snapshot in self.stream()]
+
+def _safe_get(data: dict, field_path: str) -> Any:
+    try:
+        return _get_path(data, field_path)
+    except KeyError:
+        return None
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client: "FakeFirestore", path: str) -> None:
+        super().__init__(client, path)
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, document_id: Optional[str] = None) -> FakeDocumentReference:
+        return FakeDocumentReference(self._client, f"{self.path}/{document_id or uuid.uuid4().hex[:20]}")
+
+class FakeWriteBatch:
+    """
+    Buffers writes and applies them together. Also serves as the transaction object.
+    """
+    def __init__(self, client: "FakeFirestore") -> None:
+        self._client = client
+        self._writes: list[tuple[str, FakeDocumentReference, Any]] = []
+
+    def set(self, reference: FakeDocumentReference, document_data: dict, merge: bool = False) -> None:
+        self._writes.append(("merge" if merge else "set", reference, document_data))
+
+    def update(self, reference: FakeDocumentReference, field_updates: dict) -> None:
+        self._writes.append(("update", reference, field_updates))
+
+    def delete(self, reference: FakeDocumentReference) -> None:
+        self._writes.append(("delete", reference, None))
+
+    def _apply(self) -> None:
+        writes, self._writes = self._writes, []
+        for operation, reference, payload in writes:
+            if operation in ("set", "merge"):
+                self._client._set(reference.path, payload, merge=operation == "merge")
+            elif operation == "update":
+                self._client._update(reference.path, payload)
+            else:
+                self._client._delete(reference.path)
+
+    async def commit(self) -> None:
+        await self._client._delay("write")
+        self._apply()
+
+class FakeTransaction(FakeWriteBatch):
+    pass
+
+class FakeFirestore:
+    """
+    Drop-in for the firestore.AsyncClient returned by app.utils.firestore.get_db.
+    Transactions are serialized (see async_transactional below), which is
+    stricter than Firestore's optimistic concurrency but never less correct.
+    """
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = max(0.0, latency)
+        self.operations: Counter = Counter()
+        self._lock = threading.Lock()
+        self._documents: dict[str, dict] = {}
+        self._transaction_lock: Optional[asyncio.Lock] = None
+
+    async def _delay(self, operation: str) -> None:
+        self.operations[operation] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _read(self, path: str) -> Optional[dict]:
+        with self._lock:
+            data = self._documents.get(path)
+            return copy.deepcopy(data) if data is not None else None
+
+    def _set(self, path: str, document_data: dict, merge: bool) -> None:
+        with self._lock:
+            current = self._documents.get(path) if merge else None
+            data = copy.deepcopy(current) if current is not None else {}
+            for key, value in document_data.items():
+                _apply_field(data, key, value)
+            self._documents[path] = data
+
+    def _update(self, path: str, field_updates: dict) -> None:
+        with self._lock:
+            data = self._documents.get(path)
+            if data is None:
+                raise gax_exceptions.NotFound(f"No document to update: {path}")
+            for field_path, value in field_updates.items():
+                _apply_field(data, field_path, value)
+
+    def _delete(self, path: str) -> None:
+        with self._lock:
+            self._documents.pop(path, None)
+
+    def _children(self, collection_path: str) -> list[tuple[str, dict]]:
+        depth = collection_path.count("/") + 1
+        prefix = collection_path + "/"
+        with self._lock:
+            return [
+                (path, copy.deepcopy(data))
+                for path, data in self._documents.items()
+                if path.startswith(prefix) and path.count("/") == depth
+            ]
+
+    def collection(self, collection_id: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, collection_id)
+
+    def document(self, document_path: str) -> FakeDocumentReference:
+        return FakeDocumentReference(self, document_path)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def transaction(self, **kwargs) -> FakeTransaction:
+        return FakeTransaction(self)
+
+    def document_count(self, collection_id: str) -> int:
+        return len(self._children(collection_id))
+
+def async_transactional(to_wrap):
+    """
+    Replacement for firestore.async_transactional that works with FakeTransaction.
+    """
+    async def wrapper(transaction: FakeTransaction, *args, **kwargs):
+        client = transaction._client
+        if client._transaction_lock is None:
+            client._transaction_lock = asyncio.Lock()
+        async with client._transaction_lock:
+            result = await to_wrap(transaction, *args, **kwargs)
+            transaction._apply()
+            return result
+    return wrapper
+
+def _firestore_module_shim() -> ModuleType:
+    shim = ModuleType(firestore.__name__)
+    shim.__dict__.update(vars(firestore))
+    shim.async_transactional = async_transactional
+    return shim
+
+# ---------------------------------------------------------------------------
+# AI provider
+# ---------------------------------------------------------------------------
+
+def load_canned_grids(grid_dir: Optional[str] = None, size: int = 1024, count: int = 3) -> list[bytes]:
+    """
+    PNG grids returned by FakeAIService: every *.png in grid_dir, or synthetic grids.
+    """
+    if grid_dir:
+        grids = [path.read_bytes() for path in sorted(Path(grid_dir).glob("*.png"))]
+        if not grids:
+            raise ValueError(f"No PNG grids found in {grid_dir}")
+        return grids
+
+    from bench.synthetic_grid import GridSpec, encode_png, make_grid
+    return [encode_png(make_grid(GridSpec(size=size, gutter=14, margin=24, seed=seed))) for seed in range(count)]
+
+class FakeAIService(AIService):
+    """
+    AIService whose provider call sleeps and returns a canned grid instead of calling Vertex.
+    Retries, backoff, metrics and the rate-limit user message go through the real AIService code.
+    """
+    def __init__(
+        self,
+        storage_client: FakeStorageClient,
+        grids: list[bytes],
+        latency: float = 20.0,
+        latency_jitter: float = 5.0,
+        rate_limit_ratio: float = 0.0,
+        error_ratio: float = 0.0,
+        max_retries: int = 2,
+        retry_base_delay: float = 2.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        # AIService.__init__ is skipped on purpose: it would initialise a real provider
+        self.provider = "fake"
+        self.max_retries = max(0, max_retries)
+        self.retry_base_delay = max(0.0, retry_base_delay)
+        self.fallback_provider = ""
+        self.fallback_max_retries = 0
+        self.gemini_api_key = None
+        self.model_id = "fake-grid-model"
+        self.model = None
+        self.generation_config = None
+
+        self.storage_client = storage_client
+        self.grids = grids
+        self.latency = max(0.0, latency)
+        self.latency_jitter = max(0.0, latency_jitter)
+        self.rate_limit_ratio = rate_limit_ratio
+        self.error_ratio = error_ratio
+        self.calls: Counter = Counter()
+        self._rng = random.Random(seed)
+
+    async def generate_sticker_grid(self, image_uri: str, style_id: str, extra_prompt: Optional[str]) -> bytes:
+        self._resolve_style_prompt(style_id)
+        with timing.span("ai.load_image"):
+            await asyncio.to_thread(self.storage_client.download_gcs_uri, image_uri)
+
+        try:
+            return await self._generate_with_retry(self._fake_call, provider_label="Fake AI", provider="fake")
+        except Exception as e:
+            if self._is_retryable_error(e):
+                raise RuntimeError(self.RATE_LIMIT_USER_MESSAGE) from e
+            raise
+
+    async def _fake_call(self) -> bytes:
+        self.calls["attempts"] += 1
+        await asyncio.sleep(max(0.0, self._rng.gauss(self.latency, self.latency_jitter)))
+        roll = self._rng.random()
+        if roll < self.rate_limit_ratio:
+            self.calls["rate_limited"] += 1
+            raise gax_exceptions.ResourceExhausted("429 Resource exhausted (injected by FakeAIService)")
+        if roll < self.rate_limit_ratio + self.error_ratio:
+            self.calls["errors"] += 1
+            raise ValueError("API returned success but no image data was found.")
+        self.calls["success"] += 1
+        return self._rng.choice(self.grids)
+
+# ---------------------------------------------------------------------------
+# Wiring
+# ---------------------------------------------------------------------------
+
+def install_fakes(app, storage: FakeStorageClient, db: FakeFirestore) -> None:
+    """
+    Point the app at the fakes: the get_db singleton, the storage
+    dependencies of every router, and firestore.async_transactional.
+    The AI service is handed to the GenerationWorker directly.
+    """
+    from app.api.v1 import stickers, upload
+    from app.utils import firestore as firestore_utils
+
+    wrapper = object.__new__(firestore_utils.AsyncFirestoreClientWrapper)
+    wrapper._client = db
+    firestore_utils.AsyncFirestoreClientWrapper._instance = wrapper
+
+    shim = _firestore_module_shim()
+    for name, module in list(sys.modules.items()):
+        # Matches both the real module and app.utils.lazy stand-ins for it
+        if name.startswith("app.") and getattr(getattr(module, "firestore", None), "__name__", None) == firestore.__name__:
+            module.firestore = shim
+
+    app.dependency_overrides[stickers.get_storage_client] = lambda: storage
+    app.dependency_overrides[upload.get_storage_client] = lambda: storage
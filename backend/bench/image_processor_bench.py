@@ -0,0 +1,212 @@
+"""
+Benchmark ImageProcessor.process_sticker_grid on synthetic grids.
+
+Runs offline on CPU. With --stub-models the rembg matting model is replaced by a
+deterministic chroma key, so results are comparable across machines and the
+golden check catches behaviour changes in the OpenCV stages.
+
+    cd backend
+    python -m bench.image_processor_bench --stub-models --sizes 1k,2k --iterations 5
+    python -m bench.image_processor_bench --stub-models --check-golden
+    python -m bench.image_processor_bench --stub-models --update-golden
+"""
+import argparse
+import json
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+import types
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from bench.synthetic_grid import GOLDEN_SPECS, SIZES, GridSpec, default_specs, encode_png, make_grid
+
+GOLDEN_DIR = Path(__file__).parent / "golden"
+FINGERPRINT_SIZE = 8
+GOLDEN_TOLERANCE = 8
+
+def _stub_remove(cv_img: np.ndarray, session=None) -> np.ndarray:
+    """
+    Stand-in for rembg.remove: alpha is 0 on chroma green, 255 elsewhere.
+    """
+    b, g, r = cv2.split(cv_img)
+    green = (g >= 180) & (r <= 90) & (b <= 90)
+    alpha = np.where(green, 0, 255).astype(np.uint8)
+    return cv2.merge([b, g, r, alpha])
+
+def _load_processor(stub_models: bool):
+    stub = types.ModuleType("rembg")
+    stub.remove = _stub_remove
+    stub.new_session = lambda *args, **kwargs: None
+    if stub_models:
+        # Lets image_service import even where rembg/onnxruntime are not installed
+        sys.modules.setdefault("rembg", stub)
+    from app.services import image_service
+
+    if stub_models:
+        image_service.rembg = stub
+    return image_service.ImageProcessor()
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def _fingerprint(sticker_png: bytes) -> dict:
+    image = cv2.imdecode(np.frombuffer(sticker_png, np.uint8), cv2.IMREAD_UNCHANGED)
+    alpha = image[:, :, 3]
+    small = cv2.resize(alpha, (FINGERPRINT_SIZE, FINGERPRINT_SIZE), interpolation=cv2.INTER_AREA)
+    opaque = alpha > 0
+    mean_bgr = [int(round(v)) for v in image[:, :, :3][opaque].mean(axis=0)] if opaque.any() else [0, 0, 0]
+    return {"alpha": small.flatten().tolist(), "mean_bgr": mean_bgr, "shape": list(image.shape[:2])}
+
+def _compare(expected: dict, actual: dict) -> list[str]:
+    problems = []
+    if expected["shape"] != actual["shape"]:
+        problems.append(f"shape {actual['shape']} != {expected['shape']}")
+    alpha_diff = max(abs(a - b) for a, b in zip(expected["alpha"], actual["alpha"]))
+    if alpha_diff > GOLDEN_TOLERANCE:
+        problems.append(f"alpha fingerprint differs by {alpha_diff}")
+    color_diff = max(abs(a - b) for a, b in zip(expected["mean_bgr"], actual["mean_bgr"]))
+    if color_diff > GOLDEN_TOLERANCE:
+        problems.append(f"mean colour differs by {color_diff}")
+    return problems
+
+def run_case(processor, spec: GridSpec, iterations: int, warmup: int, measure_memory: bool) -> dict:
+    from app.utils import timing
+
+    grid_png = encode_png(make_grid(spec))
+
+    for _ in range(warmup):
+        processor.process_sticker_grid(grid_png)
+
+    latencies: list[float] = []
+    stage_totals: dict[str, list[float]] = {}
+    for _ in range(iterations):
+        timer = timing.start_job_timer()
+        start = time.perf_counter()
+        processor.process_sticker_grid(grid_png)
+        latencies.append(time.perf_counter() - start)
+        for stage, millis in timer.as_millis().items():
+            stage_totals.setdefault(stage, []).append(millis)
+
+    result = {
+        "case": spec.name,
+        "grid_bytes": len(grid_png),
+        "iterations": iterations,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50) * 1000, 1),
+            "p90": round(_percentile(latencies, 90) * 1000, 1),
+            "p99": round(_percentile(latencies, 99) * 1000, 1),
+            "mean": round(statistics.mean(latencies) * 1000, 1),
+        },
+        "grids_per_second": round(iterations / sum(latencies), 3),
+        "stickers_per_second": round(16 * iterations / sum(latencies), 2),
+        "stage_mean_ms": {stage: round(statistics.mean(values), 1) for stage, values in sorted(stage_totals.items())},
+    }
+
+    if measure_memory:
+        # Separate pass: tracemalloc slows allocation-heavy code noticeably
+        tracemalloc.start()
+        processor.process_sticker_grid(grid_png)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_traced_mb"] = round(peak / (1024 * 1024), 1)
+    return result
+
+def check_golden(processor, golden_path: Path, update: bool) -> list[str]:
+    actual = {}
+    for spec in GOLDEN_SPECS:
+        stickers = processor.process_sticker_grid(encode_png(make_grid(spec)))
+        actual[spec.name] = [_fingerprint(sticker) for sticker in stickers]
+
+    if update:
+        golden_path.parent.mkdir(parents=True, exist_ok=True)
+        golden_path.write_text(json.dumps(actual, separators=(",", ":")) + "\n")
+        print(f"Golden fingerprints written to {golden_path}")
+        return []
+
+    if not golden_path.exists():
+        return [f"{golden_path} does not exist; run with --update-golden first"]
+
+    expected = json.loads(golden_path.read_text())
+    failures = []
+    for case, fingerprints in expected.items():
+        if case not in actual:
+            failures.append(f"{case}: missing from current run")
+            continue
+        if len(actual[case]) != len(fingerprints):
+            failures.append(f"{case}: {len(actual[case])} stickers, expected {len(fingerprints)}")
+            continue
+        for index, (want, got) in enumerate(zip(fingerprints, actual[case])):
+            for problem in _compare(want, got):
+                failures.append(f"{case} sticker {index}: {problem}")
+    return failures
+
+def _print_table(results: list[dict]) -> None:
+    header = f"{'case':<36}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'grids/s':>10}{'peak MB':>10}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        latency = result["latency_ms"]
+        peak = result.get("peak_traced_mb", "-")
+        print(
+            f"{result['case']:<36}{latency['p50']:>10}{latency['p90']:>10}{latency['p99']:>10}"
+            f"{result['grids_per_second']:>10}{peak:>10}"
+        )
+    print()
+    for result in results:
+        stages = ", ".join(f"{stage}={millis}" for stage, millis in result["stage_mean_ms"].items())
+        print(f"{result['case']}: {stages}")
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1k,2k", help=f"Comma-separated subset of {','.join(SIZES)}")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--stub-models", action="store_true", help="Replace rembg with a deterministic chroma key")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc peak-memory pass")
+    parser.add_argument("--check-golden", action="store_true", help="Fail if outputs drift from golden fingerprints")
+    parser.add_argument("--update-golden", action="store_true", help="Rewrite golden fingerprints from this run")
+    parser.add_argument("--json", dest="json_path", help="Also write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip().lower() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"Unknown sizes: {', '.join(unknown)}")
+
+    processor = _load_processor(args.stub_models)
+    golden_path = GOLDEN_DIR / ("stub.json" if args.stub_models else "rembg.json")
+
+    if args.check_golden or args.update_golden:
+        failures = check_golden(processor, golden_path, update=args.update_golden)
+        if failures:
+            print("Golden check FAILED:")
+            for failure in failures:
+                print(f"  {failure}")
+            return 1
+        if args.check_golden:
+            print(f"Golden check passed ({golden_path.name})")
+        return 0
+
+    results = [
+        run_case(processor, spec, args.iterations, args.warmup, measure_memory=not args.no_memory)
+        for spec in default_specs(sizes)
+    ]
+    _print_table(results)
+    print(f"\nmax RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB "
+          f"(models {'stubbed' if args.stub_models else 'real'})")
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps({"stub_models": args.stub_models, "results": results}, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
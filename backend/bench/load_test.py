@@ -0,0 +1,367 @@
+"""
+End-to-end load test of the sticker flow against in-memory fakes.
+
+The FastAPI app runs in-process behind httpx's ASGI transport with fake GCS,
+Firestore and AI provider (bench/fakes.py), so no Vertex quota is spent and no
+real data is touched. Every virtual user runs
+
+    sync -> upload (stream) -> generate -> poll until done -> download ZIP
+
+and the run reports throughput, per-step latency percentiles, end-to-end job
+latency and failures grouped by step and cause.
+
+    cd backend
+    python -m bench.load_test --users 50 --jobs-per-user 2 --stub-models
+    python -m bench.load_test --users 200 --ai-latency 20 --rate-limit-ratio 0.2 --generation-concurrency 4
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import resource
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from bench.image_processor_bench import _load_processor, _percentile
+
+STEPS = ("sync", "upload", "generate", "poll", "download")
+
+@dataclass
+class Recorder:
+    step_latencies: dict[str, list[float]] = field(default_factory=lambda: {step: [] for step in STEPS})
+    step_failures: Counter = field(default_factory=Counter)
+    job_latencies: list[float] = field(default_factory=list)
+    tier_latencies: dict[str, list[float]] = field(default_factory=dict)
+    job_outcomes: Counter = field(default_factory=Counter)
+    job_errors: Counter = field(default_factory=Counter)
+    max_queue_depth: float = 0.0
+    max_in_progress: float = 0.0
+
+    def failure(self, step: str, detail: str) -> None:
+        self.step_failures[(step, detail[:120])] += 1
+
+def _make_selfie(index: int) -> bytes:
+    """
+    Small JPEG that differs per user, so uploads are not deduplicated unless asked.
+    """
+    rng = np.random.default_rng(index)
+    image = np.full((1024, 768, 3), rng.integers(60, 200, size=3), dtype=np.uint8)
+    cv2.circle(image, (384, 420), 220, (150, 180, 230), -1)
+    cv2.putText(image, f"user {index}", (220, 900), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 4)
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    if not ok:
+        raise ValueError("Failed to encode synthetic selfie.")
+    return buffer.tobytes()
+
+def _describe(response) -> str:
+    try:
+        detail = response.json().get("detail")
+    except Exception:
+        detail = None
+    return f"HTTP {response.status_code}" + (f": {detail}" if detail else "")
+
+async def _request(client, recorder: Recorder, step: str, method: str, url: str, ok_statuses=(200, 201), **kwargs):
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+    except Exception as e:
+        recorder.step_latencies[step].append(time.perf_counter() - start)
+        recorder.failure(step, f"{type(e).__name__}: {e}")
+        return None
+    recorder.step_latencies[step].append(time.perf_counter() - start)
+    if response.status_code not in ok_statuses:
+        recorder.failure(step, _describe(response))
+        return None
+    return response
+
+def _is_paying_user(index: int, paid_ratio: float) -> bool:
+    # Spread paying users evenly through the ramp-up instead of front-loading them
+    return int((index + 1) * paid_ratio) > int(index * paid_ratio)
+
+async def _seed_user(db, user_id: str, coins: int, total_spent_thb: float = 0.0) -> None:
+    from app.models.user import UserInDB
+
+    now = datetime.now(timezone.utc)
+    user = UserInDB(
+        line_id=user_id,
+        display_name=user_id,
+        coin_balance=coins,
+        total_spent_thb=total_spent_thb,
+        is_free_trial_used=True,
+        created_at=now,
+        updated_at=now,
+    )
+    await db.collection("users").document(user_id).set(user.model_dump())
+
+async def run_user(client, recorder: Recorder, args, user_index: int, selfie: bytes, start_delay: float) -> None:
+    await asyncio.sleep(start_delay)
+    user_id = f"loadtest-{user_index:05d}"
+
+    response = await _request(
+        client, recorder, "sync", "POST", "/api/v1/auth/sync",
+        json={"line_id": user_id, "display_name": f"Load Test {user_index}"},
+    )
+    if response is None:
+        recorder.job_outcomes["not_started"] += args.jobs_per_user
+        return
+
+    for _ in range(args.jobs_per_user):
+        headers = {"Content-Type": "image/jpeg"}
+        if args.send_digest:
+            headers["X-Content-SHA256"] = hashlib.sha256(selfie).hexdigest()
+        response = await _request(
+            client, recorder, "upload", "POST", "/api/v1/upload/stream?filename=selfie.jpg",
+            content=selfie, headers=headers,
+        )
+        if response is None:
+            recorder.job_outcomes["not_started"] += 1
+            continue
+        image_uri = response.json()["gcs_uri"]
+
+        job_start = time.perf_counter()
+        response = await _request(
+            client, recorder, "generate", "POST", "/api/v1/jobs/generate",
+            json={"user_id": user_id, "image_uri": image_uri, "style": args.style, "prompt": ""},
+        )
+        if response is None:
+            recorder.job_outcomes["rejected"] += 1
+            continue
+        job_id = response.json()["job_id"]
+        tier = response.json().get("tier", "unknown")
+
+        deadline = job_start + args.job_timeout
+        job_status = None
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(args.poll_interval)
+            response = await _request(client, recorder, "poll", "GET", f"/api/v1/jobs/{job_id}")
+            if response is None:
+                continue
+            body = response.json()
+            if body.get("status") in ("completed", "failed", "cancelled", "timed_out"):
+                job_status = body["status"]
+                if job_status != "completed":
+                    recorder.job_errors[str(body.get("error", "unknown"))[:120]] += 1
+                break
+
+        if job_status is None:
+            recorder.job_outcomes["timed_out"] += 1
+            continue
+        recorder.job_outcomes[job_status] += 1
+        recorder.job_latencies.append(time.perf_counter() - job_start)
+        recorder.tier_latencies.setdefault(tier, []).append(time.perf_counter() - job_start)
+
+        if job_status == "completed":
+            await _request(
+                client, recorder, "download", "GET", f"/api/v1/jobs/current/download?user_id={user_id}",
+                ok_statuses=(200, 307),
+            )
+
+async def _watch_generation_queue(recorder: Recorder, interval: float = 0.05) -> None:
+    from app.utils import metrics
+
+    while True:
+        recorder.max_queue_depth = max(recorder.max_queue_depth, metrics.GENERATION_QUEUE_DEPTH.value())
+        recorder.max_in_progress = max(recorder.max_in_progress, metrics.GENERATION_IN_PROGRESS.value())
+        await asyncio.sleep(interval)
+
+def _latency_summary(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": round(_percentile(values, 50) * 1000, 1),
+        "p90_ms": round(_percentile(values, 90) * 1000, 1),
+        "p99_ms": round(_percentile(values, 99) * 1000, 1),
+        "max_ms": round(max(values) * 1000, 1),
+    }
+
+def _stage_means() -> dict[str, float]:
+    from app.utils.timing import STAGE_HISTOGRAMS
+
+    return {
+        stage: round(histogram.total / histogram.count * 1000, 1)
+        for stage, histogram in sorted(STAGE_HISTOGRAMS.snapshot().items())
+        if histogram.count
+    }
+
+def _print_report(report: dict) -> None:
+    jobs = report["jobs"]
+    print(f"\n{report['users']} users x {report['jobs_per_user']} jobs in {report['wall_seconds']}s "
+          f"(generation concurrency {report['generation_concurrency']})")
+    print(f"jobs: {dict(jobs['outcomes'])}")
+    print(f"throughput: {jobs['completed_per_minute']} completed jobs/min, "
+          f"max queue depth {report['max_queue_depth']:.0f}, max in progress {report['max_in_progress']:.0f}")
+    print(f"job latency (generate -> terminal status): {jobs['latency']}")
+    for tier, latency in jobs["latency_by_tier"].items():
+        print(f"  {tier:>8}: {latency}")
+
+    header = f"\n{'step':<10}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print("-" * (len(header) - 1))
+    for step, summary in report["steps"].items():
+        if not summary["count"]:
+            continue
+        print(f"{step:<10}{summary['count']:>8}{summary['p50_ms']:>10}{summary['p90_ms']:>10}"
+              f"{summary['p99_ms']:>10}{summary['max_ms']:>10}")
+
+    if report["request_failures"]:
+        print("\nrequest failures:")
+        for failure in report["request_failures"]:
+            print(f"  {failure['count']:>6}  {failure['step']:<10}{failure['detail']}")
+    if jobs["errors"]:
+        print("\njob failures:")
+        for error, count in jobs["errors"].items():
+            print(f"  {count:>6}  {error}")
+
+    print(f"\nfake AI calls: {report['ai_calls']}")
+    print(f"fake storage: {report['storage']}")
+    print(f"fake firestore: {report['firestore']}")
+    print("\nstage means (ms): " + ", ".join(f"{stage}={millis}" for stage, millis in report["stage_mean_ms"].items()))
+    print(f"max RSS: {report['max_rss_mb']} MB")
+
+async def run(args) -> dict:
+    from app.core.config import settings
+
+    # GENERATION_SEMAPHORE is sized at import time, so settings must be patched first
+    settings.GENERATION_CONCURRENCY = args.generation_concurrency
+    settings.GENERATION_COOLDOWN_SECONDS = args.cooldown
+    processor = _load_processor(args.stub_models)
+
+    import httpx
+    from app.api.v1 import upload
+    from app.main import app
+    from app.services.generation_worker import GenerationWorker
+    from bench.fakes import FakeAIService, FakeFirestore, FakeStorageClient, install_fakes, load_canned_grids
+
+    storage = FakeStorageClient(bucket_name=settings.GCS_BUCKET_NAME, latency=args.storage_latency_ms / 1000)
+    db = FakeFirestore(latency=args.firestore_latency_ms / 1000)
+    ai_service = FakeAIService(
+        storage_client=storage,
+        grids=load_canned_grids(args.grid_dir),
+        latency=args.ai_latency,
+        latency_jitter=args.ai_latency_jitter,
+        rate_limit_ratio=args.rate_limit_ratio,
+        error_ratio=args.error_ratio,
+        max_retries=args.ai_max_retries,
+        retry_base_delay=args.ai_retry_base_delay,
+        seed=args.seed,
+    )
+    install_fakes(app, storage, db)
+    app.dependency_overrides[upload.get_image_processor] = lambda: processor
+    # ASGITransport does not run the lifespan, so start the generation worker here
+    worker = GenerationWorker(
+        ai_service=ai_service,
+        image_processor=processor,
+        storage_client=storage,
+        concurrency=args.generation_concurrency,
+    )
+    worker.start()
+
+    shared_selfie = _make_selfie(0) if args.shared_selfie else None
+    for index in range(args.users):
+        await _seed_user(
+            db, f"loadtest-{index:05d}", coins=args.jobs_per_user,
+            total_spent_thb=args.paid_spend if _is_paying_user(index, args.paid_ratio) else 0.0,
+        )
+
+    recorder = Recorder()
+    watcher = asyncio.create_task(_watch_generation_queue(recorder))
+    transport = httpx.ASGITransport(app=app)
+    start = time.perf_counter()
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.job_timeout) as client:
+        await asyncio.gather(*(
+            run_user(
+                client, recorder, args, index,
+                selfie=shared_selfie or _make_selfie(index),
+                start_delay=args.ramp_up * index / max(1, args.users),
+            )
+            for index in range(args.users)
+        ))
+    wall = time.perf_counter() - start
+    watcher.cancel()
+    await worker.stop()
+
+    completed = recorder.job_outcomes["completed"]
+    return {
+        "users": args.users,
+        "jobs_per_user": args.jobs_per_user,
+        "generation_concurrency": args.generation_concurrency,
+        "wall_seconds": round(wall, 2),
+        "jobs": {
+            "outcomes": dict(recorder.job_outcomes),
+            "completed_per_minute": round(completed / wall * 60, 2) if wall else 0.0,
+            "latency": _latency_summary(recorder.job_latencies),
+            "latency_by_tier": {tier: _latency_summary(values) for tier, values in sorted(recorder.tier_latencies.items())},
+            "errors": dict(recorder.job_errors.most_common()),
+        },
+        "steps": {step: _latency_summary(values) for step, values in recorder.step_latencies.items()},
+        "request_failures": [
+            {"step": step, "detail": detail, "count": count}
+            for (step, detail), count in recorder.step_failures.most_common()
+        ],
+        "max_queue_depth": recorder.max_queue_depth,
+        "max_in_progress": recorder.max_in_progress,
+        "ai_calls": dict(ai_service.calls),
+        "storage": {"objects": storage.object_count(), "bytes": storage.stored_bytes(), **storage.operations},
+        "firestore": dict(db.operations),
+        "stage_mean_ms": _stage_means(),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),
+    }
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    load = parser.add_argument_group("load")
+    load.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    load.add_argument("--jobs-per-user", type=int, default=1)
+    load.add_argument("--ramp-up", type=float, default=0.0, help="Seconds over which user start times are spread")
+    load.add_argument("--poll-interval", type=float, default=1.0)
+    load.add_argument("--job-timeout", type=float, default=600.0, help="Give up polling a job after this many seconds")
+    load.add_argument("--style", default="chibi_2d")
+    load.add_argument("--paid-ratio", type=float, default=0.0, help="Share of users seeded as paying customers")
+    load.add_argument("--paid-spend", type=float, default=100.0, help="total_spent_thb given to paying users")
+    load.add_argument("--shared-selfie", action="store_true", help="All users upload the same image (exercises dedup)")
+    load.add_argument("--send-digest", action="store_true", help="Send X-Content-SHA256 like the web client does")
+
+    server = parser.add_argument_group("server")
+    server.add_argument("--generation-concurrency", type=int, default=2)
+    server.add_argument("--cooldown", type=int, default=0, help="GENERATION_COOLDOWN_SECONDS")
+    server.add_argument("--stub-models", action="store_true", help="Replace rembg with a deterministic chroma key")
+
+    fakes = parser.add_argument_group("fakes")
+    fakes.add_argument("--ai-latency", type=float, default=20.0, help="Mean seconds per fake AI call")
+    fakes.add_argument("--ai-latency-jitter", type=float, default=5.0, help="Std dev of fake AI call latency")
+    fakes.add_argument("--rate-limit-ratio", type=float, default=0.0, help="Fraction of AI calls failing with 429")
+    fakes.add_argument("--error-ratio", type=float, default=0.0, help="Fraction of AI calls returning no image")
+    fakes.add_argument("--ai-max-retries", type=int, default=2)
+    fakes.add_argument("--ai-retry-base-delay", type=float, default=2.0)
+    fakes.add_argument("--grid-dir", help="Directory of PNG grids to return instead of synthetic ones")
+    fakes.add_argument("--storage-latency-ms", type=float, default=20.0)
+    fakes.add_argument("--firestore-latency-ms", type=float, default=10.0)
+    fakes.add_argument("--seed", type=int, default=0)
+
+    parser.add_argument("--log-level", default="CRITICAL", help="App log level during the run")
+    parser.add_argument("--max-failure-ratio", type=float, default=1.0,
+                        help="Exit non-zero if more than this fraction of jobs did not complete")
+    parser.add_argument("--json", dest="json_path", help="Also write the report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper())
+    report = asyncio.run(run(args))
+    _print_report(report)
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(report, indent=2))
+
+    total_jobs = args.users * args.jobs_per_user
+    failed_ratio = 1 - report["jobs"]["outcomes"].get("completed", 0) / max(1, total_jobs)
+    return 1 if failed_ratio > args.max_failure_ratio else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Deterministic synthetic 4x4 green-screen sticker grids for benchmarking ImageProcessor.
+"""
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+GREEN_BGR = (0, 255, 0)
+SIZES = {"1k": 1024, "2k": 2048, "4k": 4096}
+
+@dataclass(frozen=True)
+class GridSpec:
+    size: int = 1024
+    gutter: int = 0          # green gutter between cells (px at 1K, scaled with size)
+    margin: int = 0          # solid green padding around the grid (px at 1K, scaled with size)
+    noise: float = 0.0       # gaussian noise sigma applied to the whole grid
+    debris: int = 0          # small non-green specks scattered per cell
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        label = next((key for key, value in SIZES.items() if value == self.size), str(self.size))
+        parts = [label]
+        if self.gutter:
+            parts.append(f"gutter{self.gutter}")
+        if self.margin:
+            parts.append(f"margin{self.margin}")
+        if self.noise:
+            parts.append(f"noise{self.noise:g}")
+        if self.debris:
+            parts.append(f"debris{self.debris}")
+        return "-".join(parts)
+
+def _draw_character(cell: np.ndarray, rng: np.random.Generator, index: int) -> None:
+    height, width = cell.shape[:2]
+    cx, cy = width // 2, int(height * 0.45)
+    # Saturated non-green palette so the subject never matches the chroma key
+    body = tuple(int(v) for v in rng.integers(40, 220, size=3))
+    body = (body[0], min(body[1], 150), body[2])
+    skin = (150, 180, 230)
+
+    cv2.ellipse(cell, (cx, int(height * 0.72)), (int(width * 0.22), int(height * 0.18)), 0, 0, 360, body, -1)
+    cv2.circle(cell, (cx, cy), int(min(width, height) * 0.2), skin, -1)
+    cv2.circle(cell, (cx, cy), int(min(width, height) * 0.2), (20, 20, 20), max(2, width // 120))
+    eye_dx = int(width * 0.07)
+    for dx in (-eye_dx, eye_dx):
+        cv2.circle(cell, (cx + dx, cy - int(height * 0.02)), max(2, width // 60), (10, 10, 10), -1)
+    # Pose variation: a raised arm whose angle depends on the cell index
+    angle = np.deg2rad(20 * (index % 8) - 70)
+    arm_end = (int(cx + np.cos(angle) * width * 0.3), int(height * 0.65 - np.sin(angle) * height * 0.25))
+    cv2.line(cell, (cx, int(height * 0.65)), arm_end, body, max(4, width // 30))
+    # Caption plate (white box with dark text), like the Thai captions the model adds
+    plate_top = int(height * 0.86)
+    cv2.rectangle(cell, (int(width * 0.2), plate_top), (int(width * 0.8), int(height * 0.95)), (255, 255, 255), -1)
+    cv2.putText(
+        cell, f"#{index}", (int(width * 0.4), int(height * 0.93)),
+        cv2.FONT_HERSHEY_SIMPLEX, width / 500, (0, 0, 0), max(1, width // 200),
+    )
+
+def make_grid(spec: GridSpec) -> np.ndarray:
+    """
+    Render a BGR grid image for the spec. The same spec always yields the same pixels.
+    """
+    rng = np.random.default_rng(spec.seed)
+    scale = spec.size / 1024
+    margin = int(round(spec.margin * scale))
+    gutter = int(round(spec.gutter * scale))
+
+    grid = np.full((spec.size, spec.size, 3), GREEN_BGR, dtype=np.uint8)
+    inner = spec.size - 2 * margin
+    cell_size = (inner - 3 * gutter) // 4
+
+    for row in range(4):
+        for col in range(4):
+            y0 = margin + row * (cell_size + gutter)
+            x0 = margin + col * (cell_size + gutter)
+            cell = grid[y0:y0 + cell_size, x0:x0 + cell_size]
+            _draw_character(cell, rng, row * 4 + col)
+            for _ in range(spec.debris):
+                dx, dy = (int(v) for v in rng.integers(0, cell_size - 4, size=2))
+                radius = int(rng.integers(1, 4))
+                cv2.circle(cell, (dx, dy), radius, (255, 0, 255), -1)
+
+    if spec.noise:
+        noise = rng.normal(0, spec.noise, grid.shape)
+        grid = np.clip(grid.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+    return grid
+
+def encode_png(grid: np.ndarray) -> bytes:
+    ok, buffer = cv2.imencode(".png", grid)
+    if not ok:
+        raise ValueError("Failed to encode synthetic grid.")
+    return buffer.tobytes()
+
+def default_specs(sizes: list[str]) -> list[GridSpec]:
+    """
+    Benchmark matrix: for each size, a clean grid, a gutter+margin grid and a noisy grid with debris.
+    """
+    specs = []
+    for label in sizes:
+        size = SIZES[label]
+        specs.append(GridSpec(size=size))
+        specs.append(GridSpec(size=size, gutter=14, margin=24))
+        specs.append(GridSpec(size=size, gutter=14, noise=6.0, debris=6, seed=1))
+    return specs
+
+# Fixed cases checked against golden fingerprints regardless of the sizes being benchmarked
+GOLDEN_SPECS = [
+    GridSpec(size=1024),
+    GridSpec(size=1024, gutter=14, margin=24),
+    GridSpec(size=1024, gutter=14, noise=6.0, debris=6, seed=1),
+]
@@ -0,0 +1,193 @@
+"""
+Export jobs, payments and transactions for analytics.
+
+Pages through each collection in updated-time order with a cursor and a field
+projection, writing each page to NDJSON or Parquet as it arrives, so memory
+stays at one page. A watermark file records how far each collection has been
+exported; the next run only fetches documents changed since then.
+
+    python script/export_analytics.py --out-dir exports [--format parquet] [--full]
+
+A document changed after it was exported is exported again by a later run;
+dedupe on the ID column, keeping the latest updated_at / timestamp.
+Parquet output needs pyarrow (pip install pyarrow).
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+PROJECT_ID = "skitkerline"
+
+# collection -> (field the watermark follows, exported fields)
+EXPORTS = {
+    "jobs": ("updated_at", {
+        "job_id": "string",
+        "user_id": "string",
+        "status": "string",
+        "tier": "string",
+        "error": "string",
+        "created_at": "timestamp",
+        "updated_at": "timestamp",
+    }),
+    "payments": ("updated_at", {
+        "charge_id": "string",
+        "user_id": "string",
+        "package_id": "string",
+        "amount_satang": "int64",
+        "thb_amount": "float64",
+        "coins": "int64",
+        "status": "string",
+        "created_at": "timestamp",
+        "updated_at": "timestamp",
+    }),
+    "transactions": ("timestamp", {
+        "txn_id": "string",
+        "user_id": "string",
+        "type": "string",
+        "amount": "int64",
+        "reference_id": "string",
+        "timestamp": "timestamp",
+    }),
+}
+
+class NdjsonExportWriter:
+    def __init__(self, path: str, _fields: dict):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, rows: list[dict]) -> None:
+        for row in rows:
+            self.file.write(json.dumps(row, default=lambda value: value.isoformat(), ensure_ascii=False))
+            self.file.write("\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+class ParquetExportWriter:
+    """
+    One row group per page, with a fixed schema so pages with missing fields still line up.
+    """
+    def __init__(self, path: str, fields: dict):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow: pip install pyarrow") from None
+        types = {
+            "string": pa.string(),
+            "int64": pa.int64(),
+            "float64": pa.float64(),
+            "timestamp": pa.timestamp("us", tz="UTC"),
+        }
+        self.pa = pa
+        self.schema = pa.schema([(name, types[kind]) for name, kind in fields.items()])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows: list[dict]) -> None:
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self) -> None:
+        self.writer.close()
+
+WRITERS = {"ndjson": NdjsonExportWriter, "parquet": ParquetExportWriter}
+
+def load_watermarks(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as watermark_file:
+        return json.load(watermark_file)
+
+def save_watermarks(path: str, watermarks: dict) -> None:
+    # Written only after every export finished, and atomically, so a failed run is simply repeated
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as watermark_file:
+        json.dump(watermarks, watermark_file, indent=2)
+    os.replace(tmp_path, path)
+
+def to_row(snapshot, fields: dict) -> dict:
+    data = snapshot.to_dict() or {}
+    row = {}
+    for name, kind in fields.items():
+        value = data.get(name)
+        if value is not None:
+            if kind == "int64":
+                value = int(value)
+            elif kind == "float64":
+                value = float(value)
+            elif kind == "string" and not isinstance(value, str):
+                value = str(value)
+            elif kind == "timestamp" and not isinstance(value, datetime):
+                value = None
+        row[name] = value
+    return row
+
+def export_collection(db, name: str, since: datetime | None, until: datetime, writer, page_size: int) -> int:
+    order_field, fields = EXPORTS[name]
+    query = db.collection(name).select(list(fields)).where(filter=FieldFilter(order_field, "<", until))
+    if since is not None:
+        # Inclusive: a document stamped exactly at the last watermark was excluded by that run's "<"
+        query = query.where(filter=FieldFilter(order_field, ">=", since))
+    # __name__ breaks ties, so the cursor never skips or repeats documents with equal timestamps
+    query = query.order_by(order_field).order_by("__name__").limit(page_size)
+
+    exported = 0
+    cursor = None
+    while True:
+        page = list((query.start_after(cursor) if cursor is not None else query).stream())
+        if not page:
+            break
+        writer.write([to_row(snapshot, fields) for snapshot in page])
+        exported += len(page)
+        cursor = page[-1]
+        if len(page) < page_size:
+            break
+    return exported
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--project", default=PROJECT_ID)
+    parser.add_argument("--out-dir", default="exports")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="ndjson")
+    parser.add_argument("--collections", default=",".join(EXPORTS), help="Comma-separated subset of jobs,payments,transactions")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and export everything")
+    parser.add_argument("--lag-seconds", type=int, default=60,
+                        help="Leave the most recent changes for the next run, so writes still in flight are not skipped")
+    args = parser.parse_args()
+
+    collections = [name.strip() for name in args.collections.split(",") if name.strip()]
+    unknown = set(collections) - set(EXPORTS)
+    if unknown:
+        raise SystemExit(f"Unknown collections: {', '.join(sorted(unknown))}")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    watermark_path = os.path.join(args.out_dir, "watermarks.json")
+    watermarks = {} if args.full else load_watermarks(watermark_path)
+    db = firestore.Client(project=args.project)
+    until = datetime.now(timezone.utc) - timedelta(seconds=args.lag_seconds)
+    run_id = until.strftime("%Y%m%dT%H%M%SZ")
+
+    for name in collections:
+        since = datetime.fromisoformat(watermarks[name]) if name in watermarks else None
+        path = os.path.join(args.out_dir, f"{name}-{run_id}.{args.format}")
+        started = time.monotonic()
+        writer = WRITERS[args.format](path, EXPORTS[name][1])
+        try:
+            exported = export_collection(db, name, since, until, writer, args.page_size)
+        finally:
+            writer.close()
+        if exported == 0:
+            os.remove(path)
+        watermarks[name] = until.isoformat()
+        print(
+            f"{name}: {exported} documents changed {'since ' + since.isoformat() if since else 'ever'}"
+            f" -> {path if exported else 'nothing written'} ({time.monotonic() - started:.1f}s)"
+        )
+
+    save_watermarks(watermark_path, watermarks)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""
+Delete unreferenced sticker artifacts and stale uploads from the bucket.
+
+Job artifacts (users/{uid}/jobs/{job_id}/...) are kept while they are
+referenced by the user's current sticker set (slots or ZIP), while their job
+is still queued or running, and for --min-age-hours after the job last
+changed. A superseded job's grid.png is kept as long as any of its stickers
+is still referenced. Blobs of jobs with no job document are deleted once old
+enough. Before a job's blobs are deleted, its job document stops pointing at
+them (grid_blob, archive_blob, result_slots, sticker_versions) and gets
+artifacts_deleted_at, so the API never signs URLs for missing objects.
+
+Uploads (temp/uploads/{digest}/...) are deleted once they have not been
+written or reused (the API sets custom time on reuse) for
+--upload-max-age-hours, unless a queued job still points at them; abandoned
+staging objects after an hour.
+
+    python script/gc_artifacts.py                 # dry run: report only
+    python script/gc_artifacts.py --delete [--max-deletes-per-second 200]
+"""
+import argparse
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore, storage
+
+PROJECT_ID = "skitkerline"
+BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME", "")
+
+ACTIVE_JOB_STATUSES = ("queued", "processing")
+UPLOAD_PREFIX = "temp/uploads/"
+STAGING_PREFIX = "temp/uploads/staging/"
+STAGING_MAX_AGE = timedelta(hours=1)
+LIST_FIELDS = "items(name,size,updated,customTime),nextPageToken"
+# GCS batch requests take at most 100 calls
+DELETE_BATCH_SIZE = 100
+# Firestore allows 500 writes per batch
+JOB_UPDATE_BATCH_SIZE = 400
+
+class RateLimiter:
+    """
+    Token bucket shared by the delete threads.
+    """
+    def __init__(self, per_second: float):
+        self.per_second = per_second
+        self.tokens = per_second
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count: int) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.per_second, self.tokens + (now - self.updated) * self.per_second)
+                self.updated = now
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return
+                wait = (count - self.tokens) / self.per_second
+            time.sleep(wait)
+
+class Deleter:
+    """
+    Collect doomed blobs and delete them in batches on a thread pool; in dry-run mode only count them.
+    """
+    def __init__(self, client: storage.Client, bucket: storage.Bucket, dry_run: bool, concurrency: int, per_second: float):
+        self.client = client
+        self.bucket = bucket
+        self.dry_run = dry_run
+        self.limiter = RateLimiter(per_second)
+        self.concurrency = max(1, concurrency)
+        self.pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.pending: list[str] = []
+        self.futures = []
+        self.counts: Counter = Counter()
+        self.bytes: Counter = Counter()
+        self.samples: dict[str, list[str]] = {}
+        self.deleted = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def add(self, blob, reason: str) -> None:
+        self.counts[reason] += 1
+        self.bytes[reason] += blob.size or 0
+        samples = self.samples.setdefault(reason, [])
+        if len(samples) < 5:
+            samples.append(blob.name)
+        if self.dry_run:
+            return
+        self.pending.append(blob.name)
+        if len(self.pending) >= DELETE_BATCH_SIZE:
+            self._submit()
+
+    def _submit(self) -> None:
+        names, self.pending = self.pending, []
+        # Bound the queued work so memory does not grow with the size of the bucket
+        self.futures = [future for future in self.futures if not future.done()]
+        while len(self.futures) >= self.concurrency * 2:
+            self.futures.pop(0).result()
+        self.futures.append(self.pool.submit(self._delete_batch, names))
+
+    def _delete_batch(self, names: list[str]) -> None:
+        self.limiter.acquire(len(names))
+        try:
+            with self.client.batch(raise_exception=False) as batch:
+                for name in names:
+                    self.bucket.delete_blob(name)
+            # finish() keeps the per-call responses; already-deleted blobs (404) are not failures
+            failed = sum(
+                1 for response in getattr(batch, "_responses", [])
+                if response.status_code >= 400 and response.status_code != 404
+            )
+        except Exception as e:
+            print(f"Batch delete failed ({len(names)} blobs): {e}")
+            failed = len(names)
+        with self.lock:
+            self.deleted += len(names) - failed
+            self.failed += failed
+
+    def close(self) -> None:
+        if self.pending:
+            self._submit()
+        for future in self.futures:
+            future.result()
+        self.pool.shutdown()
+
+def referenced_blobs(db, user_id: str) -> set[str]:
+    """
+    Blobs used by the user's current sticker set, including sets still stored on the user document.
+    """
+    snapshot = db.collection("sticker_sets").document(user_id).get(field_paths=["slots", "archive_blob"])
+    if snapshot.exists:
+        data = snapshot.to_dict() or {}
+        slots, archive_blob = data.get("slots") or [], data.get("archive_blob")
+    else:
+        user = db.collection("users").document(user_id).get(field_paths=["current_stickers", "current_stickers_archive_blob"])
+        data = (user.to_dict() or {}) if user.exists else {}
+        slots, archive_blob = data.get("current_stickers") or [], data.get("current_stickers_archive_blob")
+    names = {slot.get("blob_name") for slot in slots if isinstance(slot, dict) and slot.get("blob_name")}
+    if archive_blob:
+        names.add(archive_blob)
+    return names
+
+def job_manifests(db, job_ids: set[str]) -> dict[str, dict]:
+    refs = [db.collection("jobs").document(job_id) for job_id in job_ids]
+    fields = ["status", "updated_at", "grid_blob", "archive_blob", "result_slots", "sticker_versions"]
+    return {
+        snapshot.id: snapshot.to_dict() or {}
+        for snapshot in db.get_all(refs, field_paths=fields)
+        if snapshot.exists
+    }
+
+def job_cleanup(job: dict, doomed: set[str], now: datetime) -> dict:
+    """
+    Job document update that drops references to blobs about to be deleted.
+    """
+    update = {"artifacts_deleted_at": now}
+    for field in ("grid_blob", "archive_blob"):
+        if job.get(field) in doomed:
+            update[field] = None
+    slots = job.get("result_slots") or []
+    if any(isinstance(slot, dict) and slot.get("blob_name") in doomed for slot in slots):
+        update["result_slots"] = [
+            {**slot, "blob_name": None} if isinstance(slot, dict) and slot.get("blob_name") in doomed else slot
+            for slot in slots
+        ]
+    for version, record in (job.get("sticker_versions") or {}).items():
+        slots = (record or {}).get("slots") or []
+        if any(isinstance(slot, dict) and slot.get("blob_name") in doomed for slot in slots):
+            update[f"sticker_versions.{version}"] = firestore.DELETE_FIELD
+    return update
+
+def collect_user(db, deleter: Deleter, user_id: str, blobs_by_job: dict[str, list], cutoff: datetime, scanned: Counter) -> None:
+    referenced = referenced_blobs(db, user_id)
+    jobs = job_manifests(db, set(blobs_by_job))
+    doomed: list[tuple] = []
+    updates: list[tuple] = []
+    for job_id, blobs in blobs_by_job.items():
+        job = jobs.get(job_id)
+        if job is not None:
+            updated_at = job.get("updated_at")
+            if job.get("status") in ACTIVE_JOB_STATUSES or (updated_at is not None and updated_at > cutoff):
+                continue
+        # Stickers of this job still in the current set keep its grid for QA and reprocessing
+        job_in_use = any(blob.name in referenced for blob in blobs)
+        job_doomed = []
+        for blob in blobs:
+            if blob.name in referenced:
+                continue
+            if job is None and (blob.updated is None or blob.updated > cutoff):
+                continue
+            if job_in_use and blob.name.endswith("/grid.png"):
+                continue
+            job_doomed.append((blob, "orphaned_job" if job is None else "superseded_job"))
+        if job is not None and job_doomed:
+            updates.append((job_id, job_cleanup(job, {blob.name for blob, _ in job_doomed}, datetime.now(timezone.utc))))
+        doomed.extend(job_doomed)
+
+    # Job documents first: if a delete then fails, the blob is only orphaned and the next run removes it
+    scanned["job_documents"] += len(updates)
+    if not deleter.dry_run:
+        for start in range(0, len(updates), JOB_UPDATE_BATCH_SIZE):
+            batch = db.batch()
+            for job_id, update in updates[start:start + JOB_UPDATE_BATCH_SIZE]:
+                batch.update(db.collection("jobs").document(job_id), update)
+            batch.commit()
+    for blob, reason in doomed:
+        deleter.add(blob, reason)
+
+def collect_job_artifacts(db, bucket: storage.Bucket, deleter: Deleter, cutoff: datetime, scanned: Counter) -> None:
+    # Listing is ordered by name, so each user's blobs arrive together
+    current_user = None
+    blobs_by_job: dict[str, list] = {}
+    for blob in bucket.list_blobs(prefix="users/", fields=LIST_FIELDS):
+        scanned["job_blobs"] += 1
+        parts = blob.name.split("/")
+        if len(parts) < 5 or parts[2] != "jobs":
+            continue
+        user_id, job_id = parts[1], parts[3]
+        if user_id != current_user:
+            if current_user is not None:
+                collect_user(db, deleter, current_user, blobs_by_job, cutoff, scanned)
+                scanned["users"] += 1
+            current_user, blobs_by_job = user_id, {}
+        blobs_by_job.setdefault(job_id, []).append(blob)
+    if current_user is not None:
+        collect_user(db, deleter, current_user, blobs_by_job, cutoff, scanned)
+        scanned["users"] += 1
+
+def active_upload_dirs(db) -> set[str]:
+    """
+    temp/uploads/{digest}/ directories that queued jobs will still read.
+    """
+    dirs = set()
+    for snapshot in db.collection("generation_queue").select(["payload.image_uri"]).stream():
+        image_uri = ((snapshot.to_dict() or {}).get("payload") or {}).get("image_uri") or ""
+        path = image_uri.split("/", 3)[-1] if image_uri.startswith("gs://") else image_uri
+        if path.startswith(UPLOAD_PREFIX):
+            dirs.add(path.rsplit("/", 1)[0] + "/")
+    return dirs
+
+def last_used(blob) -> datetime | None:
+    """
+    Latest of the blob's last write and the custom time the API sets when a deduplicated upload is reused.
+    """
+    times = [value for value in (blob.updated, blob.custom_time) if value is not None]
+    return max(times) if times else None
+
+def collect_uploads(db, bucket: storage.Bucket, deleter: Deleter, upload_cutoff: datetime, now: datetime, scanned: Counter) -> None:
+    in_use = active_upload_dirs(db)
+    staging_cutoff = now - STAGING_MAX_AGE
+    for blob in bucket.list_blobs(prefix=UPLOAD_PREFIX, fields=LIST_FIELDS):
+        scanned["upload_blobs"] += 1
+        if blob.name.startswith(STAGING_PREFIX):
+            if blob.updated is not None and blob.updated < staging_cutoff:
+                deleter.add(blob, "abandoned_staging")
+            continue
+        if blob.name.rsplit("/", 1)[0] + "/" in in_use:
+            continue
+        used_at = last_used(blob)
+        if used_at is not None and used_at < upload_cutoff:
+            deleter.add(blob, "stale_upload")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--project", default=PROJECT_ID)
+    parser.add_argument("--bucket", default=BUCKET_NAME)
+    parser.add_argument("--delete", action="store_true", help="Actually delete; without it this is a dry run")
+    parser.add_argument("--min-age-hours", type=float, default=24, help="Keep job artifacts changed more recently than this")
+    parser.add_argument("--upload-max-age-hours", type=float, default=24)
+    parser.add_argument("--skip-uploads", action="store_true")
+    parser.add_argument("--skip-jobs", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel batch deletes")
+    parser.add_argument("--max-deletes-per-second", type=float, default=200)
+    args = parser.parse_args()
+    if not args.bucket:
+        raise SystemExit("Pass --bucket or set GCS_BUCKET_NAME")
+
+    db = firestore.Client(project=args.project)
+    client = storage.Client(project=args.project)
+    bucket = client.bucket(args.bucket)
+    deleter = Deleter(client, bucket, dry_run=not args.delete, concurrency=args.concurrency, per_second=args.max_deletes_per_second)
+
+    now = datetime.now(timezone.utc)
+    scanned: Counter = Counter()
+    started = time.monotonic()
+    try:
+        if not args.skip_jobs:
+            collect_job_artifacts(db, bucket, deleter, now - timedelta(hours=args.min_age_hours), scanned)
+        if not args.skip_uploads:
+            collect_uploads(db, bucket, deleter, now - timedelta(hours=args.upload_max_age_hours), now, scanned)
+    finally:
+        deleter.close()
+
+    mode = "Deleted" if args.delete else "Would delete (dry run)"
+    print(
+        f"Scanned {scanned['job_blobs']} job blobs for {scanned['users']} users and "
+        f"{scanned['upload_blobs']} upload blobs in {time.monotonic() - started:.1f}s"
+    )
+    for reason in sorted(deleter.counts):
+        print(f"  {reason}: {deleter.counts[reason]} blobs, {deleter.bytes[reason] / 1024 / 1024:.1f} MB")
+        for name in deleter.samples[reason]:
+            print(f"    e.g. {name}")
+    print(f"{'Cleared' if args.delete else 'Would clear'} artifact references on {scanned['job_documents']} job documents")
+    total = sum(deleter.counts.values())
+    print(f"{mode}: {total} blobs, {sum(deleter.bytes.values()) / 1024 / 1024:.1f} MB")
+    if args.delete:
+        print(f"Deleted {deleter.deleted}, failed {deleter.failed}")
+
+if __name__ == "__main__":
+    main()
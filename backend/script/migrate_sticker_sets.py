@@ -0,0 +1,71 @@
+"""
+Move current sticker sets from users/{id} into sticker_sets/{id}.
+
+The API already reads sticker sets left on the user document, so this can run
+while the service is live. Users that already have a sticker_sets document
+keep it (it is newer); the legacy fields are removed from every user. Each
+user is moved in its own transaction.
+
+    python script/migrate_sticker_sets.py --project skitkerline [--dry-run]
+"""
+import argparse
+from datetime import datetime, timezone
+from google.cloud import firestore
+
+PROJECT_ID = "skitkerline"
+LEGACY_FIELDS = ["current_stickers", "current_stickers_job_id", "current_stickers_archive_blob", "current_stickers_updated_at"]
+
+def migrate_user(db, user_ref, dry_run: bool) -> bool:
+    """
+    Move one user's sticker set in a transaction, so a set the API writes meanwhile is never overwritten.
+    Returns whether a sticker_sets document was created.
+    """
+    sticker_ref = db.collection("sticker_sets").document(user_ref.id)
+
+    @firestore.transactional
+    def move(transaction) -> bool:
+        user = user_ref.get(field_paths=LEGACY_FIELDS, transaction=transaction)
+        sticker_set = sticker_ref.get(field_paths=["updated_at"], transaction=transaction)
+        data = (user.to_dict() or {}) if user.exists else {}
+        if not any(field in data for field in LEGACY_FIELDS):
+            return False
+        created = not sticker_set.exists
+        if dry_run:
+            return created
+        if created:
+            transaction.create(sticker_ref, {
+                "user_id": user_ref.id,
+                "slots": data.get("current_stickers") or [],
+                "job_id": data.get("current_stickers_job_id"),
+                "archive_blob": data.get("current_stickers_archive_blob"),
+                "updated_at": data.get("current_stickers_updated_at") or datetime.now(timezone.utc),
+            })
+        transaction.update(user_ref, {field: firestore.DELETE_FIELD for field in LEGACY_FIELDS})
+        return created
+
+    return move(db.transaction(read_only=dry_run))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--project", default=PROJECT_ID)
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    db = firestore.Client(project=args.project)
+    users = db.collection("users").select(LEGACY_FIELDS)
+    moved = cleaned = failed = 0
+    for snapshot in users.stream():
+        if not any(field in (snapshot.to_dict() or {}) for field in LEGACY_FIELDS):
+            continue
+        try:
+            moved += migrate_user(db, snapshot.reference, args.dry_run)
+            cleaned += 1
+        except Exception as e:
+            print(f"Failed to migrate {snapshot.id}: {e}")
+            failed += 1
+
+    prefix = "[dry run] " if args.dry_run else ""
+    print(f"{prefix}Moved {moved} sticker sets, removed legacy fields from {cleaned} users, {failed} failed (rerun to retry)")
+
+if __name__ == "__main__":
+    main()
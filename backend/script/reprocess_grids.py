@@ -0,0 +1,391 @@
+"""
+Regenerate stickers from stored grids after ImageProcessor changes.
+
+Streams completed jobs that have a grid.png, downloads the grids on a thread
+pool and slices them on a process pool of ImageProcessor workers, so a new
+image pipeline can be applied without new AI calls. Stickers are written next
+to the originals under a version prefix (users/{uid}/jobs/{job_id}/{version}/
+{i}.png) and recorded on the job as sticker_versions.{version}. With --promote,
+the job's result_slots and any sticker set that shows its stickers (also sets
+still stored on the user document) are switched to the new blobs; their
+pre-built ZIPs are dropped and rebuilt on download. Without it the new blobs
+are only recorded, and gc_artifacts.py removes them like any unused sticker.
+
+A checkpoint file records the last job every earlier job was handled up to,
+plus the jobs that failed; rerunning the same command resumes from it and
+retries the failures first. Jobs that already have the version are skipped.
+
+    cd backend
+    python -m script.reprocess_grids --version v2 [--workers 8] [--promote] [--limit 100]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from google.api_core.exceptions import NotFound
+from google.cloud import firestore, storage
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+PROJECT_ID = "skitkerline"
+BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME", "")
+
+VERSION_PATTERN = re.compile(r"^[a-z0-9_]+$")
+STICKERS_PER_GRID = 16
+
+_processor = None
+
+def init_worker(warm_up: bool) -> None:
+    """
+    Runs once in each pool process: one ImageProcessor (and matting session) per process.
+    """
+    global _processor
+    from app.services import image_service
+
+    # The pool already uses every core; threaded OpenCV inside each process only adds contention
+    image_service.cv2.setNumThreads(1)
+    _processor = image_service.ImageProcessor()
+    if warm_up:
+        image_service.warm_up_matting()
+
+def process_grid(grid_bytes: bytes) -> list[bytes]:
+    return _processor.process_sticker_grid(grid_bytes)
+
+def load_checkpoint(path: str, version: str) -> dict:
+    if not os.path.exists(path):
+        return {"version": version, "cursor": None, "counts": {}, "failed": {}}
+    with open(path, encoding="utf-8") as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    if checkpoint.get("version") != version:
+        raise SystemExit(f"{path} belongs to version {checkpoint.get('version')}; pass another --checkpoint")
+    return checkpoint
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file, indent=2)
+    os.replace(tmp_path, path)
+
+def sticker_blob(user_id: str, job_id: str, index: int, version: str | None = None) -> str:
+    prefix = f"users/{user_id}/jobs/{job_id}"
+    return f"{prefix}/{version}/{index}.png" if version else f"{prefix}/{index}.png"
+
+class Progress:
+    """
+    Counts and per-stage time, printed every few seconds while the run goes on.
+    """
+    def __init__(self, counts: dict):
+        self.counts: Counter = Counter()
+        # Totals from earlier runs, only for the final summary
+        self.previous = Counter(counts)
+        self.stage_seconds: Counter = Counter()
+        self.grid_bytes = 0
+        self.started = time.monotonic()
+
+    def line(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        done = self.counts["reprocessed"]
+        stages = ", ".join(
+            f"{stage} {self.stage_seconds[stage] / done * 1000:.0f}ms" for stage in ("download", "process", "upload")
+        ) if done else "no jobs finished yet"
+        return (
+            f"{done} reprocessed ({done / elapsed:.2f} grids/s, {done * STICKERS_PER_GRID / elapsed:.1f} stickers/s, "
+            f"{self.grid_bytes / elapsed / 1024 / 1024:.1f} MB/s down), {self.counts['skipped']} skipped, "
+            f"{self.counts['failed']} failed; per grid: {stages}"
+        )
+
+class Reprocessor:
+    def __init__(self, db, bucket, args, checkpoint: dict):
+        self.db = db
+        self.bucket = bucket
+        self.args = args
+        self.version = args.version
+        self.checkpoint = checkpoint
+        self.progress = Progress(checkpoint["counts"])
+        self.io_pool = ThreadPoolExecutor(max_workers=args.io_concurrency)
+        # The parent holds gRPC channels, which do not survive fork
+        self.process_pool = ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(not args.no_warm_up,),
+        )
+        # Stream order of jobs in flight; the checkpoint cursor only moves past a finished prefix
+        self.in_flight: OrderedDict[str, bool] = OrderedDict()
+        self.slots = asyncio.Semaphore(args.workers * 2)
+        self.tasks: set[asyncio.Task] = set()
+        # Set when the process pool breaks; no new work is started after it
+        self.fatal: BrokenProcessPool | None = None
+        self.last_saved = time.monotonic()
+        self.last_reported = time.monotonic()
+
+    def manifest_fields(self) -> list[str]:
+        return ["user_id", "grid_blob", "status", f"sticker_versions.{self.version}.processed_at"]
+
+    def fetch_page(self, cursor: str | None, page_size: int) -> list:
+        query = self.db.collection("jobs").select(self.manifest_fields()).where(filter=FieldFilter("status", "==", "completed"))
+        if self.args.user:
+            query = query.where(filter=FieldFilter("user_id", "==", self.args.user))
+        query = query.order_by("__name__").limit(page_size)
+        if cursor is not None:
+            query = query.start_after({"__name__": cursor})
+        return list(query.stream())
+
+    def fetch_jobs(self, job_ids: list[str]) -> list:
+        refs = [self.db.collection("jobs").document(job_id) for job_id in job_ids]
+        return [snapshot for snapshot in self.db.get_all(refs, field_paths=self.manifest_fields()) if snapshot.exists]
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        remaining = self.args.limit
+
+        # Failures from earlier runs first; they are behind the cursor and would never come round again
+        retry = list(self.checkpoint["failed"])
+        if retry:
+            print(f"Retrying {len(retry)} jobs that failed before")
+            snapshots = await loop.run_in_executor(self.io_pool, self.fetch_jobs, retry)
+            for job_id in set(retry) - {snapshot.id for snapshot in snapshots}:
+                self.checkpoint["failed"].pop(job_id, None)
+            for snapshot in snapshots:
+                if self.fatal or (remaining is not None and remaining <= 0):
+                    break
+                if await self.submit(snapshot, track=False):
+                    remaining = None if remaining is None else remaining - 1
+
+        cursor = self.checkpoint["cursor"]
+        while not self.fatal and (remaining is None or remaining > 0):
+            page = await loop.run_in_executor(self.io_pool, self.fetch_page, cursor, self.args.page_size)
+            for snapshot in page:
+                if self.fatal or (remaining is not None and remaining <= 0):
+                    break
+                if await self.submit(snapshot, track=True):
+                    remaining = None if remaining is None else remaining - 1
+            if len(page) < self.args.page_size:
+                break
+            cursor = page[-1].id
+
+        if self.tasks:
+            await asyncio.gather(*self.tasks)
+        if self.fatal:
+            raise self.fatal
+
+    async def submit(self, snapshot, track: bool) -> bool:
+        """
+        Start one job unless it is already done. Returns whether a grid is being reprocessed.
+        """
+        data = snapshot.to_dict() or {}
+        done = (data.get("sticker_versions") or {}).get(self.version) and not self.args.force
+        if done or not data.get("grid_blob") or not data.get("user_id"):
+            self.progress.counts["skipped"] += 1
+            if track:
+                self.in_flight[snapshot.id] = True
+                self.advance()
+            else:
+                self.checkpoint["failed"].pop(snapshot.id, None)
+            return False
+
+        await self.slots.acquire()
+        if self.fatal:
+            self.slots.release()
+            return False
+        if track:
+            self.in_flight[snapshot.id] = False
+        task = asyncio.create_task(self.handle(snapshot.id, data, track))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return True
+
+    async def handle(self, job_id: str, data: dict, track: bool) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            started = time.monotonic()
+            try:
+                grid_bytes = await loop.run_in_executor(self.io_pool, self.download, data["grid_blob"])
+            except NotFound:
+                # Grid already collected; nothing to reprocess
+                grid_bytes = None
+            if grid_bytes is None:
+                self.progress.counts["skipped"] += 1
+            else:
+                downloaded = time.monotonic()
+                stickers = await loop.run_in_executor(self.process_pool, process_grid, grid_bytes)
+                if len(stickers) != STICKERS_PER_GRID:
+                    raise ValueError(f"expected {STICKERS_PER_GRID} stickers, got {len(stickers)}")
+                processed = time.monotonic()
+                await loop.run_in_executor(self.io_pool, self.store, job_id, data["user_id"], stickers)
+
+                self.progress.grid_bytes += len(grid_bytes)
+                self.progress.stage_seconds["download"] += downloaded - started
+                self.progress.stage_seconds["process"] += processed - downloaded
+                self.progress.stage_seconds["upload"] += time.monotonic() - processed
+                self.progress.counts["reprocessed"] += 1
+            self.checkpoint["failed"].pop(job_id, None)
+        except BrokenProcessPool as e:
+            # A worker died (usually out of memory); every later job would fail the same way.
+            # The job is recorded as failed so the next run retries it, and run() stops.
+            self.fatal = self.fatal or e
+            self.progress.counts["failed"] += 1
+            self.checkpoint["failed"][job_id] = f"process pool broken: {e}"[:500]
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self.progress.counts["failed"] += 1
+            self.checkpoint["failed"][job_id] = str(e)[:500]
+        finally:
+            self.slots.release()
+        # Not reached when the run is interrupted, so an unfinished job holds the cursor back
+        if track:
+            self.in_flight[job_id] = True
+            self.advance()
+
+    def download(self, blob_name: str) -> bytes:
+        return self.bucket.blob(blob_name).download_as_bytes()
+
+    def store(self, job_id: str, user_id: str, stickers: list[bytes]) -> None:
+        slots = []
+        for index, sticker_bytes in enumerate(stickers):
+            blob_name = sticker_blob(user_id, job_id, index, self.version)
+            if not self.args.dry_run:
+                self.bucket.blob(blob_name).upload_from_string(sticker_bytes, content_type="image/png")
+            slots.append({"index": index, "blob_name": blob_name})
+        if self.args.dry_run:
+            return
+        self.db.collection("jobs").document(job_id).update({
+            f"sticker_versions.{self.version}": {"slots": slots, "processed_at": firestore.SERVER_TIMESTAMP},
+        })
+        if self.args.promote:
+            self.promote(job_id, user_id)
+
+    def promote(self, job_id: str, user_id: str) -> None:
+        """
+        Switch this job's stickers to the new blobs: in the job's own result_slots and
+        wherever the user's sticker set shows one, including slots locked from it into
+        later sets. Pre-built ZIPs of both are dropped. Users not yet migrated to
+        sticker_sets are updated in the legacy fields on their user document.
+        """
+        replacements = {
+            sticker_blob(user_id, job_id, index): sticker_blob(user_id, job_id, index, self.version)
+            for index in range(STICKERS_PER_GRID)
+        }
+        job_ref = self.db.collection("jobs").document(job_id)
+        sticker_ref = self.db.collection("sticker_sets").document(user_id)
+        user_ref = self.db.collection("users").document(user_id)
+
+        def replace(slots: list) -> bool:
+            changed = False
+            for slot in slots:
+                if isinstance(slot, dict) and slot.get("blob_name") in replacements:
+                    slot["blob_name"] = replacements[slot["blob_name"]]
+                    changed = True
+            return changed
+
+        @firestore.transactional
+        def swap(transaction) -> bool:
+            job = job_ref.get(field_paths=["result_slots"], transaction=transaction)
+            sticker_set = sticker_ref.get(field_paths=["slots"], transaction=transaction)
+            user = None if sticker_set.exists else user_ref.get(field_paths=["current_stickers"], transaction=transaction)
+
+            job_slots = (job.to_dict() or {}).get("result_slots") or []
+            replace(job_slots)
+            transaction.update(job_ref, {"result_slots": job_slots, "archive_blob": None})
+
+            if sticker_set.exists:
+                slots = (sticker_set.to_dict() or {}).get("slots") or []
+                if not replace(slots):
+                    return False
+                transaction.update(sticker_ref, {
+                    "slots": slots,
+                    "archive_blob": None,
+                    "updated_at": firestore.SERVER_TIMESTAMP,
+                })
+                return True
+            slots = ((user.to_dict() or {}).get("current_stickers") or []) if user.exists else []
+            if not replace(slots):
+                return False
+            transaction.update(user_ref, {
+                "current_stickers": slots,
+                "current_stickers_archive_blob": None,
+                "current_stickers_updated_at": firestore.SERVER_TIMESTAMP,
+            })
+            return True
+
+        if swap(self.db.transaction()):
+            self.progress.counts["promoted"] += 1
+
+    def advance(self) -> None:
+        while self.in_flight:
+            job_id, done = next(iter(self.in_flight.items()))
+            if not done:
+                break
+            self.in_flight.popitem(last=False)
+            self.checkpoint["cursor"] = job_id
+        now = time.monotonic()
+        if now - self.last_saved >= self.args.checkpoint_seconds:
+            self.save()
+        if now - self.last_reported >= self.args.report_seconds:
+            self.last_reported = now
+            print(self.progress.line())
+
+    def save(self) -> None:
+        self.last_saved = time.monotonic()
+        if self.args.dry_run:
+            return
+        counts = self.progress.previous + self.progress.counts
+        save_checkpoint(self.args.checkpoint, {**self.checkpoint, "counts": dict(counts)})
+
+    def close(self) -> None:
+        self.save()
+        self.process_pool.shutdown(cancel_futures=True)
+        self.io_pool.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--project", default=PROJECT_ID)
+    parser.add_argument("--bucket", default=BUCKET_NAME)
+    parser.add_argument("--version", required=True, help="Name of the new sticker version, e.g. v2 (lowercase letters, digits, _)")
+    parser.add_argument("--promote", action="store_true", help="Switch sticker sets showing these jobs to the new stickers")
+    parser.add_argument("--user", help="Only reprocess this user's jobs")
+    parser.add_argument("--limit", type=int, help="Stop after starting this many grids")
+    parser.add_argument("--force", action="store_true", help="Reprocess jobs that already have this version")
+    parser.add_argument("--dry-run", action="store_true", help="Download and process, but write nothing")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ImageProcessor processes")
+    parser.add_argument("--io-concurrency", type=int, default=16, help="Parallel grid downloads and sticker uploads")
+    parser.add_argument("--no-warm-up", action="store_true", help="Skip loading the matting model when a worker starts")
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: reprocess-<version>.json)")
+    parser.add_argument("--checkpoint-seconds", type=float, default=10)
+    parser.add_argument("--report-seconds", type=float, default=10)
+    args = parser.parse_args()
+    if not args.bucket:
+        raise SystemExit("Pass --bucket or set GCS_BUCKET_NAME")
+    if not VERSION_PATTERN.match(args.version):
+        raise SystemExit("--version may only contain lowercase letters, digits and _")
+    args.checkpoint = args.checkpoint or f"reprocess-{args.version}.json"
+
+    checkpoint = load_checkpoint(args.checkpoint, args.version)
+    if checkpoint["cursor"]:
+        print(f"Resuming after job {checkpoint['cursor']} ({len(checkpoint['failed'])} failed jobs to retry)")
+    db = firestore.Client(project=args.project)
+    bucket = storage.Client(project=args.project).bucket(args.bucket)
+    reprocessor = Reprocessor(db, bucket, args, checkpoint)
+    try:
+        asyncio.run(reprocessor.run())
+    except KeyboardInterrupt:
+        print("Interrupted; rerun the same command to resume")
+    except BrokenProcessPool as e:
+        print(f"Stopped: an image worker died ({e}); lower --workers if it ran out of memory, then rerun to resume")
+    finally:
+        reprocessor.close()
+
+    print(f"{'Dry run: ' if args.dry_run else ''}{reprocessor.progress.line()}, {reprocessor.progress.counts['promoted']} sticker sets promoted")
+    if reprocessor.checkpoint["failed"]:
+        print(f"{len(reprocessor.checkpoint['failed'])} jobs failed; rerun to retry them (details in {args.checkpoint})")
+    if reprocessor.fatal:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Seed Firestore with realistic bulk data for capacity testing.
+
+Creates users with their sticker sets, generation jobs, payments and top-up
+transactions, shaped like the documents the API writes. Writes go through a
+BulkWriter, which batches and rate-limits them.
+
+The fake payments and top-ups would show up as revenue in analytics, so it
+only runs against the emulator (FIRESTORE_EMULATOR_HOST=localhost:8080)
+unless --i-know-this-is-prod is passed. --project is always required.
+
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python script/seed_bulk.py --project skitkerline-test --users 20000 [--seed 1]
+
+The same --seed produces the same IDs, so a rerun overwrites the previous data
+instead of adding to it.
+"""
+import argparse
+import os
+import random
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+
+# Share of users by lifetime spend; tier thresholds follow PRIORITY_PREMIUM_MIN_SPENT_THB (300)
+SEGMENTS = [("free", 0.70), ("paid", 0.25), ("premium", 0.05)]
+PACKAGES = [("pkg_70", 7000, 7, 0.55), ("pkg_100", 10000, 12, 0.45)]
+JOB_STATUSES = [("completed", 0.92), ("failed", 0.05), ("cancelled", 0.02), ("timed_out", 0.01)]
+JOB_ERRORS = {
+    "failed": "Sticker generation failed. Please try again.",
+    "cancelled": "Job was cancelled.",
+    "timed_out": "Job did not finish before its deadline.",
+}
+# Payments per user by segment (min, max); abandoned QR codes stay "pending"
+PAYMENTS_PER_USER = {"free": (0, 0), "paid": (1, 3), "premium": (5, 14)}
+ABANDONED_PAYMENT_RATE = 0.3
+FREE_COINS = 2
+# BulkWriter retries a failed write this many times before giving up on it
+MAX_WRITE_ATTEMPTS = 5
+
+def pick(rng: random.Random, weighted: list[tuple]) -> tuple:
+    return rng.choices(weighted, weights=[item[-1] for item in weighted])[0]
+
+def random_id(rng: random.Random) -> str:
+    return uuid.UUID(int=rng.getrandbits(128)).hex
+
+def random_time(rng: random.Random, start: datetime, end: datetime) -> datetime:
+    return start + (end - start) * rng.random()
+
+def make_user(rng: random.Random, index: int, now: datetime, days: int) -> dict:
+    created_at = random_time(rng, now - timedelta(days=days), now)
+    return {
+        "line_id": f"U{random_id(rng)}",
+        "display_name": f"Load Test {index}",
+        "picture_url": None,
+        "coin_balance": FREE_COINS,
+        "total_spent_thb": 0.0,
+        "is_free_trial_used": True,
+        "created_at": created_at,
+        "updated_at": created_at,
+    }
+
+def make_payments(rng: random.Random, user: dict, segment: str, now: datetime) -> list[dict]:
+    low, high = PAYMENTS_PER_USER[segment]
+    # Five 70 THB packages already cross the 300 THB premium threshold
+    count = rng.randint(low, high)
+    payments = []
+    for _ in range(count + (1 if rng.random() < ABANDONED_PAYMENT_RATE else 0)):
+        package_id, amount_satang, coins, _ = pick(rng, PACKAGES)
+        created_at = random_time(rng, user["created_at"], now)
+        payments.append({
+            "charge_id": f"chrg_test_{random_id(rng)[:20]}",
+            "user_id": user["line_id"],
+            "package_id": package_id,
+            "amount_satang": amount_satang,
+            "thb_amount": amount_satang / 100.0,
+            "coins": coins,
+            "status": "success" if len(payments) < count else "pending",
+            "qr_image_url": None,
+            "expires_at": (created_at + timedelta(hours=24)).isoformat(),
+            "created_at": created_at,
+            "updated_at": created_at + timedelta(seconds=rng.randint(20, 300)),
+        })
+    return payments
+
+def make_jobs(rng: random.Random, user: dict, segment: str, coins: int, now: datetime) -> list[dict]:
+    # Most users spend nearly all their coins; failed/cancelled/timed-out jobs are refunded
+    jobs = []
+    charged = 0
+    target = coins - rng.choice([0, 0, 0, 1, 2])
+    while charged < target:
+        status = pick(rng, JOB_STATUSES)[0]
+        created_at = random_time(rng, user["created_at"], now)
+        duration = max(8.0, rng.gauss(45, 15))
+        job_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        job = {
+            "job_id": job_id,
+            "user_id": user["line_id"],
+            "status": status,
+            "tier": segment,
+            "deadline": created_at + timedelta(seconds=900),
+            "created_at": created_at,
+            "updated_at": created_at + timedelta(seconds=duration),
+        }
+        if status == "completed":
+            charged += 1
+            job["grid_blob"] = f"users/{user['line_id']}/jobs/{job_id}/grid.png"
+            job["result_slots"] = [
+                {"index": index, "blob_name": f"users/{user['line_id']}/jobs/{job_id}/{index}.png", "locked": False}
+                for index in range(16)
+            ]
+            job["archive_blob"] = f"users/{user['line_id']}/jobs/{job_id}/stickers.zip"
+            job["stage_timings_ms"] = {
+                "job.ai_generate": round(duration * 800),
+                "job.image_processing": round(duration * 150),
+                "job.total": round(duration * 1000),
+            }
+        else:
+            job["error"] = JOB_ERRORS[status]
+        jobs.append(job)
+    return jobs
+
+def seed_user(writer, db, rng: random.Random, index: int, now: datetime, days: int, counts: Counter) -> None:
+    segment = pick(rng, SEGMENTS)[0]
+    user = make_user(rng, index, now, days)
+    payments = make_payments(rng, user, segment, now)
+
+    coins = FREE_COINS
+    for payment in payments:
+        writer.set(db.collection("payments").document(payment["charge_id"]), payment)
+        counts["payments"] += 1
+        if payment["status"] != "success":
+            continue
+        coins += payment["coins"]
+        user["total_spent_thb"] += payment["thb_amount"]
+        # Same ID scheme as UserService.top_up_coin
+        txn_id = f"topup_{payment['charge_id']}"
+        writer.set(db.collection("transactions").document(txn_id), {
+            "txn_id": txn_id,
+            "user_id": user["line_id"],
+            "type": "topup",
+            "amount": payment["coins"],
+            "reference_id": payment["charge_id"],
+            "timestamp": payment["updated_at"],
+        })
+        counts["transactions"] += 1
+
+    jobs = make_jobs(rng, user, segment, coins, now)
+    latest_completed = None
+    for job in jobs:
+        writer.set(db.collection("jobs").document(job["job_id"]), job)
+        counts["jobs"] += 1
+        if job["status"] == "completed" and (latest_completed is None or job["created_at"] > latest_completed["created_at"]):
+            latest_completed = job
+
+    user["coin_balance"] = coins - sum(1 for job in jobs if job["status"] == "completed")
+    user["updated_at"] = max([user["updated_at"]] + [job["updated_at"] for job in jobs] + [p["updated_at"] for p in payments])
+    writer.set(db.collection("users").document(user["line_id"]), user)
+    writer.set(db.collection("sticker_sets").document(user["line_id"]), {
+        "user_id": user["line_id"],
+        "slots": latest_completed["result_slots"] if latest_completed else [],
+        "job_id": latest_completed["job_id"] if latest_completed else None,
+        "archive_blob": latest_completed["archive_blob"] if latest_completed else None,
+        "updated_at": latest_completed["updated_at"] if latest_completed else user["created_at"],
+    })
+    counts["users"] += 1
+    counts[f"users_{segment}"] += 1
+
+def documents_written(counts: Counter) -> int:
+    # Each user also gets a sticker set
+    return counts["users"] * 2 + counts["payments"] + counts["transactions"] + counts["jobs"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--project", required=True)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=180, help="Spread created_at over this many past days")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-ops-per-second", type=int, default=500,
+                        help="BulkWriter ceiling; raise it for the emulator")
+    parser.add_argument("--i-know-this-is-prod", action="store_true",
+                        help="Allow writing to a real project instead of the emulator")
+    args = parser.parse_args()
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST") and not args.i_know_this_is_prod:
+        raise SystemExit(
+            f"Refusing to seed fake users and payments into project {args.project}: "
+            "set FIRESTORE_EMULATOR_HOST, or pass --i-know-this-is-prod"
+        )
+
+    db = firestore.Client(project=args.project)
+    writer = db.bulk_writer(options=BulkWriterOptions(
+        initial_ops_per_second=min(500, args.max_ops_per_second),
+        max_ops_per_second=args.max_ops_per_second,
+    ))
+    failures = []
+
+    def on_write_error(error, _writer) -> bool:
+        if error.attempts < MAX_WRITE_ATTEMPTS:
+            return True
+        failures.append(error)
+        return False
+
+    writer.on_write_error(on_write_error)
+
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    counts: Counter = Counter()
+    started = time.monotonic()
+    for index in range(args.users):
+        seed_user(writer, db, rng, index, now, args.days, counts)
+        if (index + 1) % 1000 == 0:
+            # Keeps the writer's buffer, and so memory, bounded
+            writer.flush()
+            elapsed = time.monotonic() - started
+            print(f"{index + 1}/{args.users} users, {documents_written(counts) / elapsed:.0f} docs/s")
+    writer.close()
+
+    elapsed = time.monotonic() - started
+    documents = documents_written(counts)
+    print(
+        f"Seeded {counts['users']} users ({counts['users_free']} free, {counts['users_paid']} paid, "
+        f"{counts['users_premium']} premium), {counts['jobs']} jobs, {counts['payments']} payments, "
+        f"{counts['transactions']} transactions: {documents} documents in {elapsed:.1f}s "
+        f"({documents / elapsed:.0f} docs/s), {len(failures)} failed writes"
+    )
+
+if __name__ == "__main__":
+    main()
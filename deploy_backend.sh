@@ -6,6 +6,9 @@ REGION="${REGION:-asia-southeast1}"
 REPO="${REPO:-asia-southeast1-docker.pkg.dev/${PROJECT_ID}/stickerline}"
 
 BE_SERVICE="${BE_SERVICE:-stickerline-be}"
+WORKER_SERVICE="${WORKER_SERVICE:-stickerline-worker}"
+# DEPLOY_WORKER=1 runs generation in a separate worker service; otherwise the API runs it in-process
+DEPLOY_WORKER="${DEPLOY_WORKER:-0}"
 RUN_SERVICE_ACCOUNT="${RUN_SERVICE_ACCOUNT:-superadmin@${PROJECT_ID}.iam.gserviceaccount.com}"
 
 GCS_BUCKET_NAME="${GCS_BUCKET_NAME:-}"
@@ -25,6 +28,14 @@ if [[ -z "${GCS_BUCKET_NAME}" || -z "${LIFF_CHANNEL_ID}" ]]; then
   exit 1
 fi
 
+if [[ "${DEPLOY_WORKER}" == "1" ]]; then
+  BE_ROLE="api"
+else
+  BE_ROLE="all"
+fi
+COMMON_ENV_VARS="PROJECT_ID=${PROJECT_ID},GCS_BUCKET_NAME=${GCS_BUCKET_NAME},LIFF_CHANNEL_ID=${LIFF_CHANNEL_ID},VERTEX_MODEL=${VERTEX_MODEL},VERTEX_LOCATION=${VERTEX_LOCATION},GENAI_PROVIDER=${GENAI_PROVIDER},GENAI_FALLBACK_PROVIDER=${GENAI_FALLBACK_PROVIDER},GENAI_FALLBACK_MAX_RETRIES=${GENAI_FALLBACK_MAX_RETRIES},GENERATION_MAX_RETRIES=${GENERATION_MAX_RETRIES},GENERATION_RETRY_BASE_DELAY=${GENERATION_RETRY_BASE_DELAY},GENERATION_CONCURRENCY=${GENERATION_CONCURRENCY},GENERATION_COOLDOWN_SECONDS=${GENERATION_COOLDOWN_SECONDS}"
+SECRETS="GEMINI_API_KEY=gemini_api_key:latest,LINE_CHANNEL_SECRET=line_channel_secret:latest,OMISE_SECRET_KEY=omise_secret_key:latest,OMISE_PUBLIC_KEY=omise_public_key:latest"
+
 GIT_SHA="$(git rev-parse --short HEAD 2>/dev/null || date +%Y%m%d%H%M%S)"
 BE_IMAGE="${REPO}/${BE_SERVICE}:${GIT_SHA}"
 
@@ -44,8 +55,24 @@ gcloud run deploy "${BE_SERVICE}" \
   --image "${BE_IMAGE}" \
   --service-account "${RUN_SERVICE_ACCOUNT}" \
   --no-allow-unauthenticated \
-  --set-env-vars "PROJECT_ID=${PROJECT_ID},GCS_BUCKET_NAME=${GCS_BUCKET_NAME},LIFF_CHANNEL_ID=${LIFF_CHANNEL_ID},VERTEX_MODEL=${VERTEX_MODEL},VERTEX_LOCATION=${VERTEX_LOCATION},GENAI_PROVIDER=${GENAI_PROVIDER},GENAI_FALLBACK_PROVIDER=${GENAI_FALLBACK_PROVIDER},GENAI_FALLBACK_MAX_RETRIES=${GENAI_FALLBACK_MAX_RETRIES},GENERATION_MAX_RETRIES=${GENERATION_MAX_RETRIES},GENERATION_RETRY_BASE_DELAY=${GENERATION_RETRY_BASE_DELAY},GENERATION_CONCURRENCY=${GENERATION_CONCURRENCY},GENERATION_COOLDOWN_SECONDS=${GENERATION_COOLDOWN_SECONDS}" \
-  --set-secrets "GEMINI_API_KEY=gemini_api_key:latest,LINE_CHANNEL_SECRET=line_channel_secret:latest,OMISE_SECRET_KEY=omise_secret_key:latest,OMISE_PUBLIC_KEY=omise_public_key:latest"
+  --set-env-vars "${COMMON_ENV_VARS},PROCESS_ROLE=${BE_ROLE}" \
+  --set-secrets "${SECRETS}"
+
+if [[ "${DEPLOY_WORKER}" == "1" ]]; then
+  echo "==> Deploy Generation Worker (private)"
+  # Same image, worker entry point; CPU stays allocated because jobs run outside request handling
+  gcloud run deploy "${WORKER_SERVICE}" \
+    --project "${PROJECT_ID}" \
+    --region "${REGION}" \
+    --image "${BE_IMAGE}" \
+    --service-account "${RUN_SERVICE_ACCOUNT}" \
+    --no-allow-unauthenticated \
+    --no-cpu-throttling \
+    --min-instances 1 \
+    --memory "${WORKER_MEMORY:-4Gi}" \
+    --set-env-vars "${COMMON_ENV_VARS},PROCESS_ROLE=worker,APP_MODULE=app.worker:app" \
+    --set-secrets "${SECRETS}"
+fi
 
 echo "==> Backend URL:"
 gcloud run services describe "${BE_SERVICE}" --project "${PROJECT_ID}" --region "${REGION}" --format 'value(status.url)'